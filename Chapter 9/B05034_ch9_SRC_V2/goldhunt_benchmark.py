@@ -0,0 +1,954 @@
+"""goldhunt_benchmark
+
+This module compares the run time of the various Gold Hunt optimization
+passes and query backends. Unlike goldhunt_run_master.py (which profiles a
+complete game with cProfile), the functions here time only the part of the
+program that a particular optimization targets, on the same gold field.
+
+This module requires Python 3.9 or later (for the pass-8 and the
+HuntExecutor benchmarks) and NumPy 1.17 or later. It contains supporting
+code for the book, Learning Python Application Development, Packt
+Publishing.
+
+RUNNING THE PROGRAM
+--------------------
+
+        $ python goldhunt_benchmark.py [benchmark_name]
+
+Run it without arguments to execute all the benchmarks.
+
+- See the README file for more information. Or visit python.org for OS
+specific instructions on executing Python from a command prompt.
+
+:copyright: 2016, Ninad Sathaye
+
+:license: The MIT License (MIT) . See LICENSE file for further details.
+"""
+from __future__ import print_function
+import contextlib
+import io
+import itertools
+from multiprocessing.reduction import ForkingPickler
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import timeit
+import tracemalloc
+import numpy as np
+
+from goldhunt_index import ScanIndex, GridIndex, QuadTree, PolarIndex
+from goldhunt_index import SummedAreaTable, KDTree, ScanContext, BandIndex
+from goldhunt_index import partition_slabs
+from goldhunt_pass5 import GoldHunt as GoldHunt5
+from goldhunt_pass6_parallel import GoldHunt as GoldHunt6
+from goldhunt_pass7_indexed import GoldHunt as GoldHunt7
+from goldhunt_pass7_indexed import generate_random_points
+from goldhunt_pass8_parallel import GoldHunt as GoldHunt8
+from goldhunt_pass8_parallel import available_cpus
+from goldhunt_pass7_indexed import generate_random_polar_points, path_centers
+from goldhunt_results import HuntResult
+from goldhunt_field import generate_random_chunks
+from goldhunt_field import generate_random_points_inplace
+from goldhunt_field import generate_seeded_points
+from goldhunt_dynamic import DynamicField
+from goldhunt_io import save_field, load_field, convert_csv
+from goldhunt_cache import FieldCache
+from goldhunt_order import reorder_field
+from goldhunt_shared import SharedField, scan_circles
+from goldhunt_executor import HuntExecutor
+
+# You can change the sample size.
+# WARNING: A large sample size could use a lot of computational
+# resources and could even crash your machine. Choose it carefully
+# depending on your machine configuration!
+field_coins = 2000000
+search_radius = 0.1
+# All the benchmarks use the same (seeded) gold field, so the results of
+# different runs can be compared.
+seed = 0
+
+
+def time_it(label, func, num=1):
+    """Run timeit.timeit for the given function and print the result.
+
+    :param str label: Text printed along with the measured time
+    :param func: The function (without arguments) to be timed
+    :param int num: Number of times the function is executed
+    :return: The best time (in seconds) per execution
+    """
+    t = min(timeit.repeat(func, number=num, repeat=3))/num
+    print("{label:<46} time: {t:.4f} s".format(label=label, t=t))
+    return t
+
+
+def benchmark_grid_index():
+    """Compare pass-5, pass-6 and the GridIndex of pass-7.
+
+    The search part (all the circles) is timed for the pass-5 kernel and
+    the 'grid' backend on one shared field. Pass-6 generates its own field
+    and runs a process pool, so the complete play() is timed for it.
+    """
+    x_list, y_list = generate_seeded_points(seed, 10.0, field_coins)
+    game5 = GoldHunt5(field_coins=field_coins, search_radius=search_radius)
+    game7 = GoldHunt7(field_coins=field_coins, search_radius=search_radius,
+                      query_backend='grid')
+    x_centers = game7.circle_centers()
+
+    def search_pass5():
+        for x_ref in x_centers:
+            game5.x_ref = x_ref
+            game5.find_coins(x_list, y_list)
+
+    index = game7.build_index(x_list, y_list)
+
+    def search_grid():
+        for x_ref in x_centers:
+            game7.x_ref = x_ref
+            game7.find_coins(x_list, y_list, index)
+
+    def play_pass6():
+        game6 = GoldHunt6(field_coins=field_coins, search_radius=search_radius)
+        with contextlib.redirect_stdout(io.StringIO()):
+            game6.play()
+
+    print("Field coins: {0}, circles: {1}".format(field_coins,
+                                                  len(x_centers)))
+    time_it("pass-5 find_coins (all circles)", search_pass5)
+    time_it("pass-6 play (includes generation)", play_pass6)
+    time_it("pass-7 GridIndex build", lambda: game7.build_index(x_list,
+                                                                y_list))
+    time_it("pass-7 grid find_coins (all circles)", search_grid)
+    print("~"*60)
+
+
+def benchmark_band_index():
+    """Compare the pass-7 'scan', 'grid' and 'band' backends.
+
+    The BandIndex gets more attractive as the search radius gets smaller,
+    so the search part is timed for a few radii on the same field.
+    """
+    x_list, y_list = generate_seeded_points(seed, 10.0, field_coins)
+    for radius in (1.0, search_radius, search_radius/10.0):
+        print("Field coins: {0}, search radius: {1}".format(field_coins,
+                                                            radius))
+        for backend in ('scan', 'grid', 'band'):
+            game = GoldHunt7(field_coins=field_coins, search_radius=radius,
+                             query_backend=backend)
+            x_centers = game.circle_centers()
+            index = game.build_index(x_list, y_list)
+
+            def search():
+                for x_ref in x_centers:
+                    game.x_ref = x_ref
+                    game.find_coins(x_list, y_list, index)
+
+            time_it("pass-7 {0} find_coins ({1} circles)".format(
+                backend, len(x_centers)), search)
+        print("~"*60)
+
+
+def benchmark_assign():
+    """Compare the single pass 'assign' backend with pass-6 and 'grid'.
+
+    The complete search (all circles, results as coin index arrays) is
+    timed for the pass-7 backends. Pass-6 play() is timed as a whole.
+    """
+    x_list, y_list = generate_seeded_points(seed, 10.0, field_coins)
+    print("Field coins: {0}".format(field_coins))
+    for backend in ('scan', 'grid', 'assign'):
+        game = GoldHunt7(field_coins=field_coins, search_radius=search_radius,
+                         query_backend=backend)
+        x_centers = game.circle_centers()
+        time_it("pass-7 {0} search_circles ({1} circles)".format(
+            backend, len(x_centers)),
+            lambda: game.search_circles(x_list, y_list, x_centers))
+
+    def play_pass6():
+        game6 = GoldHunt6(field_coins=field_coins, search_radius=search_radius)
+        with contextlib.redirect_stdout(io.StringIO()):
+            game6.play()
+
+    time_it("pass-6 play (includes generation)", play_pass6)
+    print("~"*60)
+
+
+def benchmark_query_many():
+    """Compare the pass-5 enumerate loop with the batched query_many kernel.
+
+    The batched kernel is timed for a few memory budgets, with the same
+    circles as the pass-5 loop and with random circles of random radii.
+    """
+    x_list, y_list = generate_seeded_points(seed, 10.0, field_coins)
+    game5 = GoldHunt5(field_coins=field_coins, search_radius=search_radius)
+    game7 = GoldHunt7(field_coins=field_coins, search_radius=search_radius)
+    x_centers = game7.circle_centers()
+    centers = [(x_ref, game7.y_ref) for x_ref in x_centers]
+
+    def search_pass5():
+        for x_ref in x_centers:
+            game5.x_ref = x_ref
+            game5.find_coins(x_list, y_list)
+
+    print("Field coins: {0}, circles: {1}".format(field_coins,
+                                                  len(x_centers)))
+    time_it("pass-5 find_coins (all circles)", search_pass5)
+    for budget in (1, 16, 256):
+        game7.query_block_bytes = budget*1024*1024
+        time_it("pass-7 query_many ({0} MB blocks)".format(budget),
+                lambda: game7.query_many(x_list, y_list, centers,
+                                         search_radius))
+
+    random_centers = np.random.uniform(-10.0, 10.0, (len(x_centers), 2))
+    random_radii = np.random.uniform(0.0, 2*search_radius, len(x_centers))
+    time_it("pass-7 query_many (random circles)",
+            lambda: game7.query_many(x_list, y_list, random_centers,
+                                     random_radii))
+    print("~"*60)
+
+
+def benchmark_quadtree():
+    """Compare the pass-5 einsum kernel with the QuadTree count and query.
+
+    Only the number of coins per circle is needed by GoldHunt.play. The
+    QuadTree.count avoids creating the coin arrays, so it is timed
+    separately from QuadTree.query. The comparison is repeated for a few
+    field sizes.
+    """
+    for num_coins in (field_coins//100, field_coins//10, field_coins):
+        x_list, y_list = generate_seeded_points(seed, 10.0, num_coins)
+        game = GoldHunt7(field_coins=num_coins, search_radius=search_radius)
+        x_centers = game.circle_centers()
+        scan = ScanIndex(x_list, y_list)
+        print("Field coins: {0}, circles: {1}".format(num_coins,
+                                                      len(x_centers)))
+        time_it("pass-5 einsum kernel (all circles)",
+                lambda: [scan.query(x_ref, 0.0, search_radius).size
+                         for x_ref in x_centers])
+        tree = QuadTree(x_list, y_list)
+        time_it("QuadTree build", lambda: QuadTree(x_list, y_list))
+        time_it("QuadTree.count (all circles)",
+                lambda: [tree.count(x_ref, 0.0, search_radius)
+                         for x_ref in x_centers])
+        time_it("QuadTree.query (all circles)",
+                lambda: [tree.query(x_ref, 0.0, search_radius)
+                         for x_ref in x_centers])
+        time_it("QuadTree.count (all circles, radius x 10)",
+                lambda: [tree.count(x_ref, 0.0, 10*search_radius)
+                         for x_ref in x_centers])
+        time_it("pass-5 einsum kernel (all circles, radius x 10)",
+                lambda: [scan.query(x_ref, 0.0, 10*search_radius).size
+                         for x_ref in x_centers])
+        print("~"*60)
+
+
+def benchmark_polar_index():
+    """Compare the PolarIndex with the other backends near the boundary.
+
+    Hunters patrol along a circle just inside the field boundary. The
+    circles are thus spread over all the directions around the origin.
+    """
+    theta, radius = generate_random_polar_points(10.0, field_coins)
+    x_list = radius*np.cos(theta)
+    y_list = radius*np.sin(theta)
+    patrol_radius = 10.0 - search_radius
+    angles = np.arange(0.0, 2*np.pi, 2*search_radius/patrol_radius)
+    centers = list(zip((patrol_radius*np.cos(angles)).tolist(),
+                       (patrol_radius*np.sin(angles)).tolist()))
+    print("Field coins: {0}, boundary circles: {1}".format(field_coins,
+                                                           len(centers)))
+    time_it("PolarIndex build (from theta, radius)",
+            lambda: PolarIndex(theta, radius, 100, 629))
+    indices = [('polar', PolarIndex(theta, radius, 100, 629)),
+               ('grid', GridIndex(x_list, y_list, search_radius)),
+               ('quadtree', QuadTree(x_list, y_list)),
+               ('scan', ScanIndex(x_list, y_list))]
+    for name, index in indices:
+        time_it("{0} query (boundary circles)".format(name),
+                lambda: [index.query(x_ref, y_ref, search_radius)
+                         for x_ref, y_ref in centers])
+    print("~"*60)
+
+
+def benchmark_summed_area_table():
+    """Compare the accuracy and speed of the approximate circle counts.
+
+    The exact counts are obtained with the 'assign' backend. For each
+    resolution of the SummedAreaTable, the build time, the time to count
+    all the circles, the errors and the mean width of the error bounds
+    are reported.
+    """
+    x_list, y_list = generate_seeded_points(seed, 10.0, field_coins)
+    game = GoldHunt7(field_coins=field_coins, search_radius=search_radius,
+                     query_backend='assign')
+    x_centers = game.circle_centers()
+    time_it("pass-7 assign search_circles (exact)",
+            lambda: game.search_circles(x_list, y_list, x_centers))
+    exact = np.array([coin_ids.size for coin_ids in
+                      game.search_circles(x_list, y_list, x_centers)])
+    centers = [(x_ref, game.y_ref) for x_ref in x_centers]
+    print("Field coins: {0}, circles: {1}, mean exact count: {2:.1f}".format(
+        field_coins, len(x_centers), exact.mean()))
+    for resolution in (256, 1024, 4096):
+        time_it("SummedAreaTable build ({0} cells/axis)".format(resolution),
+                lambda: SummedAreaTable(x_list, y_list, resolution))
+        table = SummedAreaTable(x_list, y_list, resolution)
+        time_it("SummedAreaTable count_many ({0} cells/axis)".format(
+            resolution), lambda: table.count_many(centers, search_radius))
+        estimate, lower, upper = table.count_many(centers, search_radius)
+        error = np.abs(estimate - exact)
+        print("    error: mean {0:.2f}, max {1:.2f}, mean bound width "
+              "{2:.1f}".format(error.mean(), error.max(),
+                               (upper - lower).mean()))
+    print("~"*60)
+
+
+def benchmark_kdtree():
+    """Compare KDTree.nearest with a brute force k nearest coins search.
+
+    The brute force search computes the distance of every coin and picks
+    the k smallest ones with np.argpartition.
+    """
+    x_list, y_list = generate_seeded_points(seed, 10.0, field_coins)
+    centers = np.random.uniform(-10.0, 10.0, (1000, 2))
+    time_it("KDTree build", lambda: KDTree(x_list, y_list))
+    tree = KDTree(x_list, y_list)
+    num_brute = 20
+
+    def brute_force(k):
+        for x_ref, y_ref in centers[:num_brute]:
+            delta_x = x_list - x_ref
+            delta_y = y_list - y_ref
+            dist_squares = delta_x*delta_x + delta_y*delta_y
+            nearest = np.argpartition(dist_squares, k)[:k]
+            nearest[np.argsort(dist_squares[nearest])]
+
+    print("Field coins: {0}".format(field_coins))
+    for k in (1, 10, 100):
+        t = time_it("brute force, k={0} ({1} units)".format(k, num_brute),
+                    lambda: brute_force(k))
+        print("    per unit: {0:.2e} s".format(t/num_brute))
+        t = time_it("KDTree.nearest, k={0} ({1} units)".format(
+            k, len(centers)), lambda: tree.nearest(centers, k))
+        print("    per unit: {0:.2e} s".format(t/len(centers)))
+    print("~"*60)
+
+
+def benchmark_radius_sweep():
+    """Compare GoldHunt.radius_sweep with one hunt per candidate radius.
+
+    The 'one hunt per radius' runs regenerate the field (as re-running
+    GoldHunt.play does) and use the 'assign' backend, the fastest exact one.
+    The radius vs yield curve of the sweep is printed at the end.
+    """
+    radii = np.linspace(0.05, 1.0, 20)
+    x_list, y_list = generate_seeded_points(seed, 10.0, field_coins)
+    game = GoldHunt7(field_coins=field_coins)
+
+    def one_hunt_per_radius():
+        for radius in radii:
+            hunt = GoldHunt7(field_coins=field_coins, search_radius=radius,
+                             query_backend='assign')
+            x_field, y_field = generate_random_points(10.0, field_coins)
+            hunt.search_circles(x_field, y_field, hunt.circle_centers())
+
+    print("Field coins: {0}, radii: {1}".format(field_coins, radii.size))
+    time_it("one hunt per radius (regenerate + assign)",
+            one_hunt_per_radius)
+    time_it("radius_sweep (one field)",
+            lambda: game.radius_sweep(x_list, y_list, radii))
+    totals, counts_per_circle = game.radius_sweep(x_list, y_list, radii)
+    for radius, total, counts in zip(radii, totals, counts_per_circle):
+        print("    radius {0:.3f}: circles {1:3d}, yield {2}".format(
+            radius, counts.size, total))
+    print("~"*60)
+
+
+def benchmark_hunt_path():
+    """Compare the pass-6 style merge with hunt_path on overlapping circles.
+
+    The path has a stride much smaller than 2*search_radius, so a coin lies
+    in many circles. The pass-6 style search scans the whole field for
+    every circle and merges the coin lists with itertools.chain (which
+    counts a coin once for each circle it lies in). hunt_path uses an index
+    and a 'collected' mask instead.
+    """
+    x_list, y_list = generate_seeded_points(seed, 10.0, field_coins)
+    waypoints = [(-9.0, 0.0), (-3.0, 6.0), (3.0, -6.0), (9.0, 0.0)]
+    centers = path_centers(waypoints, search_radius/10.0)
+    scan = ScanIndex(x_list, y_list)
+    num_scan = 100
+
+    def pass6_style():
+        output = [list(zip(x_list[coin_ids].tolist(),
+                           y_list[coin_ids].tolist()))
+                  for coin_ids in (scan.query(x_ref, y_ref, search_radius)
+                                   for x_ref, y_ref in centers[:num_scan])]
+        return list(itertools.chain(*output))
+
+    print("Field coins: {0}, circles: {1}".format(field_coins, len(centers)))
+    t = time_it("scan + chain ({0} circles)".format(num_scan), pass6_style)
+    print("    estimated for all circles: {0:.2f} s".format(
+        t*len(centers)/num_scan))
+    print("    coins (with duplicates) in {0} circles: {1}".format(
+        num_scan, len(pass6_style())))
+    for backend in ('grid', 'quadtree', 'kdtree'):
+        game = GoldHunt7(field_coins=field_coins, search_radius=search_radius,
+                         query_backend=backend)
+        time_it("hunt_path {0} ({1} circles)".format(backend, len(centers)),
+                lambda: game.hunt_path(x_list, y_list, centers))
+    new_coins_per_circle, collected = game.hunt_path(x_list, y_list, centers)
+    print("    unique coins collected: {0}".format(
+        np.count_nonzero(collected)))
+    print("~"*60)
+
+
+def benchmark_hunt_result():
+    """Compare lists of (x, y) tuples with HuntResult index arrays.
+
+    Pass-6 converts the coins of every circle to a list of tuples, pickles
+    it back from the worker process and merges the lists with
+    itertools.chain. This benchmark does the same round trip (without the
+    process pool) for the tuple lists and for HuntResult instances, and
+    prints the size of the pickled data.
+    """
+    x_list, y_list = generate_seeded_points(seed, 10.0, field_coins)
+    game = GoldHunt7(field_coins=field_coins, search_radius=1.0,
+                     query_backend='assign')
+    x_centers = game.circle_centers()
+    coins_per_circle = game.search_circles(x_list, y_list, x_centers)
+    # Pretend that every circle was searched by a different worker.
+    results = [HuntResult.from_circles([coin_ids], x_list, y_list)
+               for coin_ids in coins_per_circle]
+
+    def tuple_lists():
+        output = [pickle.loads(pickle.dumps(
+            list(zip(x_list[coin_ids].tolist(), y_list[coin_ids].tolist()))))
+            for coin_ids in coins_per_circle]
+        return list(itertools.chain(*output))
+
+    def index_arrays():
+        output = [pickle.loads(pickle.dumps(result)) for result in results]
+        return HuntResult.concatenate(output)
+
+    print("Field coins: {0}, collected coins: {1}".format(
+        field_coins, len(index_arrays())))
+    time_it("tuple lists + pickle + itertools.chain", tuple_lists)
+    time_it("HuntResult + pickle + np.concatenate", index_arrays)
+    tuple_bytes = sum(len(pickle.dumps(list(zip(
+        x_list[coin_ids].tolist(), y_list[coin_ids].tolist()))))
+        for coin_ids in coins_per_circle)
+    result_bytes = sum(len(pickle.dumps(result)) for result in results)
+    print("    pickled bytes, tuple lists: {0}, HuntResult: {1}".format(
+        tuple_bytes, result_bytes))
+    print("~"*60)
+
+
+def benchmark_float32():
+    """Compare float64 and float32 gold fields.
+
+    The same random numbers (same seed) are used for both the fields. For
+    a few backends, the complete hunt is timed and the difference in the
+    number of collected coins is printed. These coins lie within about
+    1e-6 of a circle boundary.
+    """
+    fields = {}
+    for dtype in (np.float64, np.float32):
+        np.random.seed(0)
+        label = "generate_random_points ({0})".format(np.dtype(dtype).name)
+        time_it(label, lambda: generate_random_points(10.0, field_coins,
+                                                      dtype))
+        np.random.seed(0)
+        fields[dtype] = generate_random_points(10.0, field_coins, dtype)
+        print("    field size: {0:.1f} MB".format(
+            sum(a.nbytes for a in fields[dtype])/1e6))
+    for backend in ('assign', 'grid', 'scan'):
+        game = GoldHunt7(field_coins=field_coins, search_radius=search_radius,
+                         query_backend=backend)
+        x_centers = game.circle_centers()
+        totals = {}
+        for dtype in (np.float64, np.float32):
+            x_list, y_list = fields[dtype]
+            label = "{0} ({1})".format(backend, np.dtype(dtype).name)
+            time_it(label, lambda: game.search_result(x_list, y_list,
+                                                      x_centers))
+            totals[dtype] = len(game.search_result(x_list, y_list, x_centers))
+        print("    collected coins, float64: {0}, float32: {1}".format(
+            totals[np.float64], totals[np.float32]))
+    print("~"*60)
+
+
+def peak_memory(func):
+    """Return the peak memory (in bytes) allocated while running func.
+
+    NumPy reports its array allocations to the tracemalloc module.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_streaming():
+    """Compare the peak memory of a complete and a chunked (streamed) hunt.
+
+    The complete hunt creates the whole field before searching it. The
+    streamed hunt (GoldHunt.stream_counts) generates and searches chunks of
+    chunk_size coins, so its peak memory stays the same for any field size.
+    """
+    chunk_size = 250000
+    game = GoldHunt7(field_coins=field_coins, search_radius=search_radius,
+                     query_backend='assign')
+    x_centers = game.circle_centers()
+
+    def complete_hunt():
+        x_list, y_list = generate_seeded_points(seed, 10.0, field_coins)
+        return game.search_result(x_list, y_list, x_centers).counts()
+
+    def streamed_hunt(num_coins=field_coins):
+        chunks = generate_random_chunks(10.0, num_coins, chunk_size)
+        return game.stream_counts(chunks, x_centers)
+
+    for label, func in (("complete field", complete_hunt),
+                        ("chunked field", streamed_hunt)):
+        time_it(label, func)
+        print("    peak memory: {0:.1f} MB".format(peak_memory(func)/1e6))
+    print("10x the coins (chunk size {0}):".format(chunk_size))
+    time_it("chunked field", lambda: streamed_hunt(10*field_coins))
+    print("    peak memory: {0:.1f} MB".format(
+        peak_memory(lambda: streamed_hunt(10*field_coins))/1e6))
+    print("~"*60)
+
+
+def benchmark_inplace_generation():
+    """Compare the default and the in-place (low peak memory) generation."""
+    output_bytes = 2*8*field_coins
+    print("Field coins: {0}, output size: {1:.1f} MB".format(
+        field_coins, output_bytes/1e6))
+    for label, func in (
+            ("generate_random_points",
+             lambda: generate_random_points(10.0, field_coins)),
+            ("generate_random_points_inplace",
+             lambda: generate_random_points_inplace(10.0, field_coins))):
+        time_it(label, func)
+        print("    peak memory: {0:.1f} MB".format(peak_memory(func)/1e6))
+    print("~"*60)
+
+
+def benchmark_seeded_generation():
+    """Time generate_seeded_points for an increasing number of processes.
+
+    The field is the same for any number of processes. That is verified
+    here as well.
+    """
+    num_coins = 10*field_coins
+    x_list, y_list = generate_seeded_points(seed, 10.0, num_coins)
+    print("Field coins: {0}".format(num_coins))
+    time_it("generate_random_points (global np.random)",
+            lambda: generate_random_points(10.0, num_coins))
+    for processes in (1, 2, 4):
+        time_it("generate_seeded_points ({0} processes)".format(processes),
+                lambda: generate_seeded_points(seed, 10.0, num_coins,
+                                               processes=processes))
+        x_other, y_other = generate_seeded_points(seed, 10.0, num_coins,
+                                                  processes=processes)
+        print("    bit-identical to 1 process:",
+              np.array_equal(x_other, x_list) and
+              np.array_equal(y_other, y_list))
+    print("~"*60)
+
+
+def benchmark_field_cache():
+    """Compare generating the field with reopening it from a FieldCache.
+
+    The first get() call generates and stores the field. The later calls
+    reopen the memory mapped file, with and without the checksum test. A
+    complete 'assign' hunt on the memory mapped field is also timed.
+    """
+    cache = FieldCache()
+    game = GoldHunt7(field_coins=field_coins, search_radius=search_radius,
+                     query_backend='assign')
+    x_centers = game.circle_centers()
+    np.random.seed(0)
+    time_it("generate_random_points", lambda: generate_random_points(
+        10.0, field_coins))
+    cache.get(seed, field_coins, 10.0)
+    time_it("FieldCache.get (verify checksum)", lambda: cache.get(
+        seed, field_coins, 10.0))
+    cache.verify = False
+    time_it("FieldCache.get (size check only)", lambda: cache.get(
+        seed, field_coins, 10.0))
+    x_list, y_list = cache.get(seed, field_coins, 10.0)
+    time_it("assign hunt on the memmap field", lambda: game.search_result(
+        x_list, y_list, x_centers))
+    print("    cache directory:", cache.cache_dir)
+    print("~"*60)
+
+
+def benchmark_dynamic_field():
+    """Compare a static index with a DynamicField for repeated sweeps.
+
+    Several game units sweep the field one after the other, along the same
+    overlapping path. With the static index, every circle examines all its
+    candidate coins and the already collected ones are filtered out with a
+    mask. The DynamicField removes the collected coins from the index, so
+    the later sweeps get cheaper as the field is depleted.
+    """
+    x_list, y_list = generate_seeded_points(seed, 10.0, field_coins)
+    radius = 10*search_radius
+    waypoints = [(-9.0, -6.0), (9.0, -6.0), (9.0, 6.0), (-9.0, 6.0),
+                 (-9.0, -6.0)]
+    centers = path_centers(waypoints, radius/2).tolist()
+    num_units = 5
+
+    def static_index():
+        index = GridIndex(x_list, y_list, radius)
+        collected = np.zeros(field_coins, dtype=bool)
+        for unit in range(num_units):
+            for x_ref, y_ref in centers:
+                coin_ids = index.query(x_ref, y_ref, radius + 0.1*unit)
+                collected[coin_ids[~collected[coin_ids]]] = True
+        return collected
+
+    def dynamic_field():
+        field = DynamicField(x_list, y_list,
+                             lambda x, y: GridIndex(x, y, radius))
+        for unit in range(num_units):
+            for x_ref, y_ref in centers:
+                field.collect(x_ref, y_ref, radius + 0.1*unit)
+        return field
+
+    print("Field coins: {0}, circles: {1} x {2} units".format(
+        field_coins, len(centers), num_units))
+    time_it("static GridIndex + collected mask", static_index)
+    time_it("DynamicField (GridIndex.compact)", dynamic_field)
+    field = dynamic_field()
+    print("    collected: {0}, compactions: {1}, same coins: {2}".format(
+        np.count_nonzero(field.taken), field.num_compactions,
+        np.array_equal(field.taken, static_index())))
+    print("~"*60)
+
+
+def benchmark_field_io():
+    """Time the binary field file format and the CSV import.
+
+    load_field only maps the file, so it is timed alone and together with
+    a complete pass over the coordinates (np.sum). The CSV import is timed
+    for a tenth of the field and the time for the complete field is
+    estimated from it.
+    """
+    x_list, y_list = generate_seeded_points(seed, 10.0, field_coins)
+    tmp_dir = tempfile.mkdtemp(prefix='goldhunt_io_')
+    field_path = os.path.join(tmp_dir, 'field.ghf')
+    csv_path = os.path.join(tmp_dir, 'field.csv')
+    num_csv = field_coins//10
+    np.savetxt(csv_path, np.column_stack((x_list[:num_csv],
+                                          y_list[:num_csv])),
+               delimiter=',', fmt='%.17g')
+    try:
+        time_it("save_field", lambda: save_field(field_path, x_list, y_list))
+        print("    file size: {0:.1f} MB".format(
+            os.path.getsize(field_path)/1e6))
+        time_it("load_field (map only)", lambda: load_field(field_path))
+        time_it("load_field + np.sum", lambda: [
+            np.sum(column) for column in load_field(field_path)[:2]])
+        t = time_it("convert_csv ({0} rows)".format(num_csv),
+                    lambda: convert_csv(csv_path, field_path))
+        print("    estimated for all the coins: {0:.2f} s".format(
+            t*field_coins/num_csv))
+    finally:
+        shutil.rmtree(tmp_dir)
+    print("~"*60)
+
+
+def scratch_bytes(query, circles):
+    """Return the mean temporary memory (in bytes) allocated per query.
+
+    The peak memory traced during each query, less the size of the array
+    returned by it, is the volume of the temporary (scratch) arrays.
+    """
+    total = 0
+    for x_ref, y_ref, radius in circles:
+        tracemalloc.start()
+        try:
+            coin_ids = query(x_ref, y_ref, radius)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        total += max(peak - coin_ids.nbytes, 0)
+    return total/len(circles)
+
+
+def benchmark_scratch_buffers():
+    """Compare the pass-5 find_coins, ScanIndex and ScanContext.
+
+    All the three scan the complete field for every circle. Pass-5 stacks
+    the field with np.dstack for every call, ScanIndex stacks it once but
+    allocates the temporaries for every call, and ScanContext reuses its
+    scratch buffers. The time and the temporary memory per circle are
+    printed.
+    """
+    x_list, y_list = generate_seeded_points(seed, 10.0, field_coins)
+    game5 = GoldHunt5(field_coins=field_coins, search_radius=search_radius)
+    game7 = GoldHunt7(field_coins=field_coins, search_radius=search_radius)
+    circles = [(x_ref, 0.0, search_radius)
+               for x_ref in game7.circle_centers()[:10]]
+    scan = ScanIndex(x_list, y_list)
+    context = ScanContext(x_list, y_list)
+
+    def pass5_query(x_ref, y_ref, radius):
+        game5.x_ref = x_ref
+        return np.array(game5.find_coins(x_list, y_list))
+
+    print("Field coins: {0}, circles: {1}".format(field_coins, len(circles)))
+    for label, query in (("pass-5 find_coins", pass5_query),
+                         ("ScanIndex", scan.query),
+                         ("ScanContext (reused buffers)", context.query)):
+        t = time_it(label, lambda: [
+            query(*circle) for circle in circles])/len(circles)
+        print("    per circle: {0:.4f} s, temporary memory: {1:.1f} MB".format(
+            t, scratch_bytes(query, circles)/1e6))
+    print("~"*60)
+
+
+def benchmark_spatial_order():
+    """Compare the query throughput on a random and a reordered field.
+
+    The same random circles are searched with a GridIndex, a BandIndex and
+    a KDTree built on the field as generated and on the field sorted along
+    the Morton and the Hilbert curves. The time to reorder the field is
+    printed as well.
+    """
+    x_list, y_list = generate_seeded_points(seed, 10.0, field_coins)
+    rng = np.random.RandomState(seed)
+    num_circles = 2000
+    circles = list(zip(rng.uniform(-9.0, 9.0, num_circles).tolist(),
+                       rng.uniform(-9.0, 9.0, num_circles).tolist()))
+    radius = 2*search_radius
+    builders = (('GridIndex', lambda x, y: GridIndex(x, y, radius)),
+                ('BandIndex', BandIndex),
+                ('KDTree', KDTree))
+    fields = [('random', x_list, y_list)]
+    for curve in ('morton', 'hilbert'):
+        time_it("reorder_field ({0})".format(curve),
+                lambda: reorder_field(x_list, y_list, curve))
+        fields.append((curve,) + reorder_field(x_list, y_list, curve)[:2])
+
+    print("Field coins: {0}, circles: {1}".format(field_coins, num_circles))
+    for name, builder in builders:
+        for order, x_field, y_field in fields:
+            index = builder(x_field, y_field)
+            t = time_it("{0} queries, {1} order".format(name, order),
+                        lambda: [index.query(x_ref, y_ref, radius)
+                                 for x_ref, y_ref in circles])
+            print("    {0:.0f} queries/s".format(num_circles/t))
+    print("~"*60)
+
+
+def benchmark_shared_field():
+    """Compare the bytes sent per task by pass-6 and pass-8.
+
+    A task is pickled the way multiprocessing.Pool sends it to a worker
+    (with ForkingPickler). Pass-6 sends the field arrays and the GoldHunt
+    instance with every task, pass-8 only the handle of the shared field.
+    The pickling of all the tasks and the complete parallel search of
+    pass-8 are timed as well.
+    """
+    x_list, y_list = generate_seeded_points(seed, 10.0, field_coins)
+    game6 = GoldHunt6(field_coins=field_coins, search_radius=search_radius)
+    game8 = GoldHunt8(field_coins=field_coins, search_radius=search_radius,
+                      workers=3)
+    x_centers = game8.circle_centers()
+    tasks6 = [(game6.find_coins, (x_list, y_list, x_ref, num), {})
+              for num, x_ref in enumerate(x_centers, 1)]
+
+    def pickle_tasks(tasks):
+        return [ForkingPickler.loads(ForkingPickler.dumps(task))
+                for task in tasks]
+
+    print("Field coins: {0}, circles: {1}".format(field_coins,
+                                                  len(x_centers)))
+    with SharedField(x_list, y_list) as field:
+        tasks8 = [(scan_circles, (task,), {}) for task in
+                  game8.circle_tasks(field.handle, x_centers)]
+        for label, tasks in (("pass-6", tasks6), ("pass-8", tasks8)):
+            print("{0} bytes sent per task: {1}".format(
+                label, len(ForkingPickler.dumps(tasks[0]))))
+            time_it("{0} pickle + unpickle (all tasks)".format(label),
+                    lambda: pickle_tasks(tasks))
+    time_it("pass-8 search_result ({0} processes)".format(game8.workers),
+            lambda: game8.search_result(x_list, y_list, x_centers))
+    print("~"*60)
+
+
+def benchmark_thread_backend():
+    """Compare the serial scan, the thread and the process workers of pass-8.
+
+    The complete search (all the circles) is timed for several field sizes,
+    with one worker per CPU available to this process. The processes pay a
+    fixed start up cost (and the copy of the field to shared memory), the
+    threads pay for the Python code run with the GIL held in every query.
+    With a single CPU, pass-8 falls back to the serial scan, so there is
+    nothing to compare and the benchmark is skipped.
+    """
+    workers = available_cpus()
+    if workers < 2:
+        print("Skipped: only one CPU is available, so the workers would "
+              "all run the serial scan.")
+        print("~"*60)
+        return
+    game7 = GoldHunt7(search_radius=search_radius, query_backend='scan')
+    x_centers = game7.circle_centers()
+    print("Circles: {0}, workers: {1}".format(len(x_centers), workers))
+    for num_coins in (10000, 100000, 1000000, field_coins):
+        x_list, y_list = generate_seeded_points(seed, 10.0, num_coins)
+        print("Field coins:", num_coins)
+        time_it("  serial scan (pass-7)",
+                lambda: game7.search_result(x_list, y_list, x_centers))
+        for backend in ('thread', 'process'):
+            game8 = GoldHunt8(search_radius=search_radius,
+                              parallel_backend=backend, workers=workers)
+            time_it("  {0} workers".format(backend),
+                    lambda: game8.search_result(x_list, y_list, x_centers))
+    print("~"*60)
+
+
+def benchmark_slab_decomposition():
+    """Compare the circle and the slab decomposition of pass-8.
+
+    For both ways to split the work, the number of coin-circle distance
+    tests and the field memory per worker are printed along with the time
+    of the complete parallel search.
+    """
+    x_list, y_list = generate_seeded_points(seed, 10.0, field_coins)
+    workers = 4
+    game8 = GoldHunt8(search_radius=search_radius, workers=workers)
+    x_centers = np.asarray(game8.circle_centers())
+    slab_start, coin_ids = partition_slabs(x_list, workers)
+    slab_tests = 0
+    for k in range(workers):
+        x_slab = x_list[coin_ids[slab_start[k]:slab_start[k + 1]]]
+        num_near = np.count_nonzero(
+            (x_centers + search_radius >= x_slab.min()) &
+            (x_centers - search_radius <= x_slab.max()))
+        slab_tests += x_slab.size*num_near
+    point_bytes = 2*x_list.itemsize
+
+    print("Field coins: {0}, circles: {1}, workers: {2}".format(
+        field_coins, len(x_centers), workers))
+    for decomposition, tests, coins in (
+            ('circle', field_coins*len(x_centers), field_coins),
+            ('slab', slab_tests, np.diff(slab_start).max())):
+        game8.decomposition = decomposition
+        print("{0}: {1} distance tests, field per worker {2:.1f} MB".format(
+            decomposition, tests, coins*point_bytes/1e6))
+        for backend in ('process', 'thread'):
+            game8.parallel_backend = backend
+            time_it("  {0} workers".format(backend),
+                    lambda: game8.search_result(x_list, y_list, x_centers))
+    print("~"*60)
+
+
+def benchmark_adaptive_workers():
+    """Compare the automatic plan of pass-8 with the pass-6 settings.
+
+    For several field sizes, the workers and the circles per task picked
+    by GoldHunt.plan are printed, and the search is timed with them and
+    with 3 processes and one circle per task (as in pass-6). The time of
+    the automatic search includes the calibration run.
+    """
+    game = GoldHunt8(search_radius=search_radius)
+    fixed = GoldHunt8(search_radius=search_radius, workers=3,
+                      circles_per_task=1)
+    x_centers = game.circle_centers()
+    print("Circles: {0}".format(len(x_centers)))
+    for num_coins in (10000, 100000, 1000000, field_coins):
+        x_list, y_list = generate_seeded_points(seed, 10.0, num_coins)
+        print("Field coins: {0}, plan (workers, circles per task): "
+              "{1}".format(num_coins, game.plan(x_list, y_list, x_centers)))
+        time_it("  calibrate", lambda: game.calibrate(x_list, y_list,
+                                                      x_centers))
+        time_it("  automatic plan", lambda: game.search_result(
+            x_list, y_list, x_centers))
+        time_it("  3 processes, 1 circle per task",
+                lambda: fixed.search_result(x_list, y_list, x_centers))
+    print("~"*60)
+
+
+def benchmark_hunt_executor():
+    """Compare a new process pool per hunt with a warm HuntExecutor.
+
+    A service runs many short hunts on the same field. With pass-8 as it
+    is, every hunt starts a pool and copies the field to shared memory.
+    The HuntExecutor keeps its workers (and their attached field) from one
+    hunt to the next. The time per hunt is printed for both.
+    """
+    num_coins = field_coins//20
+    num_hunts = 20
+    x_list, y_list = generate_seeded_points(seed, 10.0, num_coins)
+    game = GoldHunt8(search_radius=search_radius, workers=2,
+                     circles_per_task=8)
+    x_centers = game.circle_centers()
+
+    def new_pools():
+        for _ in range(num_hunts):
+            game.search_result(x_list, y_list, x_centers)
+
+    print("Field coins: {0}, circles: {1}, hunts: {2}".format(
+        num_coins, len(x_centers), num_hunts))
+    t = time_it("new pool per hunt (pass-8)", new_pools)
+    print("    per hunt: {0:.4f} s".format(t/num_hunts))
+    start = timeit.default_timer()
+    with HuntExecutor(workers=2) as executor:
+        print("executor start up and warm up: {0:.4f} s".format(
+            timeit.default_timer() - start))
+        executor.add_field('field', x_list, y_list)
+
+        def warm_pool():
+            for _ in range(num_hunts):
+                executor.hunt('field', x_centers, game.y_ref, search_radius,
+                              circles_per_task=8)
+
+        t = time_it("warm HuntExecutor", warm_pool)
+        print("    per hunt: {0:.4f} s".format(t/num_hunts))
+        print("    health:", executor.health())
+    print("~"*60)
+
+
+benchmarks = {
+    'grid': benchmark_grid_index,
+    'band': benchmark_band_index,
+    'assign': benchmark_assign,
+    'query_many': benchmark_query_many,
+    'quadtree': benchmark_quadtree,
+    'polar': benchmark_polar_index,
+    'sat': benchmark_summed_area_table,
+    'kdtree': benchmark_kdtree,
+    'sweep': benchmark_radius_sweep,
+    'path': benchmark_hunt_path,
+    'result': benchmark_hunt_result,
+    'float32': benchmark_float32,
+    'stream': benchmark_streaming,
+    'cache': benchmark_field_cache,
+    'inplace': benchmark_inplace_generation,
+    'seeded': benchmark_seeded_generation,
+    'dynamic': benchmark_dynamic_field,
+    'io': benchmark_field_io,
+    'scratch': benchmark_scratch_buffers,
+    'order': benchmark_spatial_order,
+    'shared': benchmark_shared_field,
+    'threads': benchmark_thread_backend,
+    'slabs': benchmark_slab_decomposition,
+    'adaptive': benchmark_adaptive_workers,
+    'executor': benchmark_hunt_executor,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(benchmarks)
+    for name in names:
+        print("Benchmark:", name)
+        benchmarks[name]()
@@ -0,0 +1,265 @@
+"""goldhunt_cache
+
+This module contains the FieldCache class, an on-disk cache of the gold
+fields.
+
+Generating a field with millions of coins takes a good share of the run
+time of a game (see the cProfile output of goldhunt_run_master.py). The
+same field is produced over and over again when the random seed and the
+field parameters do not change. FieldCache stores such a field as raw
+binary arrays and reopens it with np.memmap. The operating system then
+shares the file between the runs (and between the worker processes) via
+its page cache, so the field is neither regenerated nor pickled.
+
+Each cached field is a pair of files in the cache directory:
+
+    <key>.bin   The x coordinates followed by the y coordinates (raw,
+                little-endian floats)
+    <key>.json  Metadata: the field parameters, the array dtype and size,
+                and a CRC-32 checksum of the .bin file
+
+The least recently used fields are deleted once the cache grows larger
+than max_bytes.
+
+This module is compatible with Python 3.5.x and requires NumPy 1.17 or
+later (see goldhunt_field.py). It contains supporting code for the book,
+Learning Python Application Development, Packt Publishing.
+
+:copyright: 2016, Ninad Sathaye
+
+:license: The MIT License (MIT) . See LICENSE file for further details.
+"""
+from __future__ import print_function
+import json
+import os
+import tempfile
+import time
+import zlib
+import numpy as np
+
+from goldhunt_field import field_dtype, generate_seeded_points
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(),
+                                 'goldhunt_field_cache')
+# Part of the key of every entry. Increment it whenever
+# generate_seeded_points changes the field of a given seed, so that the
+# fields cached before are not used any more.
+FIELD_VERSION = 2
+# A data file without its metadata file is only deleted once it is older
+# than this (in seconds): it may belong to a store still in progress.
+STORE_GRACE_SECONDS = 60
+
+
+def file_checksum(path, block_bytes=16*1024*1024):
+    """Return the CRC-32 checksum of the given file.
+
+    :param path: Path of the file
+    :param int block_bytes: The file is read in blocks of this size
+    """
+    checksum = 0
+    with open(path, 'rb') as fil:
+        block = fil.read(block_bytes)
+        while block:
+            checksum = zlib.crc32(block, checksum)
+            block = fil.read(block_bytes)
+    return checksum & 0xffffffff
+
+
+class FieldCache:
+    """Cache of gold fields, stored on disk and opened with np.memmap.
+
+    A field is identified by the random seed and the arguments of
+    goldhunt_field.generate_seeded_points. See the module docstring for
+    the file layout.
+
+    :ivar cache_dir: Directory where the cached fields are stored
+    :ivar int max_bytes: Maximum total size of the cached fields. The least
+          recently used ones are evicted once it is exceeded.
+    :ivar bool verify: If True, the checksum of a cached field is verified
+          every time it is opened. Otherwise only the file size is checked.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=2*1024**3,
+                 verify=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.verify = verify
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def key(seed, field_coins, field_radius, dtype):
+        """Return the name of the cache entry of a field."""
+        return "field_v{0}_s{1}_n{2}_r{3!r}_{4}".format(
+            FIELD_VERSION, seed, field_coins, float(field_radius),
+            field_dtype(dtype).name)
+
+    def _paths(self, key):
+        """Return the paths of the data and the metadata file of a key."""
+        path = os.path.join(self.cache_dir, key)
+        return path + '.bin', path + '.json'
+
+    def _remove(self, key):
+        """Delete the files of a cache entry (if present)."""
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Already deleted (possibly by another process).
+                pass
+
+    def _temp_file(self, key, suffix):
+        """Create a new, uniquely named temporary file for a cache entry.
+
+        Every writer gets its own file, so two processes storing the same
+        key never write to the same temporary file.
+
+        :return: The path of the (empty) file
+        """
+        handle, path = tempfile.mkstemp(suffix=suffix + '.tmp',
+                                        prefix=key + '.',
+                                        dir=self.cache_dir)
+        os.close(handle)
+        return path
+
+    def load(self, seed, field_coins, field_radius, dtype=np.float64):
+        """Return the cached field as read-only memmap arrays.
+
+        An entry that fails the integrity checks (missing file, wrong
+        size, dtype or checksum) is deleted. The metadata file is renamed
+        into place after the data file (see store), so a data file without
+        metadata is kept for STORE_GRACE_SECONDS: another process may be
+        about to finish storing it.
+
+        :return: A tuple (x_list, y_list) of np.memmap arrays or None if
+           the field is not cached.
+        """
+        key = self.key(seed, field_coins, field_radius, dtype)
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as fil:
+                meta = json.load(fil)
+        except (IOError, OSError, ValueError):
+            try:
+                age = time.time() - os.path.getmtime(data_path)
+            except FileNotFoundError:
+                age = None
+            if age is None or age > STORE_GRACE_SECONDS:
+                self._remove(key)
+            return None
+
+        dtype = field_dtype(dtype).newbyteorder('<')
+        expected_bytes = 2*field_coins*dtype.itemsize
+        if (meta.get('key') != key or meta.get('dtype') != dtype.str or
+                not os.path.exists(data_path) or
+                os.path.getsize(data_path) != expected_bytes or
+                meta.get('nbytes') != expected_bytes or
+                (self.verify and
+                 file_checksum(data_path) != meta.get('checksum'))):
+            print("FieldCache: discarding the invalid entry", key)
+            self._remove(key)
+            return None
+
+        # Update the access time used by the eviction.
+        os.utime(meta_path, None)
+        if field_coins == 0:
+            empty = np.empty(0, dtype=dtype)
+            return empty, empty.copy()
+        fields = np.memmap(data_path, dtype=dtype, mode='r',
+                           shape=(2, field_coins))
+        return fields[0], fields[1]
+
+    def store(self, seed, field_coins, field_radius, x_list, y_list):
+        """Write a field to the cache and evict the old fields if needed.
+
+        The files are first written under unique temporary names and then
+        renamed, so an interrupted run never leaves a partial entry behind
+        and concurrent writers of the same key never mix their data.
+        """
+        dtype = np.result_type(x_list, y_list)
+        key = self.key(seed, field_coins, field_radius, dtype)
+        data_path, meta_path = self._paths(key)
+        little_endian = field_dtype(dtype).newbyteorder('<')
+        data_temp = self._temp_file(key, '.bin')
+        meta_temp = self._temp_file(key, '.json')
+        try:
+            with open(data_temp, 'wb') as fil:
+                np.asarray(x_list, dtype=little_endian).tofile(fil)
+                np.asarray(y_list, dtype=little_endian).tofile(fil)
+            meta = {'key': key, 'seed': seed, 'field_coins': field_coins,
+                    'field_radius': field_radius,
+                    'dtype': little_endian.str,
+                    'nbytes': os.path.getsize(data_temp),
+                    'checksum': file_checksum(data_temp)}
+            with open(meta_temp, 'w') as fil:
+                json.dump(meta, fil)
+            # The metadata last: a metadata file always describes a
+            # complete data file.
+            os.replace(data_temp, data_path)
+            os.replace(meta_temp, meta_path)
+        finally:
+            for path in (data_temp, meta_temp):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.evict(keep=key)
+
+    def get(self, seed, field_coins, field_radius, dtype=np.float64,
+            processes=1):
+        """Return the field for the given seed, creating it if needed.
+
+        A field that is not cached yet is generated with
+        goldhunt_field.generate_seeded_points, stored and reopened. If
+        another process evicts it before it is reopened, the generated
+        arrays are returned instead.
+
+        :param processes: Number of processes used to generate the field
+        :return: A tuple (x_list, y_list) of np.memmap arrays (or of
+           NumPy arrays, see above)
+        """
+        fields = self.load(seed, field_coins, field_radius, dtype)
+        if fields is None:
+            generated = generate_seeded_points(
+                seed, field_radius, field_coins, dtype, processes)
+            self.store(seed, field_coins, field_radius, *generated)
+            fields = self.load(seed, field_coins, field_radius, dtype)
+            if fields is None:
+                fields = generated
+        return fields
+
+    def entries(self):
+        """Return a list of (last_used_time, nbytes, key) of cached fields."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            data_path, meta_path = self._paths(key)
+            # Another process may delete an entry while it is listed.
+            try:
+                last_used = os.path.getmtime(meta_path)
+            except FileNotFoundError:
+                continue
+            try:
+                nbytes = os.path.getsize(data_path)
+            except FileNotFoundError:
+                nbytes = 0
+            entries.append((last_used, nbytes, key))
+        return entries
+
+    def evict(self, keep=None):
+        """Delete the least recently used fields until under max_bytes.
+
+        :param keep: Optional key of an entry that must not be deleted
+        """
+        entries = sorted(self.entries())
+        total = sum(nbytes for last_used, nbytes, key in entries)
+        for last_used, nbytes, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key != keep:
+                self._remove(key)
+                total -= nbytes
+
+    def clear(self):
+        """Delete all the cached fields."""
+        for last_used, nbytes, key in self.entries():
+            self._remove(key)
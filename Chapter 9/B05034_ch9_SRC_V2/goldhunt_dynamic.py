@@ -0,0 +1,119 @@
+"""goldhunt_dynamic
+
+This module contains the DynamicField class, a gold field from which the
+collected coins are removed.
+
+In the earlier optimization passes the field never changes: every search
+circle (and every game unit) scans the complete original field, including
+the coins already picked up. A DynamicField keeps a 'collected' mask, so a
+coin is returned by only one query. Once enough coins are collected, the
+field is compacted: the collected coins are removed from the coordinate
+arrays and from the spatial index. The later queries then examine fewer
+coins, so they get cheaper as the field is depleted.
+
+This module is compatible with Python 3.5.x. It contains
+supporting code for the book, Learning Python Application Development,
+Packt Publishing.
+
+:copyright: 2016, Ninad Sathaye
+
+:license: The MIT License (MIT) . See LICENSE file for further details.
+"""
+from __future__ import print_function
+import numpy as np
+
+
+class DynamicField:
+    """Gold field with the collected coins removed from later queries.
+
+    The coin indices accepted and returned by this class always refer to
+    the original field, even after a compaction. The current (compacted)
+    arrays keep the coins in the original relative order, so a field that
+    was sorted along a space filling curve stays sorted.
+
+    If the index has a compact(keep) method (like GridIndex and BandIndex)
+    it is updated in place. Any other index is rebuilt with index_builder.
+
+    :ivar x_list: NumPy array of x coordinates of the remaining coins
+    :ivar y_list: NumPy array of y coordinates of the remaining coins
+    :ivar coin_ids: Original coin index of each of the remaining coins
+    :ivar collected: Boolean NumPy array over the remaining coins. True for
+          the coins collected since the last compaction.
+    :ivar taken: Boolean NumPy array over the original field. True for all
+          the collected coins.
+    :ivar index: Spatial index of the remaining coins
+    :ivar index_builder: Function (x_list, y_list) -> index
+    :ivar float compact_ratio: The field is compacted when this fraction of
+          the remaining coins has been collected.
+    :ivar int num_collected: Number of coins collected since the last
+          compaction
+    :ivar int num_compactions: Number of compactions done so far
+    """
+    def __init__(self, x_list, y_list, index_builder, compact_ratio=0.25):
+        if not 0.0 < compact_ratio <= 1.0:
+            raise ValueError("compact_ratio must be in (0, 1], got %r"
+                             % compact_ratio)
+        self.x_list = np.asarray(x_list)
+        self.y_list = np.asarray(y_list)
+        self.coin_ids = np.arange(self.x_list.size, dtype=np.intp)
+        self.collected = np.zeros(self.x_list.size, dtype=bool)
+        self.taken = np.zeros(self.x_list.size, dtype=bool)
+        self.index_builder = index_builder
+        self.index = index_builder(self.x_list, self.y_list)
+        self.compact_ratio = compact_ratio
+        self.num_collected = 0
+        self.num_compactions = 0
+
+    def __len__(self):
+        """Return the number of coins not collected yet."""
+        return self.x_list.size - self.num_collected
+
+    def query(self, x_ref, y_ref, radius):
+        """Return the original indices of the free coins in the circle.
+
+        :param float x_ref: X-coordinate of the search circle center
+        :param float y_ref: Y-coordinate of the search circle center
+        :param float radius: Radius of the search circle
+        :return: Sorted NumPy array of the (original) coin indices
+        """
+        positions = self._free_positions(x_ref, y_ref, radius)
+        return self.coin_ids[positions]
+
+    def _free_positions(self, x_ref, y_ref, radius):
+        """Return the positions (in the current arrays) of free coins."""
+        positions = self.index.query(x_ref, y_ref, radius)
+        return positions[~self.collected[positions]]
+
+    def collect(self, x_ref, y_ref, radius):
+        """Collect the free coins in the circle and return their indices.
+
+        The field is compacted afterwards if needed (see compact_ratio).
+
+        :param float x_ref: X-coordinate of the search circle center
+        :param float y_ref: Y-coordinate of the search circle center
+        :param float radius: Radius of the search circle
+        :return: Sorted NumPy array of the (original) coin indices
+        """
+        positions = self._free_positions(x_ref, y_ref, radius)
+        coin_ids = self.coin_ids[positions]
+        self.collected[positions] = True
+        self.taken[coin_ids] = True
+        self.num_collected += positions.size
+        if (self.num_collected and
+                self.num_collected >= self.compact_ratio*self.x_list.size):
+            self.compact()
+        return coin_ids
+
+    def compact(self):
+        """Remove the collected coins from the arrays and the index."""
+        keep = ~self.collected
+        self.x_list = self.x_list[keep]
+        self.y_list = self.y_list[keep]
+        self.coin_ids = self.coin_ids[keep]
+        if hasattr(self.index, 'compact'):
+            self.index.compact(keep)
+        else:
+            self.index = self.index_builder(self.x_list, self.y_list)
+        self.collected = np.zeros(self.x_list.size, dtype=bool)
+        self.num_collected = 0
+        self.num_compactions += 1
@@ -0,0 +1,363 @@
+"""goldhunt_executor
+
+This module contains the HuntExecutor class, a long lived pool of warm
+worker processes that runs Gold Hunt searches (hunts) as jobs.
+
+goldhunt_pass6_parallel.py (and by default goldhunt_pass8_parallel.py)
+starts a new process pool for every game and shuts it down at the end.
+A service that runs thousands of hunts pays the process start up, the
+imports of the workers and the attachment of the field again for each of
+them. A HuntExecutor starts its workers once (and warms them up). The gold
+fields are registered once with add_field and stay in shared memory (see
+goldhunt_shared.SharedField). Each worker attaches a field the first time
+one of its tasks needs it and keeps it, with the scratch buffers of the
+scan, for the later hunts. At most max_fields fields are registered: the
+least recently used one (that no running job needs) is destroyed when a
+new one is added. Every task carries the names of the registered fields,
+so a worker releases a field that was removed (or a temporary field that
+was never registered) at the end of its next task. A worker also keeps at
+most max_fields fields attached; the least recently used one is released
+first.
+
+A job is submitted with submit (or run with hunt). It is split into tasks
+of a few circles each, and returns a HuntJob whose result is a
+goldhunt_results.HuntResult (without the field attached).
+
+The health of the pool is reported by health. A worker that dies (for
+example killed by the operating system) breaks the pool: the jobs running
+at that time fail with BrokenProcessPool, and the next submit restarts the
+pool automatically. restart can also be called at any time, e.g. when a
+job hangs: the old worker processes are terminated. The registered fields
+are kept across the restarts. The resource tracker of
+multiprocessing (which destroys the shared memory blocks left behind by
+a process) is started before the workers, so that they share it with
+this process. Otherwise each worker would start its own tracker, and a
+worker exiting would destroy the fields it had attached.
+
+This module requires Python 3.9 or later (multiprocessing.shared_memory
+and Executor.shutdown(cancel_futures=True)). It contains supporting code
+for the book, Learning Python Application Development, Packt Publishing.
+
+:copyright: 2016, Ninad Sathaye
+
+:license: The MIT License (MIT) . See LICENSE file for further details.
+"""
+from __future__ import print_function
+import collections
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker
+
+from goldhunt_results import HuntResult
+from goldhunt_shared import SharedField, scan_circles, trim_fields
+
+
+def _ping(delay=0.0):
+    """Return the process id of the worker, after an optional delay."""
+    if delay:
+        time.sleep(delay)
+    return os.getpid()
+
+
+def _run_task(function, task, max_fields, names):
+    """Run a task in a worker, then detach the fields it no longer needs.
+
+    :param names: Names of the shared memory blocks of the registered
+       fields. The other fields are detached, and at most max_fields of
+       these stay attached.
+    """
+    result = function(task)
+    trim_fields(max_fields, keep=names)
+    return result
+
+
+class HuntJob:
+    """A hunt submitted to a HuntExecutor (see HuntExecutor.submit).
+
+    :ivar futures: List of the concurrent.futures.Future of the tasks
+    """
+    def __init__(self, futures):
+        self.futures = futures
+
+    def done(self):
+        """Return True if all the tasks of the job are finished."""
+        return all(future.done() for future in self.futures)
+
+    def cancel(self):
+        """Cancel the tasks that have not started yet."""
+        return [future.cancel() for future in self.futures]
+
+    def result(self, timeout=None):
+        """Wait for the job and return its HuntResult.
+
+        :param timeout: Maximum time to wait (in seconds) for the whole job
+        :raise concurrent.futures.TimeoutError: If the job isn't done in time
+        :raise BrokenProcessPool: If a worker died while running the job
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        coins_per_circle = []
+        for future in self.futures:
+            remaining = (None if end is None else
+                         max(end - time.monotonic(), 0.0))
+            coins_per_circle.extend(future.result(remaining))
+        return HuntResult.from_circles(coins_per_circle)
+
+
+class HuntExecutor:
+    """Persistent pool of worker processes that run the hunts as jobs.
+
+    See the module docstring. An instance must be closed with close (or
+    used as a context manager), which stops the workers and destroys the
+    shared fields.
+
+    :ivar int workers: Number of worker processes
+    :ivar int max_fields: Number of fields registered (and kept attached
+          by each worker)
+    :ivar fields: Ordered dictionary of the registered fields, key ->
+          goldhunt_shared.SharedField, the most recently used last
+    :ivar int restarts: Number of times the pool has been restarted
+    :ivar stats: Python dictionary with the number of tasks 'submitted',
+          'completed' and 'failed'
+    """
+    def __init__(self, workers=None, max_fields=4, warm_up=True):
+        if workers is None:
+            workers = (len(os.sched_getaffinity(0))
+                       if hasattr(os, 'sched_getaffinity')
+                       else os.cpu_count() or 1)
+        if workers < 1:
+            raise ValueError("workers must be at least 1, got %r" % workers)
+        if max_fields < 1:
+            raise ValueError("max_fields must be at least 1, got %r"
+                             % max_fields)
+        self.workers = workers
+        self.max_fields = max_fields
+        self.fields = collections.OrderedDict()
+        self.restarts = 0
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0}
+        self._lock = threading.Lock()
+        # Number of unfinished tasks per field key.
+        self._running = collections.Counter()
+        self._pool = None
+        self._started = None
+        self._start(warm_up)
+
+    def _start(self, warm_up):
+        """Start a new process pool (and wait until all workers run)."""
+        # The workers must share the tracker of this process (see the
+        # module docstring).
+        resource_tracker.ensure_running()
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._started = time.monotonic()
+        if warm_up:
+            self.warm_up()
+
+    def warm_up(self, delay=0.05):
+        """Make sure that all the workers are started and ready.
+
+        Each worker gets a short sleeping task, so that none of them can
+        take two.
+
+        :return: Sorted list of the process ids of the workers
+        """
+        futures = [self._pool.submit(_ping, delay)
+                   for _ in range(self.workers)]
+        return sorted(set(future.result() for future in futures))
+
+    def _count(self, key, future):
+        """Update the task statistics once a task is finished."""
+        with self._lock:
+            if future.cancelled() or future.exception() is not None:
+                self.stats['failed'] += 1
+            else:
+                self.stats['completed'] += 1
+            if key is not None:
+                self._running[key] -= 1
+                if self._running[key] <= 0:
+                    del self._running[key]
+
+    def _submit(self, function, task, key=None):
+        """Submit a task, restarting the pool first if it is broken.
+
+        :param key: Optional key of the registered field used by the task.
+           The field is not evicted until the task is finished.
+        """
+        names = frozenset(field.handle[0] for field in self.fields.values())
+        args = (_run_task, function, task, self.max_fields, names)
+        try:
+            future = self._pool.submit(*args)
+        except BrokenProcessPool:
+            self.restart()
+            future = self._pool.submit(*args)
+        with self._lock:
+            self.stats['submitted'] += 1
+            if key is not None:
+                self._running[key] += 1
+        future.add_done_callback(functools.partial(self._count, key))
+        return future
+
+    def add_field(self, key, x_list, y_list):
+        """Register a field and return the handle used by the tasks.
+
+        The field is copied into shared memory only the first time the
+        key is seen. If more than max_fields fields are then registered,
+        the least recently used ones are removed (except those used by the
+        unfinished tasks).
+
+        :param key: Any hashable name of the field (e.g. the key of
+           goldhunt_cache.FieldCache)
+        :param x_list: NumPy array of x coordinates of all the coins
+        :param y_list: NumPy array of y coordinates of all the coins
+        :return: The SharedField.handle of the field
+        """
+        if key in self.fields:
+            self.fields.move_to_end(key)
+            return self.fields[key].handle
+        self.fields[key] = SharedField(x_list, y_list)
+        with self._lock:
+            idle = [old_key for old_key in self.fields
+                    if old_key != key and old_key not in self._running]
+        for old_key in idle[:max(len(self.fields) - self.max_fields, 0)]:
+            self.remove_field(old_key)
+        return self.fields[key].handle
+
+    def remove_field(self, key):
+        """Destroy a registered field.
+
+        The workers that still have it attached release it at the end of
+        their next task (or when they are restarted).
+        """
+        self.fields.pop(key).close()
+
+    def submit(self, key, x_centers, y_ref=0.0, search_radius=1.0,
+               circles_per_task=4):
+        """Submit a hunt (a row of circles) on a registered field.
+
+        :param key: Key of the field (see add_field)
+        :param x_centers: x-coordinates of the search circles
+        :param float y_ref: Y-coordinate of all the circle centers
+        :param float search_radius: Radius of the circles
+        :param int circles_per_task: Number of circles per task
+        :return: A HuntJob instance
+        """
+        field = self.fields[key]
+        self.fields.move_to_end(key)
+        centers = [(float(x_ref), y_ref) for x_ref in x_centers]
+        futures = [
+            self._submit(scan_circles,
+                         (field.handle, centers[start:start +
+                                                circles_per_task],
+                          search_radius), key)
+            for start in range(0, len(centers), circles_per_task)]
+        return HuntJob(futures)
+
+    def hunt(self, key, x_centers, y_ref=0.0, search_radius=1.0,
+             circles_per_task=4, timeout=None):
+        """Run a hunt and return its HuntResult (see submit)."""
+        return self.submit(key, x_centers, y_ref, search_radius,
+                           circles_per_task).result(timeout)
+
+    def map(self, function, tasks, key=None):
+        """Return function(task) for all the tasks, run by the workers.
+
+        This is the interface used by goldhunt_pass8_parallel.GoldHunt.
+
+        :param function: Module level function (it must be picklable)
+        :param tasks: List of the arguments of function
+        :param key: Optional key of the registered field used by the tasks
+           (see add_field). The workers release any other field at the end
+           of a task.
+        :return: List of the results, in the order of the tasks
+        """
+        if key is not None:
+            self.fields.move_to_end(key)
+        futures = [self._submit(function, task, key) for task in tasks]
+        return [future.result() for future in futures]
+
+    def health(self, timeout=1.0):
+        """Return a Python dictionary describing the state of the pool.
+
+        A ping task is sent to the pool. It must come back within timeout
+        seconds for the pool to be reported as 'responsive'. Besides
+        'responsive' and 'ping_seconds' (None if it didn't come back), the
+        dictionary holds 'workers', 'alive' (the number of worker
+        processes running), 'restarts', 'fields', 'uptime' (of the current
+        pool, in seconds, None once the executor is closed) and the task
+        statistics.
+
+        The ping waits in the task queue like any other task, so a pool
+        whose workers are all busy for longer than timeout is reported as
+        not responsive, even though its workers are alive.
+
+        :param float timeout: Maximum time to wait for the ping (seconds)
+        """
+        ping_seconds = uptime = None
+        alive = sum(process.is_alive() for process in self._processes())
+        if self._pool is not None:
+            start = time.monotonic()
+            uptime = start - self._started
+            try:
+                self._pool.submit(_ping).result(timeout)
+                ping_seconds = time.monotonic() - start
+            except (BrokenProcessPool, TimeoutError, RuntimeError):
+                pass
+        report = {'responsive': ping_seconds is not None,
+                  'ping_seconds': ping_seconds,
+                  'workers': self.workers,
+                  'alive': alive,
+                  'restarts': self.restarts,
+                  'fields': len(self.fields),
+                  'uptime': uptime}
+        with self._lock:
+            report.update(self.stats)
+        return report
+
+    def _processes(self):
+        """Return the list of the worker processes of the current pool."""
+        if self._pool is None:
+            return []
+        # ProcessPoolExecutor doesn't expose its processes. _processes
+        # maps their process ids to the multiprocessing.Process instances
+        # (None before the first task is submitted).
+        return list((self._pool._processes or {}).values())
+
+    def restart(self, warm_up=True, timeout=1.0):
+        """Replace the worker processes with new ones.
+
+        The tasks not started yet are cancelled. The old worker processes
+        are terminated, including those stuck in a task (their jobs fail
+        with BrokenProcessPool), and killed if they don't exit within
+        timeout seconds. The registered fields are kept and are attached
+        again by the new workers.
+
+        :param float timeout: Time given to each old worker to exit
+        """
+        processes = self._processes()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
+                process.join()
+        self.restarts += 1
+        self._start(warm_up)
+
+    def close(self):
+        """Stop the workers and destroy all the registered fields."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = self._started = None
+        for field in self.fields.values():
+            field.close()
+        self.fields.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,345 @@
+"""goldhunt_field
+
+This module contains the functions that create the 'gold field' of the
+Gold Hunt scenario i.e. the random coordinates of the gold coins.
+
+The coordinates can be stored and processed as float64 (the default) or
+as float32. A float32 field takes half the memory and cache traffic, which
+matters for fields with tens of millions of coins. The coin positions are
+then accurate to about 1e-6 of the field radius, so a coin lying that close
+to the boundary of a search circle may be counted differently than with a
+float64 field.
+
+By default, generate_random_points creates several full size temporary
+arrays (theta, radius, cos(theta), ...). With the block_size argument, the
+same computation runs in place in the output arrays, one block of coins at
+a time. The peak memory is then little more than the final x, y arrays, and
+the field is bit-identical to the default one.
+
+For the fields that do not fit in the memory, generate_random_chunks
+yields the coins a fixed number at a time, so that the peak memory depends
+only on the chunk size.
+
+The functions above use the global state of np.random (like the earlier
+optimization passes), so a field can be reproduced only by calling
+np.random.seed first. generate_seeded_points instead takes an explicit
+seed. The field is split into chunks of a fixed size and each chunk draws
+its numbers from its own np.random.Generator, spawned from the seed with
+np.random.SeedSequence. The chunks are independent, so they can be
+generated by several processes, and for a given seed the field is
+bit-identical whatever the number of processes. The coordinates are
+always computed in float64, so the float32 field of a seed is the float64
+field rounded to float32. (np.random.Generator needs NumPy 1.17 or later.)
+
+This module is compatible with Python 3.5.x and requires NumPy 1.17 or
+later (np.random.Generator). It contains supporting code for the book,
+Learning Python Application Development, Packt Publishing.
+
+:copyright: 2016, Ninad Sathaye
+
+:license: The MIT License (MIT) . See LICENSE file for further details.
+"""
+from __future__ import print_function
+import multiprocessing
+import numpy as np
+
+# Block size used by the low peak memory mode of generate_random_points
+DEFAULT_BLOCK_SIZE = 65536
+# Number of points per random number stream of generate_seeded_points.
+# Changing it changes the field generated for a given seed.
+SEEDED_CHUNK_SIZE = 1048576
+
+
+def field_dtype(dtype):
+    """Return the NumPy dtype for the coin coordinates.
+
+    :param dtype: float32 or float64 (as a NumPy type or a string)
+    :return: np.dtype instance
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError("The field dtype must be float32 or float64, "
+                         "got {0}".format(dtype))
+    return dtype
+
+
+def generate_random_polar_points(ref_radius, total_points, dtype=np.float64):
+    """Return polar coordinate arrays of random points inside a circle.
+
+    Generates random points inside a circle with center at (0,0). For any
+    point, it randomly picks a polar angle and a radius between 0 and
+    ref_radius. The radius is picked such that the points are uniformly
+    distributed over the area of the circle.
+
+    :param ref_radius: The random point lies between 0 and this radius.
+    :param total_points: total number of random points to be created
+    :param dtype: float32 or float64, the type of the returned arrays
+    :return: theta (polar angle) and radius as NumPy arrays
+    """
+    dtype = field_dtype(dtype)
+    l_uniform = np.random.uniform
+    # The random numbers are always drawn as float64, so a given seed
+    # produces the same field (up to rounding) for both the dtypes.
+    theta = l_uniform(0.0, 2.0*np.pi, total_points).astype(dtype, copy=False)
+    radius = l_uniform(0.0, 1.0, total_points).astype(dtype, copy=False)
+    np.sqrt(radius, out=radius)
+    radius *= dtype.type(ref_radius)
+    return theta, radius
+
+
+def generate_random_points(ref_radius, total_points, dtype=np.float64,
+                           block_size=None):
+    """Return x, y coordinate arrays representing random points inside a circle.
+
+    Generates random points inside a circle with center at (0,0). For any
+    point, it randomly picks a radius between 0 and ref_radius.
+
+    :param ref_radius: The random point lies between 0 and this radius.
+    :param total_points: total number of random points to be created
+    :param dtype: float32 or float64, the type of the returned arrays
+    :param block_size: If given, use the low peak memory mode, processing
+       this many points at a time (see generate_random_points_inplace).
+    :return: x and y coordinates as NumPy arrays
+
+    .. seealso:: generate_random_polar_points
+    """
+    if block_size is not None:
+        return generate_random_points_inplace(ref_radius, total_points,
+                                              dtype, block_size)
+    theta, radius = generate_random_polar_points(ref_radius, total_points,
+                                                 dtype)
+    x = radius*np.cos(theta)
+    y = radius*np.sin(theta)
+
+    return x, y
+
+
+def generate_random_points_inplace(ref_radius, total_points,
+                                   dtype=np.float64,
+                                   block_size=DEFAULT_BLOCK_SIZE, rng=None):
+    """Low peak memory version of generate_random_points.
+
+    The output arrays x and y are allocated first. The polar angles are
+    drawn into x and the radii into y, block by block. The conversion to
+    the Cartesian coordinates is then done in place using the out argument
+    of the ufuncs, so the only other arrays have block_size elements.
+
+    The random numbers are drawn in the same order and the arithmetic is
+    the same as in generate_random_points, so for a given seed both return
+    exactly the same field.
+
+    :param ref_radius: The random point lies between 0 and this radius.
+    :param total_points: total number of random points to be created
+    :param dtype: float32 or float64, the type of the returned arrays
+    :param block_size: Number of points processed at a time
+    :param rng: Optional np.random.Generator to draw the random numbers
+       from (directly into the output arrays). By default, the global
+       np.random state is used.
+    :return: x and y coordinates as NumPy arrays
+    """
+    dtype = field_dtype(dtype)
+    if block_size < 1:
+        raise ValueError("block_size must be positive, got %r" % block_size)
+    x = np.empty(total_points, dtype=dtype)
+    y = np.empty(total_points, dtype=dtype)
+    blocks = [slice(start, min(start + block_size, total_points))
+              for start in range(0, total_points, block_size)]
+    # Draw all the polar angles first and then all the radii, exactly like
+    # generate_random_polar_points.
+    if rng is None:
+        l_uniform = np.random.uniform
+        for block in blocks:
+            x[block] = l_uniform(0.0, 2.0*np.pi, block.stop - block.start)
+        for block in blocks:
+            y[block] = l_uniform(0.0, 1.0, block.stop - block.start)
+    else:
+        for block in blocks:
+            rng.random(dtype=dtype.type, out=x[block])
+            x[block] *= dtype.type(2.0*np.pi)
+        for block in blocks:
+            rng.random(dtype=dtype.type, out=y[block])
+    _to_cartesian(x, y, ref_radius, block_size)
+    return x, y
+
+
+def _to_cartesian(x, y, ref_radius, block_size):
+    """Convert polar angles (in x) and uniform numbers (in y) in place.
+
+    The uniform numbers become the radii sqrt(y)*ref_radius, and x and y
+    the Cartesian coordinates, block_size points at a time.
+    """
+    total_points = x.size
+    blocks = [slice(start, min(start + block_size, total_points))
+              for start in range(0, total_points, block_size)]
+    scale = x.dtype.type(ref_radius)
+    sin_theta = np.empty(min(block_size, total_points), dtype=x.dtype)
+    for block in blocks:
+        theta = x[block]
+        radius = y[block]
+        sin_block = sin_theta[:block.stop - block.start]
+        np.sqrt(radius, out=radius)
+        np.multiply(radius, scale, out=radius)
+        np.sin(theta, out=sin_block)
+        np.cos(theta, out=theta)
+        # x = radius*cos(theta), y = radius*sin(theta)
+        np.multiply(radius, theta, out=theta)
+        np.multiply(radius, sin_block, out=radius)
+
+
+def spawn_generators(seed, num_streams):
+    """Return a list of independent np.random.Generator instances.
+
+    The streams are spawned from np.random.SeedSequence(seed), so they are
+    statistically independent (e.g. one for each worker process) and the
+    same seed always gives the same streams.
+    """
+    return [np.random.default_rng(child)
+            for child in np.random.SeedSequence(seed).spawn(num_streams)]
+
+
+def _seeded_streams(task):
+    """Return the random streams of the polar angles and of the radii.
+
+    The polar angles of all the points of a seeded chunk are drawn first,
+    then the radii, from the random stream of the chunk. Each float64
+    drawn takes one step of the stream, so the radii are drawn from a
+    second generator advanced past the angles. Both are then read in
+    order, a few points at a time if needed.
+
+    :param task: Tuple (seed_sequence, ref_radius, num_points, dtype)
+    """
+    seed_sequence, ref_radius, num_points, dtype = task
+    theta_rng = np.random.default_rng(seed_sequence)
+    radius_rng = np.random.default_rng(seed_sequence)
+    radius_rng.bit_generator.advance(num_points)
+    return theta_rng, radius_rng
+
+
+def _seeded_points(task, streams, num_points):
+    """Generate the next num_points points of a seeded chunk.
+
+    The numbers are always drawn in float64, so that the float32 field of
+    a seed is the float64 field rounded to float32.
+
+    :param task: Tuple (seed_sequence, ref_radius, num_points, dtype)
+    :param streams: The streams of the chunk, see _seeded_streams
+    """
+    theta_rng, radius_rng = streams
+    x = theta_rng.random(num_points)
+    x *= 2.0*np.pi
+    y = radius_rng.random(num_points)
+    _to_cartesian(x, y, task[1], DEFAULT_BLOCK_SIZE)
+    return x.astype(task[3], copy=False), y.astype(task[3], copy=False)
+
+
+def _seeded_chunk(task):
+    """Generate one chunk of generate_seeded_points (in a worker process).
+
+    :param task: Tuple (seed_sequence, ref_radius, num_points, dtype)
+    """
+    return _seeded_points(task, _seeded_streams(task), task[2])
+
+
+def _seeded_chunk_tasks(seed, ref_radius, total_points, dtype):
+    """Return the list of the tasks (see _seeded_chunk) for a seeded field."""
+    num_chunks = -(-total_points//SEEDED_CHUNK_SIZE)
+    children = np.random.SeedSequence(seed).spawn(num_chunks)
+    return [(child, ref_radius,
+             min(SEEDED_CHUNK_SIZE, total_points - k*SEEDED_CHUNK_SIZE),
+             field_dtype(dtype).str)
+            for k, child in enumerate(children)]
+
+
+def generate_seeded_points(seed, ref_radius, total_points, dtype=np.float64,
+                           processes=1):
+    """Return x, y coordinate arrays of a reproducible random field.
+
+    The field is generated in chunks of SEEDED_CHUNK_SIZE points, each with
+    its own random number stream spawned from the seed. With processes > 1
+    the chunks are generated in parallel by a multiprocessing.Pool. The
+    result doesn't depend on the number of processes. The coordinates are
+    computed in float64 and then converted, so the float32 field of a seed
+    is the float64 field rounded to float32.
+
+    :param seed: Seed (int) for np.random.SeedSequence
+    :param ref_radius: The random point lies between 0 and this radius.
+    :param total_points: total number of random points to be created
+    :param dtype: float32 or float64, the type of the returned arrays
+    :param processes: Number of worker processes
+    :return: x and y coordinates as NumPy arrays
+    """
+    dtype = field_dtype(dtype)
+    x = np.empty(total_points, dtype=dtype)
+    y = np.empty(total_points, dtype=dtype)
+    tasks = _seeded_chunk_tasks(seed, ref_radius, total_points, dtype)
+    if processes > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(processes=min(processes, len(tasks)))
+        chunks = pool.imap(_seeded_chunk, tasks)
+    else:
+        pool = None
+        chunks = (_seeded_chunk(task) for task in tasks)
+    # The chunks arrive in order (Pool.imap keeps the order of the tasks).
+    start = 0
+    for x_chunk, y_chunk in chunks:
+        stop = start + x_chunk.size
+        x[start:stop] = x_chunk
+        y[start:stop] = y_chunk
+        start = stop
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return x, y
+
+
+def generate_random_chunks(ref_radius, total_points, chunk_size,
+                           dtype=np.float64, seed=None):
+    """Yield x, y coordinate arrays of random points, chunk_size at a time.
+
+    Together, the chunks form a field of total_points random points inside
+    a circle of radius ref_radius (see generate_random_points). Only one
+    chunk is kept in memory at a time, as long as the caller doesn't hold
+    on to the previous chunks.
+
+    .. note:: For a given np.random.seed, the field differs from the one
+       returned by generate_random_points, because the random numbers are
+       drawn in a different order. With the seed argument, the field is
+       the one of generate_seeded_points, whatever the chunk_size.
+
+    :param ref_radius: The random point lies between 0 and this radius.
+    :param total_points: total number of random points to be created
+    :param chunk_size: Maximum number of points in a chunk
+    :param dtype: float32 or float64, the type of the returned arrays
+    :param seed: Optional seed. See generate_seeded_points.
+    :return: A generator of (x, y) tuples of NumPy arrays
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be positive, got %r" % chunk_size)
+    if seed is not None:
+        # Each chunk is drawn from the streams of the seeded chunks it
+        # overlaps, so only chunk_size points are generated at a time.
+        tasks = iter(_seeded_chunk_tasks(seed, ref_radius, total_points,
+                                         dtype))
+        task = streams = None
+        remaining = 0
+        for start in range(0, total_points, chunk_size):
+            size = min(chunk_size, total_points - start)
+            pieces = []
+            while size:
+                if remaining == 0:
+                    task = next(tasks)
+                    streams = _seeded_streams(task)
+                    remaining = task[2]
+                num_points = min(size, remaining)
+                pieces.append(_seeded_points(task, streams, num_points))
+                size -= num_points
+                remaining -= num_points
+            if len(pieces) == 1:
+                yield pieces[0]
+            else:
+                yield (np.concatenate([x for x, y in pieces]),
+                       np.concatenate([y for x, y in pieces]))
+        return
+    for start in range(0, total_points, chunk_size):
+        yield generate_random_points_inplace(
+            ref_radius, min(chunk_size, total_points - start), dtype,
+            min(chunk_size, DEFAULT_BLOCK_SIZE))
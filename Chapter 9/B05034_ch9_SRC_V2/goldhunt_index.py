@@ -0,0 +1,1140 @@
+"""goldhunt_index
+
+This module contains spatial index structures for the Gold Hunt program.
+
+Every optimization pass up to goldhunt_pass6_parallel computes the distance
+of *all* the coins from the center of *every* search circle. A search circle
+can only contain a tiny fraction of the gold field though. The classes in
+this module are built once (after generate_random_points) and let each
+circle query touch only the coins that could possibly lie inside it.
+
+All the index classes share a common interface:
+
+    index = SomeIndex(x_list, y_list, ...)
+    coin_ids = index.query(x_ref, y_ref, radius)
+
+The query returns a sorted NumPy integer array of the coin indices (into the
+original x_list and y_list) that lie within the given circle. See
+goldhunt_pass7_indexed.py for how these are plugged into GoldHunt.play.
+
+The module also has kernels (assign_to_circles, query_many and
+radius_counts) that search many circles at once without a Python level
+loop over the coins.
+
+This module is compatible with Python 3.5.x and requires NumPy 1.15 or
+later (np.quantile). It contains supporting code for the book, Learning
+Python Application Development, Packt Publishing.
+
+:copyright: 2016, Ninad Sathaye
+
+:license: The MIT License (MIT) . See LICENSE file for further details.
+"""
+from __future__ import print_function
+import heapq
+import numpy as np
+
+
+def coordinate_dtype(x_list, y_list):
+    """Return the floating point type used for computing with the coins.
+
+    A float32 field is processed in float32 (to halve the memory and cache
+    traffic), any other field in float64.
+    """
+    dtype = np.result_type(x_list, y_list)
+    if dtype == np.float32:
+        return dtype
+    return np.dtype(np.float64)
+
+
+def concatenate_ranges(starts, stops):
+    """Return the integers of several [start, stop) ranges as one array.
+
+    This is a vectorized equivalent of
+    np.concatenate([np.arange(s, e) for s, e in zip(starts, stops)])
+    that avoids the Python level loop.
+
+    :param starts: Array of range start values
+    :param stops: Array of range stop values (exclusive)
+    :return: A NumPy integer array with all the range members
+    """
+    starts = np.asarray(starts, dtype=np.intp)
+    lengths = np.asarray(stops, dtype=np.intp) - starts
+    lengths = np.maximum(lengths, 0)
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.intp)
+    # Each output element is 'start of its range + position in the range'.
+    # Compute the position by subtracting the running offset of each range.
+    offsets = np.cumsum(lengths) - lengths
+    return (np.repeat(starts - offsets, lengths) +
+            np.arange(total, dtype=np.intp))
+
+
+def assign_to_circles(x_list, y_list, x_centers, y_ref, radius):
+    """Find the coins inside each circle of a row of non-overlapping circles.
+
+    The circles are centered at (x_centers[k], y_ref) and are evenly spaced
+    at least 2*radius apart, so a coin can only lie inside the circle whose
+    center is the nearest to it along the X axis. This candidate circle is
+    computed for all the coins in one vectorized pass, followed by a single
+    distance test. The coins are then grouped by their circle.
+
+    .. note:: A coin exactly on the boundary of two touching circles is
+       reported only for one of them.
+
+    :param x_list: NumPy array of x coordinates of all the coins
+    :param y_list: NumPy array of y coordinates of all the coins
+    :param x_centers: Evenly spaced x-coordinates of the circle centers
+    :param float y_ref: Y-coordinate of all the circle centers
+    :param float radius: Radius of the circles
+    :return: A tuple (circle_start, coin_ids). The coins inside the circle
+       k are coin_ids[circle_start[k]:circle_start[k+1]] (in sorted order).
+    """
+    x_list = np.asarray(x_list)
+    y_list = np.asarray(y_list)
+    x_centers = np.asarray(x_centers, dtype=float)
+    dtype = coordinate_dtype(x_list, y_list)
+    num_circles = x_centers.size
+    circle_start = np.zeros(num_circles + 1, dtype=np.intp)
+    if num_circles == 0:
+        return circle_start, np.empty(0, dtype=np.intp)
+
+    if num_circles > 1:
+        spacings = np.diff(x_centers)
+        stride = (x_centers[-1] - x_centers[0])/(num_circles - 1)
+        if spacings.min() < 2*radius*(1 - 1e-9):
+            raise ValueError("The circles overlap: spacing {0} is less than "
+                             "2*radius = {1}".format(spacings.min(),
+                                                     2*radius))
+        if np.abs(spacings - stride).max() > 1e-6*stride:
+            raise ValueError("The circle centers must be evenly spaced")
+        candidate = np.rint((x_list - dtype.type(x_centers[0])) /
+                            dtype.type(stride)).astype(np.intp)
+        np.clip(candidate, 0, num_circles - 1, out=candidate)
+    else:
+        candidate = np.zeros(x_list.size, dtype=np.intp)
+
+    delta_x = x_list - x_centers.astype(dtype)[candidate]
+    delta_y = y_list - dtype.type(y_ref)
+    coin_ids = np.flatnonzero(delta_x*delta_x + delta_y*delta_y <=
+                              dtype.type(radius*radius))
+    circle_ids = candidate[coin_ids]
+    # A stable sort keeps the coins of each circle in the ascending order.
+    coin_ids = coin_ids[np.argsort(circle_ids, kind='stable')]
+    np.cumsum(np.bincount(circle_ids, minlength=num_circles),
+              out=circle_start[1:])
+    return circle_start, coin_ids
+
+
+def partition_slabs(x_list, num_slabs):
+    """Split the field into vertical slabs holding about as many coins.
+
+    The slab boundaries are quantiles of the x coordinates. The coins of
+    a slab keep their original relative order.
+
+    :param x_list: NumPy array of x coordinates of all the coins
+    :param int num_slabs: Number of slabs
+    :return: A tuple (slab_start, coin_ids). The coins of the slab k are
+       coin_ids[slab_start[k]:slab_start[k+1]] (in sorted order).
+    """
+    if num_slabs < 1:
+        raise ValueError("num_slabs must be at least 1, got %r" % num_slabs)
+    x_list = np.asarray(x_list)
+    slab_start = np.zeros(num_slabs + 1, dtype=np.intp)
+    if x_list.size == 0:
+        return slab_start, np.empty(0, dtype=np.intp)
+    edges = np.quantile(x_list, np.linspace(0.0, 1.0, num_slabs + 1)[1:-1])
+    slab_ids = np.searchsorted(edges, x_list, side='right')
+    # A stable sort keeps the coins of each slab in the ascending order.
+    coin_ids = np.argsort(slab_ids, kind='stable')
+    np.cumsum(np.bincount(slab_ids, minlength=num_slabs),
+              out=slab_start[1:])
+    return slab_start, coin_ids
+
+
+def query_many(x_list, y_list, centers, radii, block_bytes=8*1024*1024):
+    """Find the coins inside each of several (arbitrary) circles.
+
+    Blocks of circles are tested against blocks of coins at once using
+    NumPy broadcasting. The coins inside are then picked up with
+    np.flatnonzero on the boolean mask, so no Python level loop runs over
+    the coins. The block sizes are chosen so that the temporary arrays of
+    one block take at most about block_bytes of memory.
+
+    :param x_list: NumPy array of x coordinates of all the coins
+    :param y_list: NumPy array of y coordinates of all the coins
+    :param centers: Sequence of (x, y) circle centers, shape (M, 2)
+    :param radii: A single radius or a sequence of M radii (one per circle)
+    :param int block_bytes: Memory budget for the temporary arrays
+    :return: A tuple (circle_start, coin_ids). The coins inside the circle
+       k are coin_ids[circle_start[k]:circle_start[k+1]] (in sorted order).
+    """
+    x_list = np.asarray(x_list)
+    y_list = np.asarray(y_list)
+    dtype = coordinate_dtype(x_list, y_list)
+    centers = np.asarray(centers, dtype=float).reshape(-1, 2).astype(dtype)
+    num_circles = len(centers)
+    radii = np.broadcast_to(np.asarray(radii, dtype=float), (num_circles,))
+    num_coins = x_list.size
+    circle_start = np.zeros(num_circles + 1, dtype=np.intp)
+    if num_circles == 0 or num_coins == 0:
+        return circle_start, np.empty(0, dtype=np.intp)
+
+    # Each (circle, coin) pair needs two float temporaries and a mask byte.
+    pair_bytes = 2*np.result_type(x_list, centers).itemsize + 1
+    coins_per_block = int(min(num_coins, max(1, block_bytes//pair_bytes)))
+    circles_per_block = int(min(num_circles, max(
+        1, block_bytes//(pair_bytes*coins_per_block))))
+
+    found_circles = []
+    found_coins = []
+    for c_start in range(0, num_circles, circles_per_block):
+        c_stop = c_start + circles_per_block
+        x_ref = centers[c_start:c_stop, 0, np.newaxis]
+        y_ref = centers[c_start:c_stop, 1, np.newaxis]
+        radius_squares = (radii[c_start:c_stop, np.newaxis]**2).astype(dtype)
+        for p_start in range(0, num_coins, coins_per_block):
+            p_stop = min(p_start + coins_per_block, num_coins)
+            # Shape of the temporaries: (circles in block, coins in block)
+            delta_x = x_list[np.newaxis, p_start:p_stop] - x_ref
+            delta_y = y_list[np.newaxis, p_start:p_stop] - y_ref
+            np.multiply(delta_x, delta_x, out=delta_x)
+            np.multiply(delta_y, delta_y, out=delta_y)
+            np.add(delta_x, delta_y, out=delta_x)
+            hits = np.flatnonzero(delta_x <= radius_squares)
+            width = p_stop - p_start
+            found_circles.append(hits//width + c_start)
+            found_coins.append(hits % width + p_start)
+
+    circle_ids = np.concatenate(found_circles)
+    # The coins of a circle were found in the ascending order. The stable
+    # sort on the circle id preserves that order.
+    order = np.argsort(circle_ids, kind='stable')
+    coin_ids = np.concatenate(found_coins)[order]
+    np.cumsum(np.bincount(circle_ids, minlength=num_circles),
+              out=circle_start[1:])
+    return circle_start, coin_ids
+
+
+def radius_counts(x_list, y_list, centers, radii):
+    """Count the coins around fixed centers for a whole vector of radii.
+
+    The distance of the coins from each center is computed only once. The
+    distances not larger than the biggest radius are sorted, after which
+    the count for any radius is a binary search (np.searchsorted).
+
+    :param x_list: NumPy array of x coordinates of all the coins
+    :param y_list: NumPy array of y coordinates of all the coins
+    :param centers: Sequence of (x, y) circle centers, shape (M, 2)
+    :param radii: Sequence of R radii
+    :return: NumPy integer array of shape (M, R). Element [m, j] is the
+       number of coins within radii[j] of the center m.
+    """
+    x_list = np.asarray(x_list)
+    y_list = np.asarray(y_list)
+    centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+    radius_squares = np.asarray(radii, dtype=float)**2
+    counts = np.zeros((len(centers), radius_squares.size), dtype=np.intp)
+    if radius_squares.size == 0:
+        return counts
+    max_square = radius_squares.max()
+    for m, (x_ref, y_ref) in enumerate(centers.tolist()):
+        delta_x = x_list - x_ref
+        delta_y = y_list - y_ref
+        dist_squares = delta_x*delta_x + delta_y*delta_y
+        # Only the coins within the largest radius need to be sorted.
+        dist_squares = np.sort(dist_squares[dist_squares <= max_square])
+        counts[m] = np.searchsorted(dist_squares, radius_squares,
+                                    side='right')
+    return counts
+
+
+class ScanIndex:
+    """Brute force 'index' that tests every coin for each search circle.
+
+    This is the optimization pass-5 (einsum) kernel wrapped in the common
+    index interface. It is useful as a reference for correctness and
+    for benchmarking the other index classes.
+
+    :ivar x_list: NumPy array of x coordinates of all the coins
+    :ivar y_list: NumPy array of y coordinates of all the coins
+    """
+    def __init__(self, x_list, y_list):
+        self.x_list = np.asarray(x_list)
+        self.y_list = np.asarray(y_list)
+        # Stack the coordinates only once, instead of once per circle.
+        self.points = np.column_stack((self.x_list, self.y_list))
+
+    def query(self, x_ref, y_ref, radius):
+        """Return indices of the coins within the given circle.
+
+        :param float x_ref: X-coordinate of the search circle center
+        :param float y_ref: Y-coordinate of the search circle center
+        :param float radius: Radius of the search circle
+        :return: Sorted NumPy array of the coin indices
+        """
+        diff = self.points - np.array([x_ref, y_ref], dtype=self.points.dtype)
+        distance_squares = np.einsum('...i,...i', diff, diff)
+        return np.flatnonzero(distance_squares <= radius*radius)
+
+
+class ScanContext:
+    """Brute force scan that reuses preallocated scratch buffers.
+
+    The pass-5 find_coins creates a copy of the field with np.dstack and
+    two more full size temporaries (diff and distance_squares) for every
+    search circle, although only the circle center changes between the
+    calls. Here, the field is stacked once and the same scratch buffers are
+    used (through the out arguments of the ufuncs) for all the circles. The
+    only array allocated by a query is the returned array of coin indices.
+
+    .. note:: The scratch buffers are shared by all the queries, so an
+       instance must not be used by several threads at the same time.
+
+    :ivar points: NumPy array of shape (N, 2) with the coin coordinates
+    :ivar diff: Scratch buffer of shape (N, 2) for points - center
+    :ivar distance_squares: Scratch buffer of N squared distances
+    :ivar inside: Scratch buffer of N booleans
+    """
+    def __init__(self, x_list, y_list):
+        dtype = coordinate_dtype(x_list, y_list)
+        self._allocate(np.column_stack((x_list, y_list)).astype(dtype,
+                                                                copy=False))
+
+    @classmethod
+    def from_points(cls, points):
+        """Return a ScanContext over an existing (N, 2) coordinate array.
+
+        The array is used as is (not copied), e.g. a field that lives in a
+        shared memory block (see goldhunt_shared.py). Only the scratch
+        buffers are allocated.
+
+        :param points: NumPy float array of shape (N, 2)
+        :return: A ScanContext instance
+        """
+        context = cls.__new__(cls)
+        context._allocate(np.asarray(points))
+        return context
+
+    def _allocate(self, points):
+        """Set the field and allocate the scratch buffers."""
+        self.points = points
+        self.center = np.empty(2, dtype=points.dtype)
+        self.diff = np.empty_like(points)
+        self.distance_squares = np.empty(len(points), dtype=points.dtype)
+        self.inside = np.empty(len(points), dtype=bool)
+
+    def query(self, x_ref, y_ref, radius):
+        """Return indices of the coins within the given circle.
+
+        :param float x_ref: X-coordinate of the search circle center
+        :param float y_ref: Y-coordinate of the search circle center
+        :param float radius: Radius of the search circle
+        :return: Sorted NumPy array of the coin indices
+        """
+        self.center[0] = x_ref
+        self.center[1] = y_ref
+        np.subtract(self.points, self.center, out=self.diff)
+        np.einsum('ij,ij->i', self.diff, self.diff,
+                  out=self.distance_squares)
+        np.less_equal(self.distance_squares, radius*radius, out=self.inside)
+        return np.flatnonzero(self.inside)
+
+
+class GridIndex:
+    """Uniform grid (bucketed) spatial index over the gold field.
+
+    The bounding box of the field is divided into square cells of size
+    cell_size. The coins are sorted by their cell id (row major order) so
+    that the coins of any cell, and of any horizontal run of cells, are
+    stored contiguously. A circle query then only examines the rows of cells
+    that overlap the bounding box of the circle.
+
+    A good choice of cell_size is of the order of the search radius. A much
+    smaller cell size increases the memory taken by the cell offsets whereas a
+    much larger one increases the number of candidate coins per query.
+
+    :ivar float cell_size: Side of a square grid cell
+    :ivar int num_x_cells: Number of cells along the X axis
+    :ivar int num_y_cells: Number of cells along the Y axis
+    :ivar order: Permutation that sorts the coins by their cell id
+    :ivar cell_start: Offsets of each cell in the sorted coin arrays. The
+           coins of cell c are at positions cell_start[c]:cell_start[c+1].
+    :ivar x_sorted: X coordinates of the coins in the cell order
+    :ivar y_sorted: Y coordinates of the coins in the cell order
+    """
+    def __init__(self, x_list, y_list, cell_size):
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive, got %r" % cell_size)
+        x_list = np.asarray(x_list)
+        y_list = np.asarray(y_list)
+        self.cell_size = float(cell_size)
+
+        if x_list.size:
+            self.x_min, self.y_min = x_list.min(), y_list.min()
+            x_span = x_list.max() - self.x_min
+            y_span = y_list.max() - self.y_min
+        else:
+            self.x_min = self.y_min = 0.0
+            x_span = y_span = 0.0
+        self.num_x_cells = int(x_span // self.cell_size) + 1
+        self.num_y_cells = int(y_span // self.cell_size) + 1
+
+        cell_ids = self._cell_ids(x_list, y_list)
+        # A stable sort keeps the coins of a cell in their original order.
+        self.order = np.argsort(cell_ids, kind='stable')
+        counts = np.bincount(cell_ids,
+                             minlength=self.num_x_cells*self.num_y_cells)
+        self.cell_start = np.zeros(counts.size + 1, dtype=np.intp)
+        np.cumsum(counts, out=self.cell_start[1:])
+
+        self.x_sorted = x_list[self.order]
+        self.y_sorted = y_list[self.order]
+
+    def _cell_ids(self, x_list, y_list):
+        """Return the (row major) cell id of each of the given points."""
+        cols = ((x_list - self.x_min) // self.cell_size).astype(np.intp)
+        rows = ((y_list - self.y_min) // self.cell_size).astype(np.intp)
+        # Guard against round off at the far edge of the bounding box.
+        np.clip(cols, 0, self.num_x_cells - 1, out=cols)
+        np.clip(rows, 0, self.num_y_cells - 1, out=rows)
+        return rows*self.num_x_cells + cols
+
+    def candidates(self, x_ref, y_ref, radius):
+        """Return positions (in the sorted arrays) of the candidate coins.
+
+        The candidates are all the coins in the grid cells that overlap the
+        bounding box of the circle. These still need the exact distance test.
+
+        :param float x_ref: X-coordinate of the search circle center
+        :param float y_ref: Y-coordinate of the search circle center
+        :param float radius: Radius of the search circle
+        :return: NumPy integer array of positions into x_sorted, y_sorted
+        """
+        cell = self.cell_size
+        col_lo = int((x_ref - radius - self.x_min) // cell)
+        col_hi = int((x_ref + radius - self.x_min) // cell)
+        row_lo = int((y_ref - radius - self.y_min) // cell)
+        row_hi = int((y_ref + radius - self.y_min) // cell)
+        if (col_hi < 0 or row_hi < 0 or col_lo >= self.num_x_cells or
+                row_lo >= self.num_y_cells):
+            # The circle doesn't overlap the field at all.
+            return np.empty(0, dtype=np.intp)
+
+        col_lo = max(col_lo, 0)
+        col_hi = min(col_hi, self.num_x_cells - 1)
+        rows = np.arange(max(row_lo, 0), min(row_hi, self.num_y_cells - 1) + 1)
+        # The cells col_lo..col_hi of a given row are adjacent in the sorted
+        # order, so each row of cells is one contiguous slice.
+        first_cells = rows*self.num_x_cells + col_lo
+        starts = self.cell_start[first_cells]
+        stops = self.cell_start[first_cells + (col_hi - col_lo + 1)]
+        return concatenate_ranges(starts, stops)
+
+    def query(self, x_ref, y_ref, radius):
+        """Return indices of the coins within the given circle.
+
+        :param float x_ref: X-coordinate of the search circle center
+        :param float y_ref: Y-coordinate of the search circle center
+        :param float radius: Radius of the search circle
+        :return: Sorted NumPy array of the coin indices
+        """
+        positions = self.candidates(x_ref, y_ref, radius)
+        delta_x = self.x_sorted[positions] - x_ref
+        delta_y = self.y_sorted[positions] - y_ref
+        inside = delta_x*delta_x + delta_y*delta_y <= radius*radius
+        return np.sort(self.order[positions[inside]])
+
+    def compact(self, keep):
+        """Remove coins from the index without rebuilding it.
+
+        The grid (bounding box and cells) doesn't change. The removed coins
+        are simply dropped from the sorted arrays and the cell offsets are
+        shifted accordingly. Afterwards, the index refers to the compacted
+        field x_list[keep], y_list[keep].
+
+        :param keep: Boolean NumPy array, True for the coins to be kept
+           (one entry per coin of the field the index was built for)
+        """
+        kept = keep[self.order]
+        self.order = (np.cumsum(keep) - 1)[self.order[kept]]
+        self.x_sorted = self.x_sorted[kept]
+        self.y_sorted = self.y_sorted[kept]
+        kept_before = np.zeros(kept.size + 1, dtype=np.intp)
+        np.cumsum(kept, out=kept_before[1:])
+        self.cell_start = kept_before[self.cell_start]
+
+
+class BandIndex:
+    """Index that keeps the coins sorted by their x coordinate.
+
+    GoldHunt.play always moves the search circle along the X axis. Only the
+    coins with abs(x - x_ref) <= radius can lie inside a circle and, with
+    the coins sorted by x, these form one contiguous band. The band limits
+    are found with np.searchsorted (binary search) and only the coins of
+    the band are given the exact distance test. The cost of a query is thus
+    proportional to the size of the band instead of the whole field.
+
+    :ivar order: Permutation that sorts the coins by their x coordinate
+    :ivar x_sorted: X coordinates of the coins in the ascending order
+    :ivar y_sorted: Y coordinates of the coins in the same order as x_sorted
+    """
+    def __init__(self, x_list, y_list):
+        x_list = np.asarray(x_list)
+        self.order = np.argsort(x_list, kind='stable')
+        self.x_sorted = x_list[self.order]
+        self.y_sorted = np.asarray(y_list)[self.order]
+
+    def band(self, x_ref, radius):
+        """Return the slice of the sorted arrays with abs(x - x_ref) <= radius.
+
+        :param float x_ref: X-coordinate of the search circle center
+        :param float radius: Radius of the search circle
+        :return: A slice object for x_sorted, y_sorted and order
+        """
+        start = np.searchsorted(self.x_sorted, x_ref - radius, side='left')
+        stop = np.searchsorted(self.x_sorted, x_ref + radius, side='right')
+        return slice(start, stop)
+
+    def query(self, x_ref, y_ref, radius):
+        """Return indices of the coins within the given circle.
+
+        :param float x_ref: X-coordinate of the search circle center
+        :param float y_ref: Y-coordinate of the search circle center
+        :param float radius: Radius of the search circle
+        :return: Sorted NumPy array of the coin indices
+        """
+        band = self.band(x_ref, radius)
+        delta_x = self.x_sorted[band] - x_ref
+        delta_y = self.y_sorted[band] - y_ref
+        inside = np.flatnonzero(delta_x*delta_x + delta_y*delta_y <=
+                                radius*radius)
+        return np.sort(self.order[band][inside])
+
+    def compact(self, keep):
+        """Remove coins from the index without sorting it again.
+
+        :param keep: Boolean NumPy array, True for the coins to be kept.
+           See GridIndex.compact.
+        """
+        kept = keep[self.order]
+        self.order = (np.cumsum(keep) - 1)[self.order[kept]]
+        self.x_sorted = self.x_sorted[kept]
+        self.y_sorted = self.y_sorted[kept]
+
+
+class QuadTree:
+    """Quadtree over the gold field that stores a coin count in every node.
+
+    Each node covers a square region. A node with more than leaf_size coins
+    is split into four equal quadrants. The coins are kept sorted such that
+    the coins of every node (at any level) are stored contiguously, in the
+    range start:stop of the sorted arrays. The number of coins in a node
+    (its subtree count) is thus simply stop - start.
+
+    During a circle query, a node that lies completely inside the circle
+    contributes all its coins without any distance computation, and a node
+    that lies completely outside is skipped. Only the coins in the leaf
+    nodes crossed by the circle boundary need the exact distance test.
+    When only the number of coins is needed, use count instead of query.
+    It never creates the arrays of the coin indices.
+
+    The nodes are stored in 'structure of arrays' form. Node 0 is the root.
+
+    :ivar int leaf_size: Maximum number of coins in a leaf node
+    :ivar order: Permutation that sorts the coins in the tree order
+    :ivar x_sorted: X coordinates of the coins in the tree order
+    :ivar y_sorted: Y coordinates of the coins in the tree order
+    :ivar node_bounds: Array of shape (num_nodes, 4) with the (x_min, y_min,
+           x_max, y_max) bounds of each node
+    :ivar node_start: Start of each node's range in the sorted arrays
+    :ivar node_stop: Stop (exclusive) of each node's range
+    :ivar node_child: Index of the first of the four children of each node,
+           or -1 for a leaf node. The children are stored consecutively.
+    """
+    max_depth = 32
+
+    def __init__(self, x_list, y_list, leaf_size=64):
+        if leaf_size < 1:
+            raise ValueError("leaf_size must be at least 1, got %r"
+                             % leaf_size)
+        x_list = np.asarray(x_list)
+        y_list = np.asarray(y_list)
+        self.leaf_size = leaf_size
+        order = np.arange(x_list.size, dtype=np.intp)
+
+        if x_list.size:
+            x_min, y_min = x_list.min(), y_list.min()
+            side = max(x_list.max() - x_min, y_list.max() - y_min)
+        else:
+            x_min = y_min = side = 0.0
+        bounds = [(x_min, y_min, x_min + side, y_min + side)]
+        starts, stops, children = [0], [x_list.size], [-1]
+
+        # Iterative build. Each stack entry is (node id, depth).
+        stack = [(0, 0)]
+        while stack:
+            node, depth = stack.pop()
+            start, stop = starts[node], stops[node]
+            if stop - start <= leaf_size or depth >= self.max_depth:
+                continue
+            nx0, ny0, nx1, ny1 = bounds[node]
+            x_mid = 0.5*(nx0 + nx1)
+            y_mid = 0.5*(ny0 + ny1)
+            members = order[start:stop]
+            # Quadrant code 0..3 : (x >= x_mid) + 2*(y >= y_mid)
+            quadrant = ((x_list[members] >= x_mid).astype(np.intp) +
+                        2*(y_list[members] >= y_mid))
+            order[start:stop] = members[np.argsort(quadrant, kind='stable')]
+            offsets = start + np.concatenate(
+                ([0], np.cumsum(np.bincount(quadrant, minlength=4))))
+
+            children[node] = len(starts)
+            quadrant_bounds = [(nx0, ny0, x_mid, y_mid),
+                               (x_mid, ny0, nx1, y_mid),
+                               (nx0, y_mid, x_mid, ny1),
+                               (x_mid, y_mid, nx1, ny1)]
+            for q in range(4):
+                stack.append((len(starts), depth + 1))
+                bounds.append(quadrant_bounds[q])
+                starts.append(int(offsets[q]))
+                stops.append(int(offsets[q + 1]))
+                children.append(-1)
+
+        self.order = order
+        self.x_sorted = x_list[order]
+        self.y_sorted = y_list[order]
+        self.node_bounds = np.array(bounds, dtype=float).reshape(-1, 4)
+        self.node_start = np.array(starts, dtype=np.intp)
+        self.node_stop = np.array(stops, dtype=np.intp)
+        self.node_child = np.array(children, dtype=np.intp)
+        # The tree walk visits only a few nodes per query. Plain Python
+        # lists (and scalar arithmetic) are faster than NumPy for that.
+        self._bounds_list = self.node_bounds.tolist()
+        self._size_list = (self.node_stop - self.node_start).tolist()
+        self._child_list = children
+
+    def _walk(self, x_ref, y_ref, radius):
+        """Classify the nodes of the tree for the given circle.
+
+        :return: A tuple (inside_nodes, boundary_leaves). All the coins of
+           the nodes in inside_nodes lie within the circle. The coins of the
+           leaves in boundary_leaves need the exact distance test.
+        """
+        radius_square = radius*radius
+        bounds = self._bounds_list
+        sizes = self._size_list
+        children = self._child_list
+        inside_nodes = []
+        boundary_leaves = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if not sizes[node]:
+                continue
+            nx0, ny0, nx1, ny1 = bounds[node]
+            # Squared distance to the nearest point of the node square
+            near_x = max(nx0 - x_ref, 0.0, x_ref - nx1)
+            near_y = max(ny0 - y_ref, 0.0, y_ref - ny1)
+            if near_x*near_x + near_y*near_y > radius_square:
+                continue
+            # Squared distance to the farthest corner of the node square
+            far_x = max(x_ref - nx0, nx1 - x_ref)
+            far_y = max(y_ref - ny0, ny1 - y_ref)
+            if far_x*far_x + far_y*far_y <= radius_square:
+                inside_nodes.append(node)
+            elif children[node] < 0:
+                boundary_leaves.append(node)
+            else:
+                first = children[node]
+                stack.extend((first, first + 1, first + 2, first + 3))
+        return inside_nodes, boundary_leaves
+
+    def _boundary_positions(self, boundary_leaves, x_ref, y_ref, radius):
+        """Return positions of the coins in boundary_leaves inside the circle.
+        """
+        positions = concatenate_ranges(self.node_start[boundary_leaves],
+                                       self.node_stop[boundary_leaves])
+        delta_x = self.x_sorted[positions] - x_ref
+        delta_y = self.y_sorted[positions] - y_ref
+        return positions[delta_x*delta_x + delta_y*delta_y <= radius*radius]
+
+    def count(self, x_ref, y_ref, radius):
+        """Return the number of coins within the given circle.
+
+        :param float x_ref: X-coordinate of the search circle center
+        :param float y_ref: Y-coordinate of the search circle center
+        :param float radius: Radius of the search circle
+        :return: Number of coins inside the circle (int)
+        """
+        inside_nodes, boundary_leaves = self._walk(x_ref, y_ref, radius)
+        total = int((self.node_stop[inside_nodes] -
+                     self.node_start[inside_nodes]).sum())
+        return total + self._boundary_positions(boundary_leaves, x_ref,
+                                                y_ref, radius).size
+
+    def query(self, x_ref, y_ref, radius):
+        """Return indices of the coins within the given circle.
+
+        :param float x_ref: X-coordinate of the search circle center
+        :param float y_ref: Y-coordinate of the search circle center
+        :param float radius: Radius of the search circle
+        :return: Sorted NumPy array of the coin indices
+        """
+        inside_nodes, boundary_leaves = self._walk(x_ref, y_ref, radius)
+        positions = np.concatenate((
+            concatenate_ranges(self.node_start[inside_nodes],
+                               self.node_stop[inside_nodes]),
+            self._boundary_positions(boundary_leaves, x_ref, y_ref, radius)))
+        return np.sort(self.order[positions])
+
+
+class PolarIndex:
+    """Index that buckets the coins by radial ring and angular sector.
+
+    The gold field is a disk centered at (0, 0) and generate_random_points
+    creates it by picking a polar angle theta and a radius for each coin.
+    This index uses that polar structure directly. It can be built from the
+    theta and radius arrays without converting them to x, y coordinates.
+
+    The rings have equal areas (the ring edges are at
+    max_radius*sqrt(k/num_rings)), so for a uniform field every ring holds
+    about the same number of coins. For a search circle, the rings outside
+    its radial extent and the sectors outside its angular extent are
+    rejected as a whole before any per-coin computation.
+
+    :ivar int num_rings: Number of radial rings
+    :ivar int num_sectors: Number of angular sectors
+    :ivar ring_edges: Array of the num_rings + 1 radial ring edges
+    :ivar order: Permutation that sorts the coins by their (ring, sector)
+    :ivar cell_start: Offsets of each (ring, sector) cell in the sorted
+           arrays. Cell id is ring*num_sectors + sector.
+    """
+    def __init__(self, theta, radius, num_rings=64, num_sectors=256,
+                 x_list=None, y_list=None):
+        if num_rings < 1 or num_sectors < 1:
+            raise ValueError("num_rings and num_sectors must be at least 1")
+        theta = np.mod(np.asarray(theta), 2.0*np.pi)
+        radius = np.asarray(radius)
+        self.num_rings = num_rings
+        self.num_sectors = num_sectors
+        max_radius = radius.max() if radius.size else 0.0
+        self.ring_edges = max_radius*np.sqrt(
+            np.arange(num_rings + 1)/float(num_rings))
+
+        # Ring number from the equal area rule. Clip for round off.
+        if max_radius > 0:
+            rings = (num_rings*(radius/max_radius)**2).astype(np.intp)
+        else:
+            rings = np.zeros(radius.size, dtype=np.intp)
+        np.clip(rings, 0, num_rings - 1, out=rings)
+        self.sector_width = 2.0*np.pi/num_sectors
+        sectors = (theta//self.sector_width).astype(np.intp)
+        np.clip(sectors, 0, num_sectors - 1, out=sectors)
+
+        cell_ids = rings*num_sectors + sectors
+        self.order = np.argsort(cell_ids, kind='stable')
+        self.cell_start = np.zeros(num_rings*num_sectors + 1, dtype=np.intp)
+        np.cumsum(np.bincount(cell_ids, minlength=num_rings*num_sectors),
+                  out=self.cell_start[1:])
+        self.theta_sorted = theta[self.order]
+        self.radius_sorted = radius[self.order]
+        if x_list is None:
+            self.x_sorted = self.y_sorted = None
+        else:
+            self.x_sorted = np.asarray(x_list)[self.order]
+            self.y_sorted = np.asarray(y_list)[self.order]
+
+    @classmethod
+    def from_xy(cls, x_list, y_list, num_rings=64, num_sectors=256):
+        """Build the index from the x, y coordinates of the coins.
+
+        The x, y arrays are also kept. These are used for the exact
+        distance test, so the results match the other indices exactly.
+        """
+        x_list = np.asarray(x_list)
+        y_list = np.asarray(y_list)
+        return cls(np.arctan2(y_list, x_list), np.hypot(x_list, y_list),
+                   num_rings, num_sectors, x_list, y_list)
+
+    def candidate_cells(self, x_ref, y_ref, radius):
+        """Return ids of the (ring, sector) cells that may overlap the circle.
+
+        :param float x_ref: X-coordinate of the search circle center
+        :param float y_ref: Y-coordinate of the search circle center
+        :param float radius: Radius of the search circle
+        :return: NumPy integer array of cell ids
+        """
+        center_dist = np.hypot(x_ref, y_ref)
+        ring_lo = np.searchsorted(self.ring_edges, center_dist - radius,
+                                  side='right') - 1
+        ring_hi = np.searchsorted(self.ring_edges, center_dist + radius,
+                                  side='left')
+        # One extra ring (and sector) on each side guards against the round
+        # off in the ring and sector numbers computed in __init__.
+        rings = np.arange(max(ring_lo - 1, 0),
+                          min(ring_hi + 1, self.num_rings))
+
+        if center_dist <= radius:
+            # The circle contains the origin: every direction is possible.
+            sectors = np.arange(self.num_sectors)
+        else:
+            phi = np.arctan2(y_ref, x_ref)
+            half_width = np.arcsin(radius/center_dist)
+            sector_lo = int((phi - half_width)//self.sector_width) - 1
+            sector_hi = int((phi + half_width)//self.sector_width) + 1
+            if sector_hi - sector_lo + 1 >= self.num_sectors:
+                sectors = np.arange(self.num_sectors)
+            else:
+                sectors = np.arange(sector_lo, sector_hi + 1) % \
+                    self.num_sectors
+        return (rings[:, np.newaxis]*self.num_sectors +
+                sectors[np.newaxis, :]).ravel()
+
+    def query(self, x_ref, y_ref, radius):
+        """Return indices of the coins within the given circle.
+
+        :param float x_ref: X-coordinate of the search circle center
+        :param float y_ref: Y-coordinate of the search circle center
+        :param float radius: Radius of the search circle
+        :return: Sorted NumPy array of the coin indices
+        """
+        cells = self.candidate_cells(x_ref, y_ref, radius)
+        positions = concatenate_ranges(self.cell_start[cells],
+                                       self.cell_start[cells + 1])
+        if self.x_sorted is None:
+            # Cartesian coordinates of the candidates only. This is the
+            # same computation as in generate_random_points.
+            radius_c = self.radius_sorted[positions]
+            theta_c = self.theta_sorted[positions]
+            delta_x = radius_c*np.cos(theta_c) - x_ref
+            delta_y = radius_c*np.sin(theta_c) - y_ref
+        else:
+            delta_x = self.x_sorted[positions] - x_ref
+            delta_y = self.y_sorted[positions] - y_ref
+        inside = delta_x*delta_x + delta_y*delta_y <= radius*radius
+        return np.sort(self.order[positions[inside]])
+
+
+class SummedAreaTable:
+    """Summed-area table (integral image) of the gold field for fast counts.
+
+    The field is rasterized once into a 2D histogram of resolution x
+    resolution square cells. The summed-area table holds, at [j, i], the
+    number of coins in the cell rows below j and the cell columns left of
+    i. The count of any rectangle of cells is then found with only four
+    table lookups (see rect_count).
+
+    A circle is treated as a stack of cell rows. The coins of the row
+    segment covered by the circle are read from the table in constant time,
+    so the cost of a circle count depends on the resolution but not on the
+    number of coins. The count is approximate: the cells crossed by the
+    circle boundary are included in proportion to the covered part of the
+    cell (assuming the coins are uniformly spread within a cell). The
+    coins in these boundary cells give a strict error bound.
+
+    :ivar int resolution: Number of cells along each axis
+    :ivar float cell_size: Side of a square cell
+    :ivar float x_min: X-coordinate of the left edge of the table
+    :ivar float y_min: Y-coordinate of the bottom edge of the table
+    :ivar table: NumPy integer array of shape (resolution + 1,
+           resolution + 1) holding the summed-area table
+    """
+    def __init__(self, x_list, y_list, resolution=1024, extent=None):
+        if resolution < 1:
+            raise ValueError("resolution must be at least 1, got %r"
+                             % resolution)
+        x_list = np.asarray(x_list)
+        y_list = np.asarray(y_list)
+        if extent is None:
+            if x_list.size:
+                extent = (x_list.min(), y_list.min(), x_list.max(),
+                          y_list.max())
+            else:
+                extent = (0.0, 0.0, 1.0, 1.0)
+        x_min, y_min, x_max, y_max = [float(e) for e in extent]
+        self.resolution = resolution
+        self.x_min = x_min
+        self.y_min = y_min
+        # Square cells. A tiny margin keeps the coins on the far edge inside.
+        side = max(x_max - x_min, y_max - y_min)
+        self.cell_size = (side or 1.0)*(1 + 1e-9)/resolution
+
+        side_cells = self.cell_size*resolution
+        counts, _, _ = np.histogram2d(
+            y_list, x_list, bins=resolution,
+            range=[[y_min, y_min + side_cells], [x_min, x_min + side_cells]])
+        self.table = np.zeros((resolution + 1, resolution + 1),
+                              dtype=np.int64)
+        np.cumsum(np.cumsum(counts.astype(np.int64), axis=0), axis=1,
+                  out=self.table[1:, 1:])
+
+    def rect_count(self, row_lo, row_hi, col_lo, col_hi):
+        """Return the coins in the cell rows row_lo:row_hi, cols col_lo:col_hi.
+
+        The arguments can be NumPy arrays (vectorized lookups). The ranges
+        are half open, like Python slices, and must lie within the table.
+        """
+        t = self.table
+        return (t[row_hi, col_hi] - t[row_lo, col_hi] -
+                t[row_hi, col_lo] + t[row_lo, col_lo])
+
+    def _row_prefix(self, rows, u):
+        """Return the coins left of the fractional column u in each row.
+
+        Within a cell, the coins are assumed to be uniformly spread, so the
+        count is linearly interpolated between the cell edges.
+        """
+        n = self.resolution
+        u = np.clip(u, 0.0, n)
+        cols = np.minimum(u.astype(np.intp), n - 1)
+        left = self.rect_count(rows, rows + 1, 0, cols)
+        cell = self.rect_count(rows, rows + 1, cols, cols + 1)
+        return left + (u - cols)*cell
+
+    def count_many(self, centers, radii):
+        """Return the approximate coin counts of many circles.
+
+        :param centers: Sequence of (x, y) circle centers, shape (M, 2)
+        :param radii: A single radius or a sequence of M radii
+        :return: A tuple of NumPy arrays (estimate, lower, upper). The exact
+           count of circle k lies between lower[k] and upper[k].
+        """
+        centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+        num_circles = len(centers)
+        radii = np.broadcast_to(np.asarray(radii, dtype=float),
+                                (num_circles,))
+        n = self.resolution
+        h = self.cell_size
+        if num_circles == 0:
+            empty = np.zeros(0)
+            return empty, empty.astype(np.int64), empty.astype(np.int64)
+
+        # Work in the cell units. Shape of the arrays below is
+        # (circles, rows of the circle).
+        cx = ((centers[:, 0] - self.x_min)/h)[:, np.newaxis]
+        cy = ((centers[:, 1] - self.y_min)/h)[:, np.newaxis]
+        r = (radii/h)[:, np.newaxis]
+        num_rows = int(np.ceil(2*r.max())) + 2
+        first_row = np.floor(cy - r).astype(np.intp)
+        rows = first_row + np.arange(num_rows)[np.newaxis, :]
+        valid = (rows >= 0) & (rows < n) & (rows <= cy + r)
+        rows = np.clip(rows, 0, n - 1)
+
+        # Vertical distance from the center to the nearest and the farthest
+        # edge of each cell row.
+        near_dy = np.maximum(np.maximum(rows - cy, cy - (rows + 1)), 0.0)
+        far_dy = np.maximum(np.abs(rows - cy), np.abs(rows + 1 - cy))
+        mid_dy = rows + 0.5 - cy
+        r_sq = r*r
+        valid &= near_dy*near_dy <= r_sq
+        outer = np.sqrt(np.maximum(r_sq - near_dy*near_dy, 0.0))
+        inner = np.sqrt(np.maximum(r_sq - far_dy*far_dy, 0.0))
+        inner[far_dy > r] = -1.0
+        middle = np.sqrt(np.maximum(r_sq - mid_dy*mid_dy, 0.0))
+
+        # Upper bound: every cell touched by the circle in this row.
+        col_lo = np.clip(np.floor(cx - outer), 0, n).astype(np.intp)
+        col_hi = np.clip(np.floor(cx + outer) + 1, 0, n).astype(np.intp)
+        upper = np.where(valid, self.rect_count(rows, rows + 1,
+                                                col_lo, col_hi), 0)
+        # Lower bound: only the cells completely inside the circle.
+        col_lo = np.clip(np.ceil(cx - inner), 0, n).astype(np.intp)
+        col_hi = np.clip(np.floor(cx + inner), 0, n).astype(np.intp)
+        inside = valid & (inner >= 0) & (col_hi > col_lo)
+        lower = np.where(inside, self.rect_count(rows, rows + 1, col_lo,
+                                                 np.maximum(col_hi, col_lo)),
+                         0)
+        # Estimate: chord through the middle of the row, fractional cells.
+        estimate = np.where(valid, self._row_prefix(rows, cx + middle) -
+                            self._row_prefix(rows, cx - middle), 0.0)
+
+        lower = lower.sum(axis=1)
+        upper = upper.sum(axis=1)
+        estimate = np.clip(estimate.sum(axis=1), lower, upper)
+        return estimate, lower, upper
+
+    def count(self, x_ref, y_ref, radius):
+        """Return the approximate number of coins within the given circle.
+
+        :param float x_ref: X-coordinate of the search circle center
+        :param float y_ref: Y-coordinate of the search circle center
+        :param float radius: Radius of the search circle
+        :return: A tuple (estimate, lower, upper). The exact count lies
+           between the lower and upper bounds.
+        """
+        estimate, lower, upper = self.count_many([(x_ref, y_ref)], radius)
+        return float(estimate[0]), int(lower[0]), int(upper[0])
+
+
+class KDTree:
+    """2D tree for the 'k nearest coins' queries (and circle queries).
+
+    The tree is built by recursively splitting the coins at the median of
+    the wider axis of their bounding box, until a node holds at most
+    leaf_size coins. As in the QuadTree, the coins are reordered so that
+    every node owns a contiguous range of the sorted arrays. Each node also
+    stores the tight bounding box of its coins.
+
+    A nearest neighbor query visits the nodes in the order of their
+    distance from the query point (best first search with a heap) and stops
+    as soon as the nearest remaining node is farther than the k-th best
+    coin found so far. For a balanced tree this takes logarithmic time per
+    query.
+
+    :ivar int leaf_size: Maximum number of coins in a leaf node
+    :ivar order: Permutation that sorts the coins in the tree order
+    :ivar x_sorted: X coordinates of the coins in the tree order
+    :ivar y_sorted: Y coordinates of the coins in the tree order
+    :ivar node_bounds: Array of shape (num_nodes, 4) with the tight
+           (x_min, y_min, x_max, y_max) bounding box of each node
+    :ivar node_start: Start of each node's range in the sorted arrays
+    :ivar node_stop: Stop (exclusive) of each node's range
+    :ivar node_child: Index of the first of the two children of each node,
+           or -1 for a leaf node.
+    """
+    def __init__(self, x_list, y_list, leaf_size=32):
+        if leaf_size < 1:
+            raise ValueError("leaf_size must be at least 1, got %r"
+                             % leaf_size)
+        x_list = np.asarray(x_list)
+        y_list = np.asarray(y_list)
+        self.leaf_size = leaf_size
+        order = np.arange(x_list.size, dtype=np.intp)
+        bounds, starts, stops, children = [], [], [], []
+
+        def add_node(start, stop):
+            members = order[start:stop]
+            if stop > start:
+                bounds.append((x_list[members].min(), y_list[members].min(),
+                               x_list[members].max(), y_list[members].max()))
+            else:
+                bounds.append((np.inf, np.inf, -np.inf, -np.inf))
+            starts.append(start)
+            stops.append(stop)
+            children.append(-1)
+            return len(starts) - 1
+
+        stack = [add_node(0, x_list.size)]
+        while stack:
+            node = stack.pop()
+            start, stop = starts[node], stops[node]
+            if stop - start <= leaf_size:
+                continue
+            nx0, ny0, nx1, ny1 = bounds[node]
+            coords = x_list if nx1 - nx0 >= ny1 - ny0 else y_list
+            members = order[start:stop]
+            half = (stop - start)//2
+            # Put the median coin at position 'half', the smaller values
+            # before it and the larger ones after it.
+            order[start:stop] = members[np.argpartition(coords[members],
+                                                        half)]
+            children[node] = add_node(start, start + half)
+            add_node(start + half, stop)
+            stack.extend((children[node], children[node] + 1))
+
+        self.order = order
+        self.x_sorted = x_list[order]
+        self.y_sorted = y_list[order]
+        self.node_bounds = np.array(bounds, dtype=float).reshape(-1, 4)
+        self.node_start = np.array(starts, dtype=np.intp)
+        self.node_stop = np.array(stops, dtype=np.intp)
+        self.node_child = np.array(children, dtype=np.intp)
+        # Plain Python lists are faster for the node by node traversal.
+        self._bounds_list = self.node_bounds.tolist()
+        self._child_list = children
+
+    def _nearest_one(self, x_ref, y_ref, k):
+        """Return the sorted positions and distance squares of k nearest."""
+        bounds = self._bounds_list
+        children = self._child_list
+        best_dist = np.empty(0)
+        best_pos = np.empty(0, dtype=np.intp)
+        worst = np.inf
+        heap = [(0.0, 0)]
+        while heap:
+            node_dist, node = heapq.heappop(heap)
+            if node_dist > worst:
+                break
+            first = children[node]
+            if first < 0:
+                start, stop = self.node_start[node], self.node_stop[node]
+                delta_x = self.x_sorted[start:stop] - x_ref
+                delta_y = self.y_sorted[start:stop] - y_ref
+                best_dist = np.concatenate(
+                    (best_dist, delta_x*delta_x + delta_y*delta_y))
+                best_pos = np.concatenate(
+                    (best_pos, np.arange(start, stop, dtype=np.intp)))
+                if best_dist.size > k:
+                    keep = np.argpartition(best_dist, k - 1)[:k]
+                    best_dist = best_dist[keep]
+                    best_pos = best_pos[keep]
+                if best_dist.size == k:
+                    worst = best_dist.max()
+                continue
+            for child in (first, first + 1):
+                nx0, ny0, nx1, ny1 = bounds[child]
+                near_x = max(nx0 - x_ref, 0.0, x_ref - nx1)
+                near_y = max(ny0 - y_ref, 0.0, y_ref - ny1)
+                child_dist = near_x*near_x + near_y*near_y
+                if child_dist <= worst:
+                    heapq.heappush(heap, (child_dist, child))
+        # Sort by the distance. Ties are broken by the original coin index.
+        ranking = np.lexsort((self.order[best_pos], best_dist))
+        return best_pos[ranking], best_dist[ranking]
+
+    def nearest(self, centers, k=1):
+        """Return the k coins nearest to each of the given centers.
+
+        :param centers: Sequence of (x, y) query points, shape (M, 2)
+        :param int k: Number of nearest coins wanted per query point. It is
+           limited to the number of coins in the field.
+        :return: A tuple (coin_ids, distances) of NumPy arrays of shape
+           (M, k). Row m holds the indices of the coins nearest to the
+           center m, and their distances, in the ascending distance order.
+        :raise ValueError: If k is negative
+        """
+        if k < 0:
+            raise ValueError("k must not be negative, got %r" % k)
+        centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+        k = min(int(k), self.order.size)
+        coin_ids = np.empty((len(centers), k), dtype=np.intp)
+        dist_squares = np.empty((len(centers), k))
+        if k > 0:
+            for m, (x_ref, y_ref) in enumerate(centers.tolist()):
+                positions, dist_squares[m] = self._nearest_one(x_ref, y_ref,
+                                                               k)
+                coin_ids[m] = self.order[positions]
+        return coin_ids, np.sqrt(dist_squares)
+
+    def query(self, x_ref, y_ref, radius):
+        """Return indices of the coins within the given circle.
+
+        :param float x_ref: X-coordinate of the search circle center
+        :param float y_ref: Y-coordinate of the search circle center
+        :param float radius: Radius of the search circle
+        :return: Sorted NumPy array of the coin indices
+        """
+        bounds = self._bounds_list
+        children = self._child_list
+        radius_square = radius*radius
+        leaves = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            nx0, ny0, nx1, ny1 = bounds[node]
+            near_x = max(nx0 - x_ref, 0.0, x_ref - nx1)
+            near_y = max(ny0 - y_ref, 0.0, y_ref - ny1)
+            if near_x*near_x + near_y*near_y > radius_square:
+                continue
+            first = children[node]
+            if first < 0:
+                leaves.append(node)
+            else:
+                stack.extend((first, first + 1))
+        positions = concatenate_ranges(self.node_start[leaves],
+                                       self.node_stop[leaves])
+        delta_x = self.x_sorted[positions] - x_ref
+        delta_y = self.y_sorted[positions] - y_ref
+        inside = delta_x*delta_x + delta_y*delta_y <= radius_square
+        return np.sort(self.order[positions[inside]])
@@ -0,0 +1,249 @@
+"""goldhunt_io
+
+This module contains functions to save and load the gold fields and the
+hunt results (see goldhunt_results.HuntResult) in a compact binary format,
+and to import the coin positions from CSV files.
+
+Both the binary files start with a fixed size (64 byte) header, followed
+by raw little-endian columns. The columns are not parsed when the file is
+loaded. The file is memory mapped and the columns are wrapped with
+np.frombuffer, so even a multi-GB field is 'loaded' instantly and only
+the pages that are actually used are read from the disk.
+
+Field file (.ghf)::
+
+    header   magic b'GHFIELD1', version, bytes per float, number of coins,
+             field radius (NaN if unknown)
+    x        num_coins little-endian floats (float32 or float64)
+    y        num_coins little-endian floats
+
+Result file (.ghr)::
+
+    header        magic b'GHRESLT1', version, bytes per coin index, number
+                  of circles, number of collected coins
+    circle_start  num_circles + 1 little-endian int64 offsets
+    centers       num_circles x 2 little-endian float64 (x, y) circle
+                  centers (NaN if unknown)
+    coin_ids      num_coins little-endian int32 or int64 coin indices
+
+This module is compatible with Python 3.5.x. It contains
+supporting code for the book, Learning Python Application Development,
+Packt Publishing.
+
+:copyright: 2016, Ninad Sathaye
+
+:license: The MIT License (MIT) . See LICENSE file for further details.
+"""
+from __future__ import print_function
+import itertools
+import mmap
+import os
+import shutil
+import struct
+import numpy as np
+
+from goldhunt_field import field_dtype
+from goldhunt_results import HuntResult
+
+FIELD_MAGIC = b'GHFIELD1'
+RESULT_MAGIC = b'GHRESLT1'
+FORMAT_VERSION = 1
+HEADER_SIZE = 64
+# magic, version, item size, two counts and the field radius (field files
+# only). The rest of the HEADER_SIZE bytes is zero padding.
+HEADER_FORMAT = '<8sIIQQd'
+
+
+def _pack_header(magic, itemsize, count, count2=0, value=float('nan')):
+    """Return the HEADER_SIZE bytes of a file header."""
+    header = struct.pack(HEADER_FORMAT, magic, FORMAT_VERSION, itemsize,
+                         count, count2, value)
+    return header.ljust(HEADER_SIZE, b'\0')
+
+
+def _unpack_header(buf, magic):
+    """Check and return (itemsize, count, count2, value) of a header."""
+    if len(buf) < HEADER_SIZE:
+        raise ValueError("The file is too short for a Gold Hunt header")
+    file_magic, version, itemsize, count, count2, value = struct.unpack_from(
+        HEADER_FORMAT, buf)
+    if file_magic != magic:
+        raise ValueError("Not a Gold Hunt {0} file (magic {1!r})".format(
+            magic.decode(), file_magic))
+    if version != FORMAT_VERSION:
+        raise ValueError("Unsupported file version {0}".format(version))
+    return itemsize, count, count2, value
+
+
+def _map_file(path):
+    """Return a read-only mmap of the whole file (or bytes if it is empty)."""
+    with open(path, 'rb') as fil:
+        if os.fstat(fil.fileno()).st_size == 0:
+            return b''
+        # The mapping stays valid after the file is closed.
+        return mmap.mmap(fil.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _check_size(buf, expected, path):
+    """Raise ValueError if the file doesn't have the expected size."""
+    if len(buf) != expected:
+        raise ValueError("{0}: expected {1} bytes, found {2}".format(
+            path, expected, len(buf)))
+
+
+def save_field(path, x_list, y_list, field_radius=None):
+    """Write a gold field to a binary field file.
+
+    :param path: Path of the file to be written
+    :param x_list: NumPy array of x coordinates of all the coins
+    :param y_list: NumPy array of y coordinates of all the coins
+    :param field_radius: Optional radius of the field, stored in the header
+    """
+    dtype = field_dtype(np.result_type(x_list, y_list)).newbyteorder('<')
+    if len(x_list) != len(y_list):
+        raise ValueError("x_list and y_list must have the same length")
+    radius = float('nan') if field_radius is None else field_radius
+    with open(path, 'wb') as fil:
+        fil.write(_pack_header(FIELD_MAGIC, dtype.itemsize, len(x_list),
+                               value=radius))
+        np.asarray(x_list, dtype=dtype).tofile(fil)
+        np.asarray(y_list, dtype=dtype).tofile(fil)
+
+
+def load_field(path):
+    """Return the coins of a binary field file, without parsing or copying.
+
+    :param path: Path of the field file
+    :return: A tuple (x_list, y_list, field_radius). The arrays are
+       read-only views of the memory mapped file. field_radius is None if
+       it was not stored.
+    """
+    buf = _map_file(path)
+    itemsize, num_coins, _, radius = _unpack_header(buf, FIELD_MAGIC)
+    if itemsize not in (4, 8):
+        raise ValueError("Unsupported float size {0}".format(itemsize))
+    dtype = np.dtype('<f{0}'.format(itemsize))
+    _check_size(buf, HEADER_SIZE + 2*num_coins*itemsize, path)
+    x_list = np.frombuffer(buf, dtype=dtype, count=num_coins,
+                           offset=HEADER_SIZE)
+    y_list = np.frombuffer(buf, dtype=dtype, count=num_coins,
+                           offset=HEADER_SIZE + num_coins*itemsize)
+    return x_list, y_list, (None if np.isnan(radius) else radius)
+
+
+def save_result(path, result, centers=None):
+    """Write a HuntResult (and the circle centers) to a binary result file.
+
+    :param path: Path of the file to be written
+    :param result: goldhunt_results.HuntResult instance
+    :param centers: Optional sequence of the (x, y) centers of the circles
+    """
+    index_dtype = result.coin_ids.dtype.newbyteorder('<')
+    if centers is None:
+        centers = np.full((result.num_circles, 2), np.nan)
+    centers = np.asarray(centers, dtype='<f8').reshape(-1, 2)
+    if len(centers) != result.num_circles:
+        raise ValueError("Expected {0} circle centers, got {1}".format(
+            result.num_circles, len(centers)))
+    with open(path, 'wb') as fil:
+        fil.write(_pack_header(RESULT_MAGIC, index_dtype.itemsize,
+                               result.num_circles, len(result)))
+        result.circle_start.astype('<i8').tofile(fil)
+        centers.tofile(fil)
+        result.coin_ids.astype(index_dtype).tofile(fil)
+
+
+def load_result(path):
+    """Return the HuntResult and the circle centers of a result file.
+
+    :param path: Path of the result file
+    :return: A tuple (result, centers). The arrays are read-only views of
+       the memory mapped file.
+    """
+    buf = _map_file(path)
+    itemsize, num_circles, num_coins, _ = _unpack_header(buf, RESULT_MAGIC)
+    _check_size(buf, HEADER_SIZE + 8*(num_circles + 1) +
+                16*num_circles + itemsize*num_coins, path)
+    offset = HEADER_SIZE
+    circle_start = np.frombuffer(buf, dtype='<i8', count=num_circles + 1,
+                                 offset=offset)
+    offset += circle_start.nbytes
+    centers = np.frombuffer(buf, dtype='<f8', count=2*num_circles,
+                            offset=offset).reshape(-1, 2)
+    offset += centers.nbytes
+    coin_ids = np.frombuffer(buf, dtype='<i{0}'.format(itemsize),
+                             count=num_coins, offset=offset)
+    return HuntResult(coin_ids, circle_start), centers
+
+
+def read_csv_chunks(path, chunk_rows=1000000, dtype=np.float64,
+                    columns=(0, 1), delimiter=',', skip_rows=0):
+    """Yield the coin coordinates of a CSV file, chunk_rows rows at a time.
+
+    Only one chunk is held in memory, so the chunks can be fed directly to
+    GoldHunt.stream_counts or written to a field file (see convert_csv).
+    The blank lines are skipped (a chunk may thus have fewer rows).
+
+    :param path: Path of the CSV file
+    :param chunk_rows: Maximum number of rows per chunk
+    :param dtype: float32 or float64, the type of the returned arrays
+    :param columns: Column numbers of the x and the y coordinate
+    :param delimiter: Column separator
+    :param skip_rows: Number of header lines to skip
+    :return: A generator of (x, y) tuples of NumPy arrays
+    """
+    dtype = field_dtype(dtype)
+    with open(path) as fil:
+        for _ in range(skip_rows):
+            next(fil, None)
+        while True:
+            lines = list(itertools.islice(fil, chunk_rows))
+            if not lines:
+                return
+            lines = [line for line in lines if line.strip()]
+            if not lines:
+                continue
+            data = np.loadtxt(lines, dtype=dtype, delimiter=delimiter,
+                              usecols=columns, ndmin=2)
+            yield data[:, 0].copy(), data[:, 1].copy()
+
+
+def convert_csv(csv_path, field_path, field_radius=None, **kwargs):
+    """Convert a CSV file of coin positions to a binary field file.
+
+    The CSV file is read in chunks (see read_csv_chunks for the keyword
+    arguments). The x column is written directly to the field file and the
+    y column to a temporary file that is appended at the end, so the memory
+    used doesn't depend on the size of the CSV file. The field file is
+    written under a temporary name and renamed once complete, so a CSV
+    file that fails to parse leaves no file behind.
+
+    :param csv_path: Path of the CSV file
+    :param field_path: Path of the field file to be written
+    :param field_radius: Optional radius of the field, stored in the header
+    :return: Number of coins written
+    """
+    dtype = field_dtype(kwargs.get('dtype', np.float64)).newbyteorder('<')
+    radius = float('nan') if field_radius is None else field_radius
+    num_coins = 0
+    temp_path = field_path + '.tmp'
+    y_path = field_path + '.y.tmp'
+    try:
+        with open(temp_path, 'wb') as fil, open(y_path, 'w+b') as y_fil:
+            fil.write(_pack_header(FIELD_MAGIC, dtype.itemsize, 0,
+                                   value=radius))
+            for x_chunk, y_chunk in read_csv_chunks(csv_path, **kwargs):
+                x_chunk.astype(dtype).tofile(fil)
+                y_chunk.astype(dtype).tofile(y_fil)
+                num_coins += x_chunk.size
+            y_fil.seek(0)
+            shutil.copyfileobj(y_fil, fil)
+            fil.seek(0)
+            fil.write(_pack_header(FIELD_MAGIC, dtype.itemsize, num_coins,
+                                   value=radius))
+        os.replace(temp_path, field_path)
+    finally:
+        for path in (temp_path, y_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return num_coins
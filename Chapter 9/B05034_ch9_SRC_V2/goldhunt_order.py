@@ -0,0 +1,144 @@
+"""goldhunt_order
+
+This module contains functions to reorder the gold field along a space
+filling curve (the Morton 'Z-order' curve or the Hilbert curve).
+
+The coins returned by generate_random_points are in a random order, so two
+coins that are close to each other on the field are usually far apart in
+the coordinate arrays. Any index or band query over such arrays jumps
+around the memory. Sorting the coins by their position along a space
+filling curve keeps the nearby coins (mostly) next to each other in the
+arrays, which makes better use of the CPU caches. The curve codes are
+computed for all the coins at once with NumPy bit operations.
+
+reorder_field also returns the permutation it applied, so the results
+found on the reordered field can still be reported with the original coin
+ids (see goldhunt_results.HuntResult.remap).
+
+This module is compatible with Python 3.5.x. It contains
+supporting code for the book, Learning Python Application Development,
+Packt Publishing.
+
+:copyright: 2016, Ninad Sathaye
+
+:license: The MIT License (MIT) . See LICENSE file for further details.
+"""
+from __future__ import print_function
+import numpy as np
+
+
+def quantize(x_list, y_list, bits):
+    """Return the integer cell coordinates of the coins on a 2**bits grid.
+
+    The bounding box of the field is divided into 2**bits x 2**bits cells.
+
+    :param x_list: NumPy array of x coordinates of all the coins
+    :param y_list: NumPy array of y coordinates of all the coins
+    :param int bits: Bits per axis (1 to 31)
+    :return: Tuple of two np.uint64 arrays (column, row)
+    """
+    if not 1 <= bits <= 31:
+        raise ValueError("bits must be between 1 and 31, got %r" % bits)
+    x_list = np.asarray(x_list, dtype=float)
+    y_list = np.asarray(y_list, dtype=float)
+    num_cells = 2**bits
+    cells = []
+    for values in (x_list, y_list):
+        if values.size == 0:
+            cells.append(np.zeros(0, dtype=np.uint64))
+            continue
+        low = values.min()
+        span = values.max() - low
+        scale = (num_cells - 1)/span if span > 0 else 0.0
+        cells.append(((values - low)*scale).astype(np.uint64))
+    return cells[0], cells[1]
+
+
+def _spread_bits(values):
+    """Insert a zero bit after every bit of the (up to 32 bit) values."""
+    values = values & np.uint64(0x00000000ffffffff)
+    for shift, mask in ((16, 0x0000ffff0000ffff), (8, 0x00ff00ff00ff00ff),
+                        (4, 0x0f0f0f0f0f0f0f0f), (2, 0x3333333333333333),
+                        (1, 0x5555555555555555)):
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def morton_codes(x_list, y_list, bits=16):
+    """Return the Morton (Z-order) code of each coin.
+
+    The bits of the column and the row of the coin's cell are interleaved.
+
+    :param x_list: NumPy array of x coordinates of all the coins
+    :param y_list: NumPy array of y coordinates of all the coins
+    :param int bits: Bits per axis. The grid has 2**bits cells per axis.
+    :return: np.uint64 array of the codes
+    """
+    cols, rows = quantize(x_list, y_list, bits)
+    return _spread_bits(cols) | (_spread_bits(rows) << np.uint64(1))
+
+
+def hilbert_codes(x_list, y_list, bits=16):
+    """Return the distance of each coin along the Hilbert curve.
+
+    This is the classic 'xy2d' algorithm, run for all the coins at once.
+    Unlike the Morton curve, two successive cells of the Hilbert curve are
+    always adjacent, which gives a somewhat better locality.
+
+    :param x_list: NumPy array of x coordinates of all the coins
+    :param y_list: NumPy array of y coordinates of all the coins
+    :param int bits: Bits per axis. The grid has 2**bits cells per axis.
+    :return: np.uint64 array of the codes
+    """
+    cols, rows = quantize(x_list, y_list, bits)
+    cols = cols.astype(np.int64)
+    rows = rows.astype(np.int64)
+    codes = np.zeros(cols.size, dtype=np.uint64)
+    last = 2**bits - 1
+    for level in range(bits - 1, -1, -1):
+        s = 1 << level
+        rx = (cols & s) > 0
+        ry = (rows & s) > 0
+        codes += (np.uint64(s*s) *
+                  ((3*rx.astype(np.uint64)) ^ ry.astype(np.uint64)))
+        # Rotate the quadrant so that the sub-curve has the right shape.
+        flip = ~ry & rx
+        cols = np.where(flip, last - cols, cols)
+        rows = np.where(flip, last - rows, rows)
+        cols, rows = np.where(ry, cols, rows), np.where(ry, rows, cols)
+    return codes
+
+
+curves = {
+    'morton': morton_codes,
+    'hilbert': hilbert_codes,
+}
+
+
+def curve_order(x_list, y_list, curve='hilbert', bits=16):
+    """Return the permutation that sorts the coins along a curve.
+
+    :param x_list: NumPy array of x coordinates of all the coins
+    :param y_list: NumPy array of y coordinates of all the coins
+    :param str curve: 'morton' or 'hilbert'
+    :param int bits: Bits per axis of the grid the coins are snapped to
+    :return: NumPy integer array of the coin indices, in the curve order
+    """
+    if curve not in curves:
+        raise ValueError("Unknown curve {0!r}. Choose from: {1}".format(
+            curve, ", ".join(sorted(curves))))
+    return np.argsort(curves[curve](x_list, y_list, bits), kind='stable')
+
+
+def reorder_field(x_list, y_list, curve='hilbert', bits=16):
+    """Return the field sorted along a space filling curve.
+
+    :param x_list: NumPy array of x coordinates of all the coins
+    :param y_list: NumPy array of y coordinates of all the coins
+    :param str curve: 'morton' or 'hilbert'
+    :param int bits: Bits per axis of the grid the coins are snapped to
+    :return: A tuple (x_sorted, y_sorted, order). The coin i of the sorted
+       field is the coin order[i] of the original field.
+    """
+    order = curve_order(x_list, y_list, curve, bits)
+    return np.asarray(x_list)[order], np.asarray(y_list)[order], order
@@ -0,0 +1,710 @@
+"""goldhunt_pass7_indexed
+
+This module illustrates the 7th optimization pass for the Gold Hunt
+program.
+
+All the previous passes compute the distance of every coin in the field
+from the center of every search circle. Here, a spatial index is built
+only once (right after generate_random_points) and each search circle
+queries only the coins that could lie inside it (for example the coins in
+the grid cells that overlap it, or the coins in the band of x coordinates
+that it covers). The index to be used is selected with the query_backend
+argument of GoldHunt. See the module goldhunt_index.py for the available
+index classes.
+
+The circles of a hunt are spaced 2*search_radius apart, so a coin can lie
+in at most one of them. The 'assign' backend exploits this. It computes the
+only candidate circle of every coin in one NumPy pass, so the complete hunt
+takes O(N) work instead of O(N x circles). For this workload it also makes
+the process pool of goldhunt_pass6_parallel.py unnecessary.
+
+The gold field is created by the functions in goldhunt_field.py. With
+dtype=np.float32 the coordinates are stored (and the distances computed)
+in single precision, which halves the memory used by the field. With the
+chunk_size argument, the field is never created as a whole. The coins are
+generated and searched chunk by chunk (see stream_counts), so the peak
+memory does not depend on the number of coins. Given a seed and a
+goldhunt_cache.FieldCache, the field is created only once and reopened from
+the disk (with np.memmap) by the later games. With spatial_order, the
+coins are sorted along a space filling curve (see goldhunt_order.py) before
+the index is built, so the coins found by a query are close together in
+memory. The results are still reported with the original coin indices.
+
+This module is compatible with Python 3.5.x and requires NumPy 1.17 or
+later (for the seeded fields, see goldhunt_field.py). It contains
+supporting code for the book, Learning Python Application Development,
+Packt Publishing.
+
+RUNNING THE PROGRAM
+--------------------
+$ python goldhunt_pass7_indexed.py
+
+- See the README file for more information. Or visit python.org for OS
+specific instructions on executing Python from a command prompt.
+
+:copyright: 2016, Ninad Sathaye
+
+:license: The MIT License (MIT) . See LICENSE file for further details.
+"""
+from __future__ import print_function
+import cProfile
+import pstats
+import numpy as np
+
+from goldhunt_index import ScanContext, GridIndex, BandIndex, QuadTree
+from goldhunt_index import PolarIndex, SummedAreaTable, KDTree
+from goldhunt_index import assign_to_circles, query_many
+from goldhunt_results import HuntResult
+from goldhunt_dynamic import DynamicField
+from goldhunt_io import load_field, save_result
+from goldhunt_order import curves, reorder_field
+from goldhunt_field import field_dtype
+from goldhunt_field import generate_random_points, generate_random_polar_points
+from goldhunt_field import generate_random_chunks
+from goldhunt_field import generate_random_points_inplace
+from goldhunt_field import generate_seeded_points
+
+# The field generators are re-exported, for the code written against the
+# earlier passes (which defined them in the game module).
+__all__ = ['GoldHunt', 'path_centers', 'plot_points', 'play_game',
+           'view_stats', 'generate_random_points',
+           'generate_random_polar_points']
+
+try:
+    import matplotlib.pyplot as plt
+except ImportError:
+    msg = "You won't be able to visualize the random point distribution."
+    print("ImportError: matplotlib.pyplot ",msg)
+
+
+def plot_points(ref_radius, x_coords, y_coords):
+    """Utility function to show the 'Gold Field!
+
+    :param float ref_radius: Reference radius to determine axis limits
+    :param list x_coords: X coordinates of the points to be plotted
+    :param list y_coords: Y coordinates of the points to be plotted
+    """
+    # Define axis limits
+    a1 = ref_radius + 1
+    a2 = a1*(-1.0)
+    plt.plot(x_coords, y_coords, ".", color='#A67C00', ms=4)
+    plt.axis([a2, a1, a2, a1])
+    plt.show()
+
+
+def path_centers(waypoints, stride):
+    """Return the search circle centers along a path of waypoints.
+
+    The game unit walks along the straight segments joining the waypoints
+    (in the given order) and searches for the coins every 'stride' units
+    of walked distance, starting at the first waypoint. It stops at the
+    last waypoint.
+
+    :param waypoints: Sequence of (x, y) waypoints, shape (W, 2)
+    :param float stride: Walked distance between two successive searches
+    :return: NumPy array of shape (num_circles, 2) with the circle centers
+    """
+    if stride <= 0:
+        raise ValueError("stride must be positive, got %r" % stride)
+    waypoints = np.asarray(waypoints, dtype=float).reshape(-1, 2)
+    if len(waypoints) == 0:
+        return np.empty((0, 2))
+    # Walked distance at each of the waypoints
+    walked = np.concatenate(([0.0], np.cumsum(np.hypot(
+        *np.diff(waypoints, axis=0).T))))
+    stops = np.arange(int(walked[-1]//stride) + 1)*stride
+    return np.column_stack((np.interp(stops, walked, waypoints[:, 0]),
+                            np.interp(stops, walked, waypoints[:, 1])))
+
+
+class GoldHunt:
+    """Class to play a game scenario 'Gold Hunt' in 'Attack of The Orcs'.
+
+    This class is created to illustrate a scenario discussed in the book:
+    'Learning Python Application Development (Packt Publishing).
+
+    Unlike the earlier optimization passes, the search for the coins is
+    delegated to a spatial index that is built once per game. The index
+    class is picked from the query_backends dictionary using the
+    query_backend argument.
+
+    :ivar int field_coins: Gold coins scattered over a circular field
+    :ivar float field_radius: Radius of the circular field with gold coins
+    :ivar float search radius: Radius of a circle. The gold search will be
+            constrained within this circle.
+    :ivar float x_ref: X-coordinate of the game unit searching for gold.
+    :ivar float y_ref: Y-coordinate of the game unit searching for gold.
+    :ivar float move_distance: Distance by which the game unit advances for the
+           next search.
+    :ivar str query_backend: Key of query_backends (or hunt_backends) used
+           by play.
+    :ivar float grid_cell_size: Cell size of the 'grid' backend. Defaults to
+           the search radius.
+    :ivar int query_block_bytes: Memory budget (in bytes) for the temporary
+           arrays of query_many (and the 'batched' backend).
+    :ivar bool approximate: If True, play only reports approximate coin
+           counts (with error bounds) obtained from a SummedAreaTable.
+    :ivar int sat_resolution: Cells per axis of the SummedAreaTable used
+           in the approximate mode. Higher is more accurate but slower.
+    :ivar waypoints: Optional sequence of (x, y) waypoints. If given, play
+           follows this path (see hunt_path) instead of the straight sweep
+           along y = y_ref. The circles are move_distance apart along it.
+    :ivar dtype: NumPy float type (float64 or float32) used to store the
+           coin coordinates and to compute the distances.
+    :ivar int chunk_size: If given, play streams the field through the
+           search circles in chunks of this many coins (see stream_counts)
+           and only reports the coin counts.
+    :ivar seed: Optional seed of the field. With a seed, the field is
+           generated with goldhunt_field.generate_seeded_points, so every
+           game (and every pass) with the same seed sees the same field.
+    :ivar int generation_processes: Number of processes used to generate
+           a seeded field. The field doesn't depend on it.
+    :ivar field_file: Optional path of a binary field file (see
+           goldhunt_io.py). If given, the coins are loaded from this file
+           instead of being generated.
+    :ivar result_file: Optional path of a binary result file. If given,
+           play saves the coins collected in each circle to this file.
+    :ivar field_cache: Optional goldhunt_cache.FieldCache instance. If
+           given, the field for the seed is taken from this cache.
+    :ivar spatial_order: Optional space filling curve ('morton' or
+           'hilbert'). If given, play sorts the field along this curve
+           before searching it (see goldhunt_order.reorder_field).
+
+    :cvar query_backends: Python dictionary that holds the names of the
+           available query backends as its keys and the corresponding
+           method that builds the index as the values.
+    :cvar hunt_backends: Python dictionary of the backends that search all
+           the circles of a hunt in one go (instead of one circle at a time
+           using an index). The values are the names of the methods that
+           do the search. See search_circles.
+    """
+    query_backends = {
+        'scan': '_build_scan_index',
+        'grid': '_build_grid_index',
+        'band': '_build_band_index',
+        'quadtree': '_build_quadtree_index',
+        'polar': '_build_polar_index',
+        'kdtree': '_build_kdtree_index',
+    }
+    hunt_backends = {
+        'assign': '_assign_circles',
+        'batched': '_batched_circles',
+    }
+
+    def __init__(self, field_coins=5000, field_radius=10.0, search_radius=1.0,
+                 query_backend='grid', grid_cell_size=None,
+                 query_block_bytes=8*1024*1024, approximate=False,
+                 sat_resolution=1024, waypoints=None, dtype=np.float64,
+                 chunk_size=None, seed=None, field_cache=None,
+                 generation_processes=1, field_file=None, result_file=None,
+                 spatial_order=None):
+        backends = set(self.query_backends) | set(self.hunt_backends)
+        if query_backend not in backends:
+            raise ValueError(
+                "Unknown query_backend {0!r}. Choose from: {1}".format(
+                    query_backend, ", ".join(sorted(backends))))
+        if approximate and chunk_size is not None:
+            raise ValueError("The approximate mode needs the complete "
+                             "field. It can't be used with chunk_size.")
+        if field_cache is not None and seed is None:
+            raise ValueError("A seed is needed to use the field_cache")
+        if spatial_order is not None and spatial_order not in curves:
+            raise ValueError(
+                "Unknown spatial_order {0!r}. Choose from: {1}".format(
+                    spatial_order, ", ".join(sorted(curves))))
+        self.field_coins = field_coins
+        self.field_radius = field_radius
+        self.search_radius = search_radius
+        self.query_backend = query_backend
+        self.grid_cell_size = grid_cell_size
+        self.query_block_bytes = query_block_bytes
+        self.approximate = approximate
+        self.sat_resolution = sat_resolution
+        self.waypoints = waypoints
+        self.dtype = field_dtype(dtype)
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.generation_processes = generation_processes
+        self.field_file = field_file
+        self.result_file = result_file
+        self.field_cache = field_cache
+        self.spatial_order = spatial_order
+
+        # Sir Foo's initial coordinates e.g. (-9.0, 0)
+        self.x_ref = - (self.field_radius - self.search_radius)
+        self.y_ref = 0.0
+        # Distance by which Sir Foo (or any unit) advances for the
+        # next search
+        self.move_distance = 2*self.search_radius
+
+    def reset_params(self):
+        """Resets some dependent params to their default computed value."""
+        self.x_ref = - (self.field_radius - self.search_radius)
+        self.move_distance = 2*self.search_radius
+
+    def _build_scan_index(self, x_list, y_list):
+        """Return the brute force index (pass-5 kernel, reused buffers)."""
+        return ScanContext(x_list, y_list)
+
+    def _build_grid_index(self, x_list, y_list):
+        """Return a GridIndex with cells of the size of the search circle."""
+        cell_size = self.grid_cell_size or self.search_radius
+        return GridIndex(x_list, y_list, cell_size)
+
+    def _build_band_index(self, x_list, y_list):
+        """Return a BandIndex (coins sorted by the x coordinate)."""
+        return BandIndex(x_list, y_list)
+
+    def _build_quadtree_index(self, x_list, y_list):
+        """Return a QuadTree (with coin counts in every node)."""
+        return QuadTree(x_list, y_list)
+
+    def _build_polar_index(self, x_list, y_list):
+        """Return a PolarIndex with rings and sectors of the circle size.
+
+        The number of rings and sectors is chosen such that the cells near
+        the field boundary are about as large as the search circle.
+        """
+        num_rings = int(np.ceil(self.field_radius/self.search_radius))
+        num_sectors = int(np.ceil(2*np.pi*self.field_radius /
+                                  self.search_radius))
+        return PolarIndex.from_xy(x_list, y_list, num_rings, num_sectors)
+
+    def _build_kdtree_index(self, x_list, y_list):
+        """Return a KDTree (median split 2D tree)."""
+        return KDTree(x_list, y_list)
+
+    def build_index(self, x_list, y_list):
+        """Build the spatial index for the selected query backend.
+
+        :param x_list: NumPy array of x coordinates of all the coins
+        :param y_list: NumPy array of y coordinates of all the coins
+        :return: An index object with the method query(x_ref, y_ref, radius)
+        """
+        if self.query_backend in self.hunt_backends:
+            raise ValueError("The {0!r} backend searches all the circles in "
+                             "one go and doesn't use an index. Use "
+                             "search_circles instead.".format(
+                                 self.query_backend))
+        builder = getattr(self, self.query_backends[self.query_backend])
+        return builder(x_list, y_list)
+
+    def dynamic_field(self, x_list, y_list, compact_ratio=0.25):
+        """Return a DynamicField using the index of the query backend.
+
+        Several hunts (or game units) can collect coins from the returned
+        field, one after the other. A coin is collected only once.
+
+        :param x_list: NumPy array of x coordinates of all the coins
+        :param y_list: NumPy array of y coordinates of all the coins
+        :param float compact_ratio: See goldhunt_dynamic.DynamicField
+        :return: A goldhunt_dynamic.DynamicField instance
+        """
+        if self.query_backend in self.hunt_backends:
+            # Raises the ValueError for the backends without an index.
+            self.build_index(x_list, y_list)
+        builder = getattr(self, self.query_backends[self.query_backend])
+        return DynamicField(x_list, y_list, builder, compact_ratio)
+
+    def circle_centers(self, search_radius=None):
+        """Return a list of the x-coordinates of all the search circles.
+
+        The game unit starts at the initial x_ref and moves along the
+        positive X axis by move_distance until it crosses x = 9.0.
+
+        :param search_radius: Optional search radius. If it is given, the
+           default circle layout for this radius is returned instead (as if
+           the game was created with it and reset_params was called).
+        :raise ValueError: If search_radius is not positive
+        """
+        if search_radius is not None and not search_radius > 0:
+            raise ValueError("search_radius must be positive, got %r"
+                             % search_radius)
+        if search_radius is None:
+            x_ref = self.x_ref
+            move_distance = self.move_distance
+        else:
+            x_ref = - (self.field_radius - search_radius)
+            move_distance = 2*search_radius
+        x_centers = []
+        while x_ref <= 9.0:
+            x_centers.append(x_ref)
+            x_ref += move_distance
+        return x_centers
+
+    def _assign_circles(self, x_list, y_list, x_centers):
+        """Search all the circles with a single pass over the field."""
+        circle_start, coin_ids = assign_to_circles(
+            x_list, y_list, x_centers, self.y_ref, self.search_radius)
+        return [coin_ids[circle_start[k]:circle_start[k + 1]]
+                for k in range(len(x_centers))]
+
+    def _batched_circles(self, x_list, y_list, x_centers):
+        """Search all the circles with the blocked, broadcasting kernel."""
+        centers = [(x_ref, self.y_ref) for x_ref in x_centers]
+        return self.query_many(x_list, y_list, centers, self.search_radius)
+
+    def query_many(self, x_list, y_list, centers, radii):
+        """Return the coins inside each of the given circles.
+
+        Unlike search_circles, the circles can be anywhere on the field and
+        each one can have its own radius. Blocks of circles are tested
+        against the field with NumPy broadcasting, so there is no Python
+        level loop over the coins (like the enumerate loop in pass-5). The
+        temporary arrays are kept under query_block_bytes.
+
+        :param x_list: NumPy array of x coordinates of all the coins
+        :param y_list: NumPy array of y coordinates of all the coins
+        :param centers: Sequence of (x, y) circle centers
+        :param radii: A single radius or a sequence of radii (one per circle)
+        :return: A list with one sorted NumPy array of coin indices per circle
+        """
+        circle_start, coin_ids = query_many(x_list, y_list, centers, radii,
+                                            self.query_block_bytes)
+        return [coin_ids[circle_start[k]:circle_start[k + 1]]
+                for k in range(len(circle_start) - 1)]
+
+    def search_circles(self, x_list, y_list, x_centers):
+        """Return the coins inside each of the given search circles.
+
+        :param x_list: NumPy array of x coordinates of all the coins
+        :param y_list: NumPy array of y coordinates of all the coins
+        :param x_centers: x-coordinates of the search circles. All the
+           circles are centered on the line y = y_ref.
+        :return: A list with one sorted NumPy array of coin indices per circle
+        """
+        if self.query_backend in self.hunt_backends:
+            searcher = getattr(self, self.hunt_backends[self.query_backend])
+            return searcher(x_list, y_list, x_centers)
+        # Build the index only once. All the search circles share it.
+        index = self.build_index(x_list, y_list)
+        return [index.query(x_ref, self.y_ref, self.search_radius)
+                for x_ref in x_centers]
+
+    def search_result(self, x_list, y_list, x_centers):
+        """Return the coins inside the search circles as a HuntResult.
+
+        Same search as search_circles, but the coins are kept as one compact
+        index array with the circle offsets (see goldhunt_results.py). No
+        (x, y) tuples are created unless they are asked for.
+
+        :param x_list: NumPy array of x coordinates of all the coins
+        :param y_list: NumPy array of y coordinates of all the coins
+        :param x_centers: x-coordinates of the search circles
+        :return: A HuntResult instance with the field attached
+        """
+        if self.query_backend == 'assign':
+            circle_start, coin_ids = assign_to_circles(
+                x_list, y_list, x_centers, self.y_ref, self.search_radius)
+            return HuntResult(coin_ids, circle_start, x_list, y_list)
+        return HuntResult.from_circles(
+            self.search_circles(x_list, y_list, x_centers), x_list, y_list)
+
+    def find_coins(self, x_list, y_list, index=None):
+        """Return list of coins that lie within a given distance.
+
+        :param x_list: NumPy array of x coordinates of all the coins (points)
+        :param y_list: NumPy array of y coordinates of all the coins (points)
+        :param index: Optional index returned by build_index. If it is not
+           given, a new one is built (slow, only for one-off searches).
+        :return: A list containing (x,y) coords of all the eligible coins
+        """
+        if index is None:
+            coin_ids = self.search_circles(x_list, y_list, [self.x_ref])[0]
+        else:
+            coin_ids = index.query(self.x_ref, self.y_ref, self.search_radius)
+        return list(zip(x_list[coin_ids].tolist(), y_list[coin_ids].tolist()))
+
+    def nearest_coins(self, x_list, y_list, centers, k=1, tree=None):
+        """Return the k coins closest to each of the given game units.
+
+        :param x_list: NumPy array of x coordinates of all the coins
+        :param y_list: NumPy array of y coordinates of all the coins
+        :param centers: Sequence of (x, y) positions of the game units
+        :param int k: Number of nearest coins wanted per game unit
+        :param tree: Optional KDTree of the field. Build it once with
+           KDTree(x_list, y_list) when calling this method repeatedly.
+        :return: A tuple (coin_ids, distances) of NumPy arrays of shape
+           (number of centers, k), sorted by the distance.
+        """
+        if tree is None:
+            tree = KDTree(x_list, y_list)
+        return tree.nearest(centers, k)
+
+    def radius_sweep(self, x_list, y_list, radii):
+        """Return the coin counts of the hunts for many search radii.
+
+        Use this to tune search_radius without regenerating and rescanning
+        the field for every candidate radius. Each radius implies its own
+        circle layout (see circle_centers). A coin can only be inside a
+        circle if abs(y - y_ref) <= radius. The coins are thus sorted once
+        by abs(y - y_ref) and, for every radius, only the prefix of this
+        sorted order (found with np.searchsorted) is assigned to the
+        circles of that radius.
+
+        :param x_list: NumPy array of x coordinates of all the coins
+        :param y_list: NumPy array of y coordinates of all the coins
+        :param radii: Sequence of the search radii to be tried (all of them
+           positive)
+        :return: A tuple (totals, counts_per_circle). totals is a NumPy array
+           with the total coins collected for each radius (the radius vs
+           yield curve). counts_per_circle is a list with, for each radius,
+           an array of the coins collected in each circle.
+        """
+        radii = np.asarray(radii, dtype=float)
+        if radii.size == 0:
+            return np.zeros(0, dtype=np.intp), []
+        if not np.all(radii > 0):
+            raise ValueError("All the radii must be positive, got %r"
+                             % radii.tolist())
+        x_list = np.asarray(x_list)
+        y_list = np.asarray(y_list)
+        y_distance = np.abs(y_list - self.y_ref)
+        # Coins farther than the largest radius from the line y = y_ref
+        # can never be collected.
+        keep = np.flatnonzero(y_distance <= radii.max())
+        order = keep[np.argsort(y_distance[keep], kind='stable')]
+        y_distance = y_distance[order]
+        x_sorted = x_list[order]
+        y_sorted = y_list[order]
+
+        totals = np.zeros(radii.size, dtype=np.intp)
+        counts_per_circle = []
+        for j, radius in enumerate(radii.tolist()):
+            num_near = np.searchsorted(y_distance, radius, side='right')
+            circle_start, coin_ids = assign_to_circles(
+                x_sorted[:num_near], y_sorted[:num_near],
+                self.circle_centers(radius), self.y_ref, radius)
+            counts_per_circle.append(np.diff(circle_start))
+            totals[j] = coin_ids.size
+        return totals, counts_per_circle
+
+    def approximate_counts(self, x_list, y_list, x_centers):
+        """Return approximate coin counts for the given search circles.
+
+        The field is rasterized once into a SummedAreaTable. Each circle
+        count then takes constant time, whatever the number of coins.
+
+        :param x_list: NumPy array of x coordinates of all the coins
+        :param y_list: NumPy array of y coordinates of all the coins
+        :param x_centers: x-coordinates of the search circles
+        :return: A tuple of NumPy arrays (estimate, lower, upper) with one
+           entry per circle. The exact count lies between lower and upper.
+        """
+        table = SummedAreaTable(x_list, y_list, self.sat_resolution)
+        centers = [(x_ref, self.y_ref) for x_ref in x_centers]
+        return table.count_many(centers, self.search_radius)
+
+    def play_approximate(self, x_list, y_list, x_centers):
+        """Print the approximate coin counts of all the search circles."""
+        estimate, lower, upper = self.approximate_counts(x_list, y_list,
+                                                         x_centers)
+        for count, x_ref in enumerate(x_centers, 1):
+            print("Circle# {num}, center:({x}, {y}), coins: ~{gold:.0f} "
+                  "[{lo}, {hi}]".format(num=count, x=x_ref, y=self.y_ref,
+                                        gold=estimate[count - 1],
+                                        lo=lower[count - 1],
+                                        hi=upper[count - 1]))
+        print("Total_collected_coins = ~{0:.0f} [{1}, {2}]".format(
+            estimate.sum(), lower.sum(), upper.sum()))
+
+    def hunt_path(self, x_list, y_list, centers):
+        """Collect the coins along an arbitrary path of search circles.
+
+        The circles may overlap (for example when the stride is smaller than
+        2*search_radius). A coin is collected only by the first circle that
+        finds it. Instead of merging the lists of coins (which counts a coin
+        once per circle, as itertools.chain does in pass-6) a per-coin
+        'collected' mask is kept. With an index backend, the coins are
+        collected from a DynamicField, so the collected coins are removed
+        from the index and the later circles examine fewer candidates. The
+        index is built only once, so the cost depends on the number of
+        candidate coins per circle and not on the number of circles times
+        the field size.
+
+        :param x_list: NumPy array of x coordinates of all the coins
+        :param y_list: NumPy array of y coordinates of all the coins
+        :param centers: Sequence of (x, y) circle centers, see path_centers
+        :return: A tuple (new_coins_per_circle, collected). The first is a
+           list with the array of the coins newly collected by each circle.
+           The second is the boolean 'collected' mask over the field.
+        """
+        centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+        if self.query_backend == 'batched':
+            coins_per_circle = self.query_many(x_list, y_list, centers,
+                                               self.search_radius)
+        elif self.query_backend in self.hunt_backends:
+            raise ValueError("The {0!r} backend only supports the straight "
+                             "sweep with non-overlapping circles".format(
+                                 self.query_backend))
+        else:
+            field = self.dynamic_field(x_list, y_list)
+            new_coins_per_circle = [
+                field.collect(x_ref, y_ref, self.search_radius)
+                for x_ref, y_ref in centers.tolist()]
+            return new_coins_per_circle, field.taken
+
+        collected = np.zeros(len(x_list), dtype=bool)
+        new_coins_per_circle = []
+        for coin_ids in coins_per_circle:
+            new_coins = coin_ids[~collected[coin_ids]]
+            collected[new_coins] = True
+            new_coins_per_circle.append(new_coins)
+        return new_coins_per_circle, collected
+
+    def play_path(self, x_list, y_list):
+        """Play the game along the path given by the waypoints."""
+        centers = path_centers(self.waypoints, self.move_distance)
+        new_coins_per_circle, collected = self.hunt_path(x_list, y_list,
+                                                         centers)
+        for count, ((x_ref, y_ref), new_coins) in enumerate(
+                zip(centers.tolist(), new_coins_per_circle), 1):
+            print("Circle# {num}, center:({x}, {y}), new coins: {gold}".format(
+                num=count, x=x_ref, y=y_ref, gold=new_coins.size))
+        print("Total_collected_coins =", np.count_nonzero(collected))
+
+    def make_field(self):
+        """Return the x, y coordinate arrays of the gold field of the game.
+
+        The field is loaded from the field_file or the field_cache (if any)
+        or generated.
+        """
+        if self.field_file is not None:
+            return load_field(self.field_file)[:2]
+        if self.field_cache is not None:
+            return self.field_cache.get(self.seed, self.field_coins,
+                                        self.field_radius, self.dtype,
+                                        self.generation_processes)
+        if self.seed is not None:
+            return generate_seeded_points(self.seed, self.field_radius,
+                                          self.field_coins, self.dtype,
+                                          self.generation_processes)
+        # Same field as generate_random_points, with a lower peak memory.
+        return generate_random_points_inplace(self.field_radius,
+                                              self.field_coins, self.dtype)
+
+    def game_field(self):
+        """Return the field of the game, in its spatial order (if any).
+
+        :return: A tuple (x_list, y_list, order). order is the permutation
+           applied by goldhunt_order.reorder_field (None without a
+           spatial_order), used to map the results back to the coins of
+           make_field.
+        """
+        x_list, y_list = self.make_field()
+        if self.spatial_order is None:
+            return x_list, y_list, None
+        return reorder_field(x_list, y_list, self.spatial_order)
+
+    def stream_counts(self, chunks, x_centers=None, centers=None):
+        """Return the number of coins in each circle, for a chunked field.
+
+        The chunks are searched one after the other and only a running
+        count per circle is kept, so the memory used is bounded by the
+        chunk size. A coin belongs to exactly one chunk, so the counts are
+        the same as for the complete field.
+
+        :param chunks: Iterable of (x_list, y_list) chunks of the field,
+           e.g. returned by goldhunt_field.generate_random_chunks
+        :param x_centers: x-coordinates of the circles of the straight
+           sweep (see search_circles)
+        :param centers: Instead of x_centers, (x, y) centers of the circles
+           along a path (see hunt_path). Then only the coins not already
+           collected by a previous circle are counted.
+        :return: NumPy integer array with the coin count per circle
+        """
+        if centers is None:
+            counts = np.zeros(len(x_centers), dtype=np.int64)
+            for x_list, y_list in chunks:
+                counts += self.search_result(x_list, y_list,
+                                             x_centers).counts()
+            return counts
+        counts = np.zeros(len(centers), dtype=np.int64)
+        for x_list, y_list in chunks:
+            new_coins_per_circle, collected = self.hunt_path(x_list, y_list,
+                                                             centers)
+            counts += [new_coins.size for new_coins in new_coins_per_circle]
+        return counts
+
+    def play_streaming(self):
+        """Play the game without creating the complete field."""
+        chunks = generate_random_chunks(self.field_radius, self.field_coins,
+                                        self.chunk_size, self.dtype,
+                                        self.seed)
+        if self.waypoints is None:
+            x_centers = self.circle_centers()
+            centers = [(x_ref, self.y_ref) for x_ref in x_centers]
+            counts = self.stream_counts(chunks, x_centers)
+        else:
+            centers = path_centers(self.waypoints,
+                                   self.move_distance).tolist()
+            counts = self.stream_counts(chunks, centers=centers)
+        for count, ((x_ref, y_ref), gold) in enumerate(zip(centers, counts),
+                                                       1):
+            print("Circle# {num}, center:({x}, {y}), coins: {gold}".format(
+                num=count, x=x_ref, y=y_ref, gold=gold))
+        print("Total_collected_coins =", counts.sum())
+
+    def play(self):
+        """Top level logic to play the game"""
+        if self.chunk_size is not None:
+            self.play_streaming()
+            return
+
+        x_list, y_list, order = self.game_field()
+        if self.waypoints is not None:
+            self.play_path(x_list, y_list)
+            return
+
+        x_centers = self.circle_centers()
+        if self.approximate:
+            self.play_approximate(x_list, y_list, x_centers)
+            return
+
+        result = self.search_result(x_list, y_list, x_centers)
+        if order is not None:
+            result = result.remap(order)
+
+        for count, (x_ref, gold) in enumerate(zip(x_centers,
+                                                  result.counts()), 1):
+            print("Circle# {num}, center:({x}, {y}), coins: {gold}".format(
+                num=count, x=x_ref, y=self.y_ref, gold=gold))
+
+        print("Total_collected_coins =", len(result))
+        if self.result_file is not None:
+            save_result(self.result_file, result,
+                        [(x_ref, self.y_ref) for x_ref in x_centers])
+
+
+# Functions for profiling the code.
+def view_stats(fil, text_restriction):
+    """View the pstats for the given file
+
+    :param fil: The file name for printing the stats.
+    :param text_restriction: UNUSED variable to define filter on the output
+
+    .. todo:: Cleanup the unused text_restriction variable or implement it!
+    """
+    stats = pstats.Stats(fil)
+    # Remove the long directory paths
+    stats.strip_dirs()
+    # Sort the stats by the total time (internal time)
+    sorted_stats = stats.sort_stats('tottime')
+    # Only show stats that have "goldhunt" in their 'name column'
+    sorted_stats.print_stats("goldhunt")
+
+
+def play_game():
+    """Control function to execute the GoldHunt game"""
+    # IMPORTANT: The choice of input suggested below can consume a lot of
+    # computational resources on your machine. See what your computer can
+    # handle first by choosing a smaller size for field_coins and a LARGER
+    # search_radius!
+    game = GoldHunt(field_coins=2000000, search_radius=0.1)
+    game.play()
+
+if __name__ == '__main__':
+    filname = 'profile_output_new'
+    cProfile.run('play_game()', filname)
+    # View the pstats
+    view_stats(filname, "goldhunt")
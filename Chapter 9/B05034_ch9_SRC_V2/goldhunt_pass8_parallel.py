@@ -0,0 +1,501 @@
+"""goldhunt_pass8_parallel
+
+This module illustrates the 8th optimization pass for the Gold Hunt
+program.
+
+Like goldhunt_pass6_parallel.py, the search circles are distributed over a
+pool of worker processes and every worker scans the complete field for
+its circles. In pass-6 the field arrays are pickled and sent to a worker
+with every single task, so most of the time goes into the interprocess
+communication. Here, the field is placed in shared memory once (see
+goldhunt_shared.SharedField) and a task only carries the name of the
+shared block and the circle parameters. The workers attach to the field
+without copying it.
+
+With parallel_backend='thread', the circles are scanned by a pool of
+threads of the main process instead. The threads see the field directly,
+so nothing is pickled, copied or started. The NumPy kernels of the scan
+(subtract, einsum, less_equal, flatnonzero) release the GIL while they
+loop over the coins, so the threads can run on several cores. Only the
+few Python statements of each query hold the GIL.
+
+Which workers to choose? A pool of processes takes longer to start than a
+pool of threads and the field is first copied to shared memory, whereas
+the threads hold the GIL for the Python statements of each query. The
+'threads' benchmark of goldhunt_benchmark.py times the serial scan, the
+threads and the processes (one worker per available CPU) for fields of
+10 thousand to 2 million coins, which shows from which field size each
+kind of workers pays off on a given machine. The processes remain the
+choice for any Python heavy per-coin work.
+
+Both kinds of workers split the work by circle: every worker scans the
+complete field for each of its circles. With decomposition='slab' the
+work is split by coins instead. The field is partitioned into vertical
+slabs with about as many coins each, one per worker (see
+goldhunt_index.partition_slabs). A worker tests the coins of its slab
+against only the circles that overlap the slab and returns partial
+results for them, which are merged per circle at the end. A worker then
+holds only 1/workers of the field (and of the scratch buffers) and never
+examines the coins that are far from a circle.
+
+By default, the number of workers and the number of circles sent to a
+worker in one task are picked for each search (see GoldHunt.plan). A short
+calibration run times one circle query on a sample of the field. Workers
+are added (up to the number of CPUs this process may use, as given by
+os.sched_getaffinity) only as long as each of them gets at least
+MIN_WORK_PER_START times its start up cost of work. The circles are then
+batched so that a task takes about TASK_SECONDS, while every worker still
+gets TASKS_PER_WORKER tasks to balance the load.
+
+A game (or a service) that runs many hunts can give GoldHunt a
+goldhunt_executor.HuntExecutor. Its worker processes are started once and
+stay warm, and the seeded field of the game (see game_field) is kept in
+shared memory (and attached by the workers) across the hunts. Any other
+field, e.g. a chunk of a streamed field, is shared only for the search
+at hand.
+
+GoldHunt extends the pass-7 class, so the field creation (seeded fields,
+the field cache, field files) and the result handling are the same.
+
+This module requires Python 3.8 or later (multiprocessing.shared_memory).
+It contains supporting code for the book, Learning Python Application
+Development, Packt Publishing.
+
+RUNNING THE PROGRAM
+--------------------
+$ python goldhunt_pass8_parallel.py
+
+- See the README file for more information. Or visit python.org for OS
+specific instructions on executing Python from a command prompt.
+
+:copyright: 2016, Ninad Sathaye
+
+:license: The MIT License (MIT) . See LICENSE file for further details.
+"""
+from __future__ import print_function
+import os
+import sys
+import contextlib
+import cProfile
+import pstats
+import multiprocessing
+import threading
+import timeit
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+if sys.version_info < (3, 8):
+    print("This code requires Python 3.8 or later "
+          "(multiprocessing.shared_memory)")
+    print("Looks like you are trying to run this using "
+          "Python version: %d.%d " % sys.version_info[:2])
+    print("Exiting...")
+    sys.exit(1)
+
+from goldhunt_index import ScanContext, coordinate_dtype, partition_slabs
+from goldhunt_pass7_indexed import GoldHunt as GoldHunt7
+from goldhunt_results import HuntResult
+from goldhunt_shared import SharedField, scan_circles, scan_slab
+from goldhunt_shared import detach_field
+from goldhunt_cache import FieldCache
+
+# Start up cost (in seconds) of a worker. It depends on the machine, see
+# the 'threads' benchmark of goldhunt_benchmark.py.
+WORKER_START_SECONDS = {'process': 0.012, 'thread': 0.001}
+# A worker is added only if its share of the work takes at least this many
+# times its start up cost.
+MIN_WORK_PER_START = 10
+# Target run time (in seconds) of a task and the minimum number of tasks
+# per worker (so that a slow worker doesn't hold up the others).
+TASK_SECONDS = 0.05
+TASKS_PER_WORKER = 4
+# Number of coins scanned by the calibration run.
+CALIBRATION_COINS = 100000
+
+
+def available_cpus():
+    """Return the number of CPUs this process is allowed to run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class GoldHunt(GoldHunt7):
+    """Class to play a game scenario 'Gold Hunt' in 'Attack of The Orcs'.
+
+    This class is created to illustrate a scenario discussed in the book:
+    'Learning Python Application Development (Packt Publishing).
+
+    With the 'scan' query backend, the search circles of play are scanned
+    in parallel by a pool of workers that share the field (see
+    search_result). The other query backends are searched by the pass-7
+    code in the main process. See the pass-7 GoldHunt for the other
+    instance variables.
+
+    :ivar str parallel_backend: Key of parallel_backends, the kind of
+           workers used
+    :ivar int workers: Number of worker processes (or threads). If None,
+           it is picked for each search (see plan).
+    :ivar int circles_per_task: Number of circles sent to a worker in one
+           task. If None, it is picked for each search (see plan).
+    :ivar str decomposition: 'circle' to give each worker a share of the
+           circles or 'slab' to give each worker a share of the coins.
+    :ivar executor: Optional goldhunt_executor.HuntExecutor. If given, its
+           warm worker processes are used instead of a new pool, and the
+           seeded field (or the field file) of the game is shared with them
+           only once (see shared_key).
+
+    :cvar parallel_backends: Python dictionary that holds the names of the
+           available kinds of workers as its keys and the corresponding
+           method that scans the circles as the values.
+    :cvar decompositions: The available ways to split the work
+    """
+    parallel_backends = {
+        'process': '_process_circles',
+        'thread': '_thread_circles',
+    }
+    decompositions = ('circle', 'slab')
+
+    def __init__(self, field_coins=5000, field_radius=10.0, search_radius=1.0,
+                 query_backend='scan', parallel_backend='process',
+                 workers=None, decomposition='circle', circles_per_task=None,
+                 executor=None, **kwargs):
+        if parallel_backend not in self.parallel_backends:
+            raise ValueError(
+                "Unknown parallel_backend {0!r}. Choose from: {1}".format(
+                    parallel_backend,
+                    ", ".join(sorted(self.parallel_backends))))
+        if workers is not None and workers < 1:
+            raise ValueError("workers must be at least 1, got %r" % workers)
+        if circles_per_task is not None and circles_per_task < 1:
+            raise ValueError("circles_per_task must be at least 1, got %r"
+                             % circles_per_task)
+        if executor is not None and parallel_backend != 'process':
+            raise ValueError("An executor runs worker processes. It can't "
+                             "be used with the {0!r} backend".format(
+                                 parallel_backend))
+        if decomposition not in self.decompositions:
+            raise ValueError(
+                "Unknown decomposition {0!r}. Choose from: {1}".format(
+                    decomposition, ", ".join(self.decompositions)))
+        super().__init__(field_coins, field_radius, search_radius,
+                         query_backend, **kwargs)
+        self.parallel_backend = parallel_backend
+        self.workers = workers
+        self.decomposition = decomposition
+        self.circles_per_task = circles_per_task
+        self.executor = executor
+        # Weak references to the arrays last returned by game_field.
+        self._game_field = None
+
+    def field_key(self):
+        """Return a name of the field of the game, or None if it is random.
+
+        Two games with the same key play on the same field, so an executor
+        can keep it in shared memory for the later games.
+        """
+        if self.field_file is not None:
+            key = 'file:{0}'.format(self.field_file)
+        elif self.seed is not None:
+            key = FieldCache.key(self.seed, self.field_coins,
+                                 self.field_radius, self.dtype)
+        else:
+            return None
+        return '{0}:{1}'.format(key, self.spatial_order)
+
+    def game_field(self):
+        """Return the field of the game (see the pass-7 game_field).
+
+        The arrays are remembered (without keeping them alive), so that
+        shared_key can tell them from any other field.
+        """
+        x_list, y_list, order = super().game_field()
+        self._game_field = (weakref.ref(x_list), weakref.ref(y_list))
+        return x_list, y_list, order
+
+    def shared_key(self, x_list, y_list):
+        """Return the executor key of a field, or None if it has none.
+
+        Only the arrays returned by game_field are known to hold the field
+        named by field_key. Any other arrays (a chunk of the field, or a
+        field made by the caller) have no key, even for a seeded game.
+
+        :param x_list: NumPy array of x coordinates of all the coins
+        :param y_list: NumPy array of y coordinates of all the coins
+        """
+        if self.executor is None or self._game_field is None:
+            return None
+        x_ref, y_ref = self._game_field
+        if x_ref() is not x_list or y_ref() is not y_list:
+            return None
+        return self.field_key()
+
+    def calibrate(self, x_list, y_list, x_centers):
+        """Return the estimated time (in seconds) of one circle query.
+
+        One circle is scanned on a sample of CALIBRATION_COINS coins and
+        the best of three times is scaled to the size of the field.
+
+        :param x_list: NumPy array of x coordinates of all the coins
+        :param y_list: NumPy array of y coordinates of all the coins
+        :param x_centers: x-coordinates of the search circles
+        """
+        sample = min(len(x_list), CALIBRATION_COINS)
+        if sample == 0 or len(x_centers) == 0:
+            return 0.0
+        context = ScanContext(x_list[:sample], y_list[:sample])
+        x_ref = x_centers[len(x_centers)//2]
+        seconds = min(timeit.repeat(
+            lambda: context.query(x_ref, self.y_ref, self.search_radius),
+            number=1, repeat=3))
+        return seconds*len(x_list)/sample
+
+    def plan(self, x_list, y_list, x_centers):
+        """Return the number of workers and of circles per task to use.
+
+        The values given to the constructor are used as they are. The
+        others are derived from a calibration run (see the module
+        docstring and calibrate).
+
+        :param x_list: NumPy array of x coordinates of all the coins
+        :param y_list: NumPy array of y coordinates of all the coins
+        :param x_centers: x-coordinates of the search circles
+        :return: A tuple (workers, circles_per_task)
+        """
+        workers = self.workers
+        if workers is None and self.executor is not None:
+            workers = self.executor.workers
+        circles_per_task = self.circles_per_task
+        if workers is not None and circles_per_task is not None:
+            return workers, circles_per_task
+        num_circles = max(len(x_centers), 1)
+        query_seconds = self.calibrate(x_list, y_list, x_centers)
+        if workers is None:
+            start_seconds = WORKER_START_SECONDS[self.parallel_backend]
+            workers = int(query_seconds*num_circles //
+                          (MIN_WORK_PER_START*start_seconds))
+            limit = available_cpus()
+            if self.decomposition == 'circle':
+                limit = min(limit, num_circles)
+            workers = max(1, min(workers, limit))
+        if circles_per_task is None:
+            circles_per_task = int(np.ceil(num_circles /
+                                           (TASKS_PER_WORKER*workers)))
+            if query_seconds > 0:
+                circles_per_task = min(
+                    circles_per_task,
+                    int(np.ceil(TASK_SECONDS/query_seconds)))
+        return workers, circles_per_task
+
+    def circle_tasks(self, handle, x_centers, circles_per_task=1):
+        """Return the list of worker tasks, with a batch of circles each.
+
+        :param handle: SharedField.handle of the field
+        :param x_centers: x-coordinates of the search circles
+        :param int circles_per_task: Number of circles per task
+        :return: List of goldhunt_shared.scan_circles arguments
+        """
+        centers = [(float(x_ref), self.y_ref) for x_ref in x_centers]
+        return [(handle, centers[start:start + circles_per_task],
+                 self.search_radius)
+                for start in range(0, len(centers), circles_per_task)]
+
+    def map_tasks(self, function, tasks, workers, key=None):
+        """Return function(task) for all the tasks, run by the workers.
+
+        With a single worker, the tasks are run in the calling thread, so
+        no worker is started.
+
+        :param function: Module level function (it must be picklable)
+        :param tasks: List of the arguments of function
+        :param int workers: Number of workers
+        :param key: Key of the field in the executor (see shared_key), if
+           it is registered there
+        :return: List of the results, in the order of the tasks
+        """
+        if self.executor is not None:
+            return self.executor.map(function, tasks, key)
+        if workers == 1:
+            return [function(task) for task in tasks]
+        if self.parallel_backend == 'thread':
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(function, tasks))
+        pool = multiprocessing.Pool(processes=workers)
+        try:
+            # The tasks are batches already.
+            return pool.map(function, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _process_circles(self, x_list, y_list, x_centers, workers,
+                         circles_per_task):
+        """Scan the circles with a process pool sharing the field."""
+        key = self.shared_key(x_list, y_list)
+        if key is not None:
+            handle = self.executor.add_field(key, x_list, y_list)
+            results = self.map_tasks(
+                scan_circles,
+                self.circle_tasks(handle, x_centers, circles_per_task),
+                workers, key)
+            return [coin_ids for batch in results for coin_ids in batch]
+        # The workers of an executor detach this field at the end of each
+        # task, as it is not registered.
+        with SharedField(x_list, y_list) as field:
+            results = self.map_tasks(
+                scan_circles,
+                self.circle_tasks(field.handle, x_centers, circles_per_task),
+                workers)
+            # Only attached here if the tasks ran in this process.
+            detach_field(field.handle[0])
+        return [coin_ids for batch in results for coin_ids in batch]
+
+    def _thread_circles(self, x_list, y_list, x_centers, workers,
+                        circles_per_task):
+        """Scan the circles with a thread pool sharing the field.
+
+        The field is stacked once. Each thread has its own ScanContext
+        over it, as the scratch buffers can't be shared by the threads.
+        """
+        points = np.column_stack((x_list, y_list)).astype(
+            coordinate_dtype(x_list, y_list), copy=False)
+        local = threading.local()
+
+        def scan(batch):
+            if not hasattr(local, 'context'):
+                local.context = ScanContext.from_points(points)
+            return [local.context.query(x_ref, self.y_ref,
+                                        self.search_radius)
+                    for x_ref in batch]
+
+        batches = [x_centers[start:start + circles_per_task]
+                   for start in range(0, len(x_centers), circles_per_task)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return [coin_ids for batch in executor.map(scan, batches)
+                    for coin_ids in batch]
+
+    def _slab_circles(self, x_list, y_list, x_centers, workers,
+                      circles_per_task):
+        """Scan the field with one worker per slab and merge the results.
+
+        For worker processes, each slab is placed in its own SharedField.
+        Worker threads are given the slab arrays directly. A slab is tested
+        against the circles that overlap its bounding box only. A slab is
+        one task, so circles_per_task is not used.
+        """
+        x_list = np.asarray(x_list)
+        y_list = np.asarray(y_list)
+        x_centers = np.asarray(x_centers, dtype=float)
+        # A small margin, so that a circle is never missed because of a
+        # rounding error (of a float32 field).
+        reach = 1.001*self.search_radius
+        slab_start, order = partition_slabs(x_list, workers)
+        threads = self.parallel_backend == 'thread'
+
+        def scan_arrays(task):
+            (x_slab, y_slab), centers, radius = task
+            context = ScanContext(x_slab, y_slab)
+            return [context.query(x_ref, y_ref, radius)
+                    for x_ref, y_ref in centers]
+
+        slabs = []
+        with contextlib.ExitStack() as stack:
+            tasks = []
+            for k in range(workers):
+                coin_ids = order[slab_start[k]:slab_start[k + 1]]
+                if coin_ids.size == 0:
+                    continue
+                if threads:
+                    x_slab, y_slab = x_list[coin_ids], y_list[coin_ids]
+                    slab = (x_slab, y_slab)
+                else:
+                    field = stack.enter_context(SharedField(
+                        x_list[coin_ids], y_list[coin_ids]))
+                    x_slab, y_slab = field.x_list, field.y_list
+                    slab = field.handle
+                near = np.flatnonzero(
+                    (x_centers + reach >= x_slab.min()) &
+                    (x_centers - reach <= x_slab.max()) &
+                    (self.y_ref + reach >= y_slab.min()) &
+                    (self.y_ref - reach <= y_slab.max()))
+                if near.size:
+                    slabs.append((coin_ids, near))
+                    tasks.append((slab,
+                                  [(x_centers[c], self.y_ref)
+                                   for c in near.tolist()],
+                                  self.search_radius))
+            # A shared block can't be closed while a view refers to it.
+            x_slab = y_slab = None
+            results = self.map_tasks(scan_arrays if threads else scan_slab,
+                                     tasks, workers)
+
+        # Reduce: the coins of a circle are collected from all its slabs.
+        parts = [[] for x_ref in x_centers]
+        for (coin_ids, near), positions in zip(slabs, results):
+            for c, slab_positions in zip(near.tolist(), positions):
+                parts[c].append(coin_ids[slab_positions])
+        return [np.sort(np.concatenate(part)) if part
+                else np.empty(0, dtype=np.intp) for part in parts]
+
+    def search_result(self, x_list, y_list, x_centers):
+        """Return the coins inside the search circles as a HuntResult.
+
+        The 'scan' backend is searched by the workers of the
+        parallel_backend, split according to the decomposition. The
+        number of workers and the task size are picked by plan.
+
+        :param x_list: NumPy array of x coordinates of all the coins
+        :param y_list: NumPy array of y coordinates of all the coins
+        :param x_centers: x-coordinates of the search circles
+        :return: A HuntResult instance with the field attached
+        """
+        if self.query_backend != 'scan':
+            return super().search_result(x_list, y_list, x_centers)
+        if self.decomposition == 'slab':
+            searcher = self._slab_circles
+        else:
+            searcher = getattr(self,
+                               self.parallel_backends[self.parallel_backend])
+        workers, circles_per_task = self.plan(x_list, y_list, x_centers)
+        if (workers == 1 and self.decomposition == 'circle' and
+                self.executor is None):
+            # The serial scan of pass-7, without any worker overhead.
+            return super().search_result(x_list, y_list, x_centers)
+        return HuntResult.from_circles(
+            searcher(x_list, y_list, x_centers, workers, circles_per_task),
+            x_list, y_list)
+
+
+# Functions for profiling the code.
+def view_stats(fil, text_restriction):
+    """View the pstats for the given file
+
+    :param fil: The file name for printing the stats.
+    :param text_restriction: UNUSED variable to define filter on the output
+
+    .. todo:: Cleanup the unused text_restriction variable or implement it!
+    """
+    stats = pstats.Stats(fil)
+    # Remove the long directory paths
+    stats.strip_dirs()
+    # Sort the stats by the total time (internal time)
+    sorted_stats = stats.sort_stats('tottime')
+    # Only show stats that have "goldhunt" in their 'name column'
+    sorted_stats.print_stats("goldhunt")
+
+
+def play_game():
+    """Control function to execute the GoldHunt game"""
+    # IMPORTANT: The choice of input suggested below can consume a lot of
+    # computational resources on your machine. See what your computer can
+    # handle first by choosing a smaller size for field_coins and a LARGER
+    # search_radius!
+    game = GoldHunt(field_coins=2000000, search_radius=0.1)
+    game.play()
+
+if __name__ == '__main__':
+    filname = 'profile_output_new'
+    cProfile.run('play_game()', filname)
+    # View the pstats
+    view_stats(filname, "goldhunt")
@@ -0,0 +1,172 @@
+"""goldhunt_results
+
+This module contains the HuntResult class, a compact container for the
+coins collected by a Gold Hunt.
+
+The earlier optimization passes return a Python list of (x, y) tuples for
+every search circle. In goldhunt_pass6_parallel.py these lists are pickled
+back from each worker process and flattened with itertools.chain. For
+millions of collected coins this costs a lot of memory and time. A
+HuntResult stores only integer index arrays into the gold field. The
+coordinates are looked up only when they are asked for, and results are
+merged with np.concatenate.
+
+This module is compatible with Python 3.5.x. It contains
+supporting code for the book, Learning Python Application Development,
+Packt Publishing.
+
+:copyright: 2016, Ninad Sathaye
+
+:license: The MIT License (MIT) . See LICENSE file for further details.
+"""
+from __future__ import print_function
+import numpy as np
+
+
+def index_dtype(num_coins):
+    """Return the smallest NumPy integer type that can index num_coins."""
+    if num_coins <= np.iinfo(np.int32).max:
+        return np.int32
+    return np.int64
+
+
+class HuntResult:
+    """Coins collected in each search circle, as indices into the field.
+
+    The coins of all the circles are stored in one array (coin_ids), in the
+    circle order. The coins of the circle k are
+    coin_ids[circle_start[k]:circle_start[k+1]]. This is the same layout as
+    returned by goldhunt_index.assign_to_circles.
+
+    The field arrays (x_list, y_list) are optional. They are needed only to
+    get the coordinates and are never pickled with the result, so a worker
+    process sends back just the index arrays.
+
+    :ivar coin_ids: Integer NumPy array of the collected coin indices
+    :ivar circle_start: Integer NumPy array of num_circles + 1 offsets
+    :ivar x_list: NumPy array of x coordinates of the field (or None)
+    :ivar y_list: NumPy array of y coordinates of the field (or None)
+    """
+    def __init__(self, coin_ids, circle_start, x_list=None, y_list=None):
+        num_coins = len(x_list) if x_list is not None else None
+        if num_coins is None:
+            dtype = np.asarray(coin_ids).dtype
+            if not np.issubdtype(dtype, np.integer):
+                dtype = np.intp
+        else:
+            dtype = index_dtype(num_coins)
+        self.coin_ids = np.asarray(coin_ids, dtype=dtype)
+        self.circle_start = np.asarray(circle_start, dtype=np.int64)
+        self.x_list = x_list
+        self.y_list = y_list
+
+    @classmethod
+    def from_circles(cls, coins_per_circle, x_list=None, y_list=None):
+        """Create a HuntResult from a list of coin index arrays per circle.
+
+        :param coins_per_circle: List with one coin index array per circle
+        :param x_list: Optional NumPy array of x coordinates of the field
+        :param y_list: Optional NumPy array of y coordinates of the field
+        :return: A HuntResult instance
+        """
+        counts = [len(coin_ids) for coin_ids in coins_per_circle]
+        circle_start = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=circle_start[1:])
+        if coins_per_circle:
+            coin_ids = np.concatenate(coins_per_circle)
+        else:
+            coin_ids = np.empty(0, dtype=np.intp)
+        return cls(coin_ids, circle_start, x_list, y_list)
+
+    @classmethod
+    def concatenate(cls, results):
+        """Merge several results (e.g. from different workers) into one.
+
+        The circles of the results are appended in the given order. The
+        field of the first result (if any) is kept.
+
+        :param results: Sequence of HuntResult instances
+        :return: A new HuntResult instance
+        """
+        results = list(results)
+        if not results:
+            return cls(np.empty(0, dtype=np.intp), [0])
+        offsets = np.cumsum([0] + [r.circle_start[-1] for r in results[:-1]])
+        circle_start = np.concatenate(
+            [[0]] + [r.circle_start[1:] + offset
+                     for r, offset in zip(results, offsets)])
+        coin_ids = np.concatenate([r.coin_ids for r in results])
+        return cls(coin_ids, circle_start, results[0].x_list,
+                   results[0].y_list)
+
+    def __getstate__(self):
+        """Leave the field arrays out when the result is pickled."""
+        state = self.__dict__.copy()
+        state['x_list'] = state['y_list'] = None
+        return state
+
+    def __len__(self):
+        """Return the total number of coins collected in all the circles."""
+        return int(self.circle_start[-1])
+
+    @property
+    def num_circles(self):
+        """Number of search circles in this result."""
+        return len(self.circle_start) - 1
+
+    def counts(self):
+        """Return a NumPy array with the number of coins of each circle."""
+        return np.diff(self.circle_start)
+
+    def circle(self, k):
+        """Return the coin indices collected in the circle number k."""
+        return self.coin_ids[self.circle_start[k]:self.circle_start[k + 1]]
+
+    def attach_field(self, x_list, y_list):
+        """Set the field arrays used to look up the coordinates."""
+        self.x_list = x_list
+        self.y_list = y_list
+        return self
+
+    def coordinates(self, k=None):
+        """Return the x, y coordinates of the collected coins.
+
+        :param k: Circle number. If None, the coins of all the circles are
+           returned.
+        :return: A tuple of two NumPy arrays (x, y)
+        """
+        if self.x_list is None:
+            raise ValueError("The field is not attached to this result. "
+                             "Call attach_field first.")
+        coin_ids = self.coin_ids if k is None else self.circle(k)
+        return self.x_list[coin_ids], self.y_list[coin_ids]
+
+    def as_tuples(self, k=None):
+        """Return the collected coins as a list of (x, y) tuples.
+
+        This is the output format of GoldHunt.find_coins in the earlier
+        optimization passes. Avoid it for large results.
+        """
+        x_coins, y_coins = self.coordinates(k)
+        return list(zip(x_coins.tolist(), y_coins.tolist()))
+
+    def remap(self, order):
+        """Return the result with the coin indices translated by order.
+
+        Use this for a result found on a reordered field (see
+        goldhunt_order.reorder_field). The coin i of the reordered field is
+        the coin order[i] of the original one. The coins of each circle are
+        sorted again, as the searches return them in the field order.
+
+        :param order: Integer NumPy array, the permutation of the field
+        :return: A new HuntResult instance (without the field arrays)
+        """
+        coin_ids = np.asarray(order)[self.coin_ids]
+        circle_ids = np.repeat(np.arange(self.num_circles), self.counts())
+        coin_ids = coin_ids[np.lexsort((coin_ids, circle_ids))]
+        return HuntResult(coin_ids.astype(self.coin_ids.dtype),
+                          self.circle_start.copy())
+
+    def unique_coins(self):
+        """Return the sorted indices of the distinct coins collected."""
+        return np.unique(self.coin_ids)
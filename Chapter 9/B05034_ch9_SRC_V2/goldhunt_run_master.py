@@ -3,7 +3,8 @@
 This is an optional module that will allow you to run a particular
 optimization pass.
 
-This module is compatible with Python 3.5.x. It contains
+This module is compatible with Python 3.5.x. The 7th pass requires NumPy
+1.17 or later and the 8th pass Python 3.8 or later. It contains
 supporting code for the book, Learning Python Application Development,
 Packt Publishing.
 
@@ -12,7 +13,10 @@ RUNNING THE PROGRAM
 
         $ python goldhunt_run_master.py
 
-Then specify the choice between 0 to 6. (NO ERROR CHECKING IS DONE!)
+Then specify the choice between 0 to 8. (NO ERROR CHECKING IS DONE!)
+
+The 7th and the 8th pass reuse the gold field of the previous runs. It is
+cached on the disk by goldhunt_cache.FieldCache (in the temporary directory).
 
 - See the README file for more information. Or visit python.org for OS
 specific instructions on executing Python from a command prompt.
@@ -33,6 +37,8 @@ from goldhunt_pass3 import GoldHunt as GoldHunt3
 from goldhunt_pass4 import GoldHunt as GoldHunt4
 from goldhunt_pass5 import GoldHunt as GoldHunt5
 from goldhunt_pass6_parallel import GoldHunt as GoldHunt6
+from goldhunt_pass7_indexed import GoldHunt as GoldHunt7
+from goldhunt_cache import FieldCache
 
 
 
@@ -55,8 +61,18 @@ def view_stats(fil, text_restriction):
 
 def play_game(num_string):
     """Control function to execute the GoldHunt game"""
-    GoldHunt_class = getattr(sys.modules[__name__], "GoldHunt%s"%num_string)
-    game = GoldHunt_class(field_coins=2000000, search_radius=0.1)
+    if str(num_string) == '8':
+        # Imported only when selected: pass-8 needs Python 3.8 or later
+        # (multiprocessing.shared_memory).
+        from goldhunt_pass8_parallel import GoldHunt as GoldHunt_class
+    else:
+        GoldHunt_class = getattr(sys.modules[__name__],
+                                 "GoldHunt%s"%num_string)
+    if issubclass(GoldHunt_class, GoldHunt7):
+        game = GoldHunt_class(field_coins=2000000, search_radius=0.1,
+                              seed=0, field_cache=FieldCache())
+    else:
+        game = GoldHunt_class(field_coins=2000000, search_radius=0.1)
     game.play()
 
 
@@ -0,0 +1,184 @@
+"""goldhunt_shared
+
+This module contains the SharedField class, a gold field stored in a
+shared memory block, and the functions run by the worker processes of
+goldhunt_pass8_parallel.py.
+
+In goldhunt_pass6_parallel.py every task given to the process pool is
+find_coins(x_list, y_list, x_ref, num). The two complete coordinate arrays
+(and the GoldHunt instance) are pickled, sent through a pipe and unpickled
+for each and every search circle. With 2 million coins that is 32 MB per
+task, and the interprocess communication takes longer than the search.
+
+A SharedField copies the coins once into a
+multiprocessing.shared_memory.SharedMemory block. A task then only carries
+the handle of the block (its name, the number of coins and the dtype) and
+the circle parameters, a few dozen bytes. A worker attaches to the block
+the first time it sees the handle and wraps it with np.ndarray, so the
+coordinates are never copied. The attached field (and its scratch buffers,
+see goldhunt_index.ScanContext) is kept for the later tasks of the worker.
+
+With the domain decomposition of pass-8, each worker is given its own
+slab of the field instead (see scan_slab). The slab is a SharedField of
+its own, so a worker only maps (and allocates scratch buffers for) its
+share of the coins.
+
+This module requires Python 3.8 or later (multiprocessing.shared_memory).
+It contains supporting code for the book, Learning Python Application
+Development, Packt Publishing.
+
+:copyright: 2016, Ninad Sathaye
+
+:license: The MIT License (MIT) . See LICENSE file for further details.
+"""
+from __future__ import print_function
+import collections
+from multiprocessing import shared_memory
+import numpy as np
+
+from goldhunt_field import field_dtype
+from goldhunt_index import ScanContext
+from goldhunt_results import index_dtype
+
+# Fields attached by this process: shared memory block name ->
+# (SharedMemory, ScanContext), the most recently used last. See
+# attach_field.
+_attached = collections.OrderedDict()
+
+
+class SharedField:
+    """Gold field stored in a shared memory block.
+
+    The coins are stored as one (N, 2) array of (x, y) pairs, the layout
+    used by goldhunt_index.ScanContext. The block is created by the
+    constructor and must be released with close (or by using the instance
+    as a context manager) once the workers are done with it.
+
+    :ivar shm: multiprocessing.shared_memory.SharedMemory instance
+    :ivar points: NumPy array of shape (N, 2), a view of the block
+    :ivar x_list: NumPy array of x coordinates (a view of points)
+    :ivar y_list: NumPy array of y coordinates (a view of points)
+    """
+    def __init__(self, x_list, y_list, dtype=None):
+        if len(x_list) != len(y_list):
+            raise ValueError("x_list and y_list must have the same length")
+        if dtype is None:
+            dtype = np.result_type(x_list, y_list)
+        dtype = field_dtype(dtype)
+        num_coins = len(x_list)
+        # A block can't be empty, even for a field without coins.
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=max(2*num_coins*dtype.itemsize, 1))
+        self.points = np.ndarray((num_coins, 2), dtype=dtype,
+                                 buffer=self.shm.buf)
+        self.points[:, 0] = x_list
+        self.points[:, 1] = y_list
+        self.x_list = self.points[:, 0]
+        self.y_list = self.points[:, 1]
+
+    @property
+    def handle(self):
+        """Picklable (name, number of coins, dtype) tuple for attach_field."""
+        return self.shm.name, len(self.points), self.points.dtype.str
+
+    def close(self):
+        """Release and destroy the shared memory block."""
+        if self.shm is None:
+            return
+        # The block can only be closed once no array refers to it.
+        self.points = self.x_list = self.y_list = None
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            # Already destroyed, e.g. by the resource tracker of a worker
+            # process that exited.
+            pass
+        self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def attach_field(handle):
+    """Return a ScanContext over a shared field, attaching it if needed.
+
+    The block is attached only once per process. The field is not copied,
+    only the scratch buffers of the ScanContext are allocated.
+
+    :param handle: SharedField.handle of the field
+    :return: A goldhunt_index.ScanContext instance
+    """
+    name, num_coins, dtype = handle
+    if name in _attached:
+        _attached.move_to_end(name)
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+        points = np.ndarray((num_coins, 2), dtype=np.dtype(dtype),
+                            buffer=shm.buf)
+        _attached[name] = (shm, ScanContext.from_points(points))
+    return _attached[name][1]
+
+
+def detach_field(name):
+    """Release this process's mapping of a shared field (if attached)."""
+    shm, context = _attached.pop(name, (None, None))
+    if shm is not None:
+        del context
+        shm.close()
+
+
+def trim_fields(max_fields, keep=None):
+    """Detach the fields not in keep and the least recently used ones.
+
+    :param int max_fields: Number of fields that may stay attached
+    :param keep: Optional collection of the names of the fields that may
+       stay attached. The others are detached.
+    :return: List of the names of the detached fields
+    """
+    names = [] if keep is None else [name for name in _attached
+                                     if name not in keep]
+    kept = [name for name in _attached if name not in names]
+    names.extend(kept[:max(len(kept) - max_fields, 0)])
+    for name in names:
+        detach_field(name)
+    return names
+
+
+def scan_circles(task):
+    """Return the indices of the coins of a shared field inside circles.
+
+    This is the function run by the worker processes, one call per task.
+    A task holds a batch of circles, so the cost of sending a task and its
+    result is shared by all of them.
+
+    :param task: Tuple (handle, centers, radius). handle is the
+       SharedField.handle of the field and centers a list of the (x, y)
+       centers of the circles.
+    :return: A list with one sorted NumPy array of coin indices per circle
+    """
+    handle, centers, radius = task
+    context = attach_field(handle)
+    dtype = index_dtype(handle[1])
+    return [context.query(x_ref, y_ref, radius).astype(dtype, copy=False)
+            for x_ref, y_ref in centers]
+
+
+def scan_slab(task):
+    """Return the coins of a shared slab of the field inside each circle.
+
+    This is the function run by the workers of the domain decomposition,
+    one call per slab. Same as scan_circles, but the coin indices are
+    positions in the slab. A slab is scanned by only one task, so it is
+    detached again at the end.
+
+    :param task: Tuple (handle, centers, radius), the SharedField.handle
+       of the slab and the centers of the circles that intersect it
+    :return: A list with one sorted NumPy array of positions per circle
+    """
+    positions = scan_circles(task)
+    detach_field(task[0][0])
+    return positions
@@ -0,0 +1,276 @@
+"""test.test_goldhunt_field
+
+This module contains unit tests for the creation and the storage of the
+gold field (goldhunt_field.py and goldhunt_cache.py).
+
+This module is compatible with Python 3.5.x and requires NumPy 1.17 or
+later. It contains supporting code for the book, Learning Python
+Application Development, Packt Publishing.
+
+:copyright: 2016, Ninad Sathaye
+
+:license: The MIT License (MIT) . See LICENSE file for further details.
+"""
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+import unittest
+import warnings
+from unittest import mock
+
+# Add the top level chapter directory to sys.path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             ".."))
+import numpy as np
+
+import goldhunt_field
+from goldhunt_cache import FieldCache
+from goldhunt_field import generate_random_points, generate_random_chunks
+from goldhunt_field import generate_random_points_inplace
+from goldhunt_field import generate_seeded_points, spawn_generators
+from goldhunt_io import save_field, load_field, load_result
+from goldhunt_io import convert_csv, read_csv_chunks
+from goldhunt_pass7_indexed import GoldHunt
+
+
+class TestGoldHuntField(unittest.TestCase):
+    """Contains unit tests for the gold field creation and caching."""
+    def setUp(self):
+        """Overrides the setUp fixture of the superclass.
+
+        Creates an empty temporary directory for the field cache.
+        """
+        self.cache_dir = tempfile.mkdtemp(prefix='goldhunt_test_')
+        self.cache = FieldCache(self.cache_dir, verify=True)
+
+    def tearDown(self):
+        """Overrides the tearDown fixture of the superclass."""
+        shutil.rmtree(self.cache_dir)
+
+    def test_inplace_generation(self):
+        """The low peak memory mode should create the same field"""
+        for dtype in (np.float64, np.float32):
+            np.random.seed(2)
+            expected_x, expected_y = generate_random_points(10.0, 10001, dtype)
+            np.random.seed(2)
+            x_list, y_list = generate_random_points(10.0, 10001, dtype,
+                                                    block_size=1000)
+            self.assertEqual(x_list.dtype, dtype)
+            np.testing.assert_array_equal(x_list, expected_x)
+            np.testing.assert_array_equal(y_list, expected_y)
+
+    def test_inplace_generation_peak_memory(self):
+        """The peak memory should stay under 1.2 times the output size"""
+        num_coins = 2000000
+        for dtype in (np.float64, np.float32):
+            tracemalloc.start()
+            try:
+                x_list, y_list = generate_random_points_inplace(
+                    10.0, num_coins, dtype)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            output_bytes = x_list.nbytes + y_list.nbytes
+            self.assertLess(peak, 1.2*output_bytes)
+
+    @mock.patch.object(goldhunt_field, 'SEEDED_CHUNK_SIZE', 1000)
+    def test_seeded_points(self):
+        """A seeded field should not depend on the number of processes"""
+        for dtype in (np.float64, np.float32):
+            x_list, y_list = generate_seeded_points(4, 10.0, 5500, dtype)
+            self.assertEqual(x_list.dtype, dtype)
+            self.assertTrue(np.all(np.hypot(x_list, y_list) <= 10.0))
+            for processes in (2, 3):
+                x_other, y_other = generate_seeded_points(
+                    4, 10.0, 5500, dtype, processes=processes)
+                np.testing.assert_array_equal(x_other, x_list)
+                np.testing.assert_array_equal(y_other, y_list)
+            chunks = list(generate_random_chunks(10.0, 5500, 700, dtype,
+                                                 seed=4))
+            self.assertEqual([x.size for x, y in chunks], [700]*7 + [600])
+            np.testing.assert_array_equal(
+                np.concatenate([y for x, y in chunks]), y_list)
+        # The float32 field is the rounded float64 field.
+        x_64, y_64 = generate_seeded_points(4, 10.0, 5500)
+        np.testing.assert_array_equal(x_list, x_64.astype(np.float32))
+        np.testing.assert_array_equal(y_list, y_64.astype(np.float32))
+        x_other, y_other = generate_seeded_points(5, 10.0, 5500, np.float32)
+        self.assertFalse(np.array_equal(x_other[:1000], x_list[:1000]))
+        first, second = spawn_generators(4, 2)
+        self.assertFalse(np.array_equal(first.random(10), second.random(10)))
+
+    def test_field_cache_roundtrip(self):
+        """A cached field should be reopened as a memmap with the same data"""
+        for dtype in (np.float64, np.float32):
+            expected_x, expected_y = generate_seeded_points(5, 10.0, 1000,
+                                                            dtype)
+            x_list, y_list = self.cache.get(5, 1000, 10.0, dtype)
+            self.assertIsInstance(x_list, np.memmap)
+            self.assertEqual(x_list.dtype, dtype)
+            np.testing.assert_array_equal(x_list, expected_x)
+            np.testing.assert_array_equal(y_list, expected_y)
+            # The second time, the field must come from the cache.
+            x_list, y_list = self.cache.get(5, 1000, 10.0, dtype)
+            np.testing.assert_array_equal(x_list, expected_x)
+        self.assertEqual(len(self.cache.entries()), 2)
+
+    def test_field_cache_integrity(self):
+        """A corrupted or truncated cache entry should be discarded"""
+        x_list, y_list = self.cache.get(1, 1000, 10.0)
+        expected = np.array(x_list)
+        del x_list, y_list
+        data_path = os.path.join(self.cache_dir,
+                                 FieldCache.key(1, 1000, 10.0, np.float64) +
+                                 '.bin')
+        with open(data_path, 'r+b') as fil:
+            fil.seek(100)
+            fil.write(b'\x00'*8)
+        self.assertIsNone(self.cache.load(1, 1000, 10.0))
+        self.assertFalse(os.path.exists(data_path))
+
+        self.cache.get(1, 1000, 10.0)
+        with open(data_path, 'r+b') as fil:
+            fil.truncate(800)
+        self.assertIsNone(self.cache.load(1, 1000, 10.0))
+        x_list, y_list = self.cache.get(1, 1000, 10.0)
+        np.testing.assert_array_equal(x_list, expected)
+
+    def test_field_cache_eviction(self):
+        """The least recently used fields should be evicted first"""
+        # Each field takes 16000 bytes. There is room for two of them.
+        cache = FieldCache(self.cache_dir, max_bytes=40000)
+        cache.get(1, 1000, 10.0)
+        cache.get(2, 1000, 10.0)
+        first = os.path.join(self.cache_dir,
+                             FieldCache.key(1, 1000, 10.0, np.float64))
+        os.utime(first + '.json', (0, 0))
+        cache.get(3, 1000, 10.0)
+        keys = sorted(key for last_used, nbytes, key in cache.entries())
+        self.assertEqual(keys, [FieldCache.key(seed, 1000, 10.0, np.float64)
+                                for seed in (2, 3)])
+
+    def test_field_cache_concurrent_writers(self):
+        """Concurrent writers and deletions shouldn't break the cache"""
+        key = FieldCache.key(1, 1000, 10.0, np.float64)
+        # Each writer gets its own temporary files.
+        first = self.cache._temp_file(key, '.bin')
+        second = self.cache._temp_file(key, '.bin')
+        self.assertNotEqual(first, second)
+        os.remove(first)
+        os.remove(second)
+        x_list, y_list = generate_seeded_points(1, 10.0, 1000)
+        for _ in range(2):
+            self.cache.store(1, 1000, 10.0, x_list, y_list)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)),
+                         [key + '.bin', key + '.json'])
+        # An entry deleted by another process after the listing is skipped.
+        listing = os.listdir(self.cache_dir) + ['gone.json']
+        with mock.patch('goldhunt_cache.os.listdir', return_value=listing):
+            self.assertEqual([entry[2] for entry in self.cache.entries()],
+                             [key])
+            self.cache.clear()
+            self.cache.clear()
+        self.assertEqual(os.listdir(self.cache_dir), [])
+        # A data file still waiting for its metadata is kept for a while.
+        data_path = os.path.join(self.cache_dir, key + '.bin')
+        with open(data_path, 'wb') as fil:
+            fil.write(b'0'*16000)
+        self.assertIsNone(self.cache.load(1, 1000, 10.0))
+        self.assertTrue(os.path.exists(data_path))
+        os.utime(data_path, (0, 0))
+        self.assertIsNone(self.cache.load(1, 1000, 10.0))
+        self.assertFalse(os.path.exists(data_path))
+        # A field evicted by another process right after it is stored.
+        with mock.patch.object(FieldCache, 'load', return_value=None):
+            x_other, y_other = self.cache.get(1, 1000, 10.0)
+        np.testing.assert_array_equal(x_other, x_list)
+        np.testing.assert_array_equal(y_other, y_list)
+
+    def test_game_with_field_cache(self):
+        """GoldHunt should collect the same coins from a cached field"""
+        game = GoldHunt(field_coins=5000, query_backend='assign', seed=8,
+                        field_cache=self.cache)
+        x_list, y_list = game.make_field()
+        expected = GoldHunt(field_coins=5000, seed=8).make_field()
+        np.testing.assert_array_equal(x_list, expected[0])
+        result = game.search_result(x_list, y_list, game.circle_centers())
+        self.assertEqual(len(result), len(game.search_result(
+            expected[0], expected[1], game.circle_centers())))
+        with self.assertRaises(ValueError):
+            GoldHunt(field_cache=self.cache)
+
+    def test_field_file(self):
+        """A field file should be loaded back as views of the file"""
+        path = os.path.join(self.cache_dir, 'field.ghf')
+        for dtype in (np.float64, np.float32):
+            x_list, y_list = generate_seeded_points(6, 10.0, 1001, dtype)
+            save_field(path, x_list, y_list, 10.0)
+            x_loaded, y_loaded, field_radius = load_field(path)
+            self.assertEqual(x_loaded.dtype, dtype)
+            self.assertFalse(x_loaded.flags.writeable)
+            np.testing.assert_array_equal(x_loaded, x_list)
+            np.testing.assert_array_equal(y_loaded, y_list)
+            self.assertEqual(field_radius, 10.0)
+            del x_loaded, y_loaded
+        with open(path, 'r+b') as fil:
+            fil.truncate(1000)
+        with self.assertRaises(ValueError):
+            load_field(path)
+
+    def test_result_file(self):
+        """GoldHunt should save its result and read the field from a file"""
+        field_path = os.path.join(self.cache_dir, 'field.ghf')
+        result_path = os.path.join(self.cache_dir, 'result.ghr')
+        x_list, y_list = generate_seeded_points(6, 10.0, 5000)
+        save_field(field_path, x_list, y_list)
+        game = GoldHunt(field_coins=5000, query_backend='assign',
+                        field_file=field_path, result_file=result_path)
+        game.play()
+        result, centers = load_result(result_path)
+        expected = game.search_result(x_list, y_list, game.circle_centers())
+        np.testing.assert_array_equal(result.circle_start,
+                                      expected.circle_start)
+        np.testing.assert_array_equal(result.coin_ids, expected.coin_ids)
+        np.testing.assert_array_equal(centers[:, 0], game.circle_centers())
+        with self.assertRaises(ValueError):
+            load_field(result_path)
+
+    def test_csv_import(self):
+        """A CSV file should be imported in chunks"""
+        csv_path = os.path.join(self.cache_dir, 'coins.csv')
+        field_path = os.path.join(self.cache_dir, 'coins.ghf')
+        x_list, y_list = generate_seeded_points(6, 10.0, 2500)
+        with open(csv_path, 'w') as fil:
+            fil.write("id,x,y\n")
+            for i, (x, y) in enumerate(zip(x_list.tolist(), y_list.tolist())):
+                fil.write("{0},{1!r},{2!r}\n".format(i, x, y))
+            # The last chunk of 1000 lines is blank.
+            fil.write("\n"*1500)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            chunks = list(read_csv_chunks(csv_path, chunk_rows=1000,
+                                          columns=(1, 2), skip_rows=1))
+        self.assertEqual([x.size for x, y in chunks], [1000, 1000, 500])
+        num_coins = convert_csv(csv_path, field_path, 10.0, chunk_rows=700,
+                                columns=(1, 2), skip_rows=1)
+        self.assertEqual(num_coins, 2500)
+        x_loaded, y_loaded, field_radius = load_field(field_path)
+        np.testing.assert_array_equal(x_loaded, x_list)
+        np.testing.assert_array_equal(y_loaded, y_list)
+        # A file that fails to parse leaves no (partial) field file.
+        with open(csv_path, 'a') as fil:
+            fil.write("2500,not a number,0.0\n")
+        del x_loaded, y_loaded
+        os.remove(field_path)
+        with self.assertRaises(ValueError):
+            convert_csv(csv_path, field_path, chunk_rows=700,
+                        columns=(1, 2), skip_rows=1)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ['coins.csv'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,442 @@
+"""test.test_goldhunt_index
+
+This module contains unit tests for the spatial index classes in
+goldhunt_index.py and the query backends of goldhunt_pass7_indexed.py.
+
+This module is compatible with Python 3.5.x and requires NumPy 1.15 or
+later. It contains supporting code for the book, Learning Python
+Application Development, Packt Publishing.
+
+:copyright: 2016, Ninad Sathaye
+
+:license: The MIT License (MIT) . See LICENSE file for further details.
+"""
+
+from __future__ import print_function
+import os
+import pickle
+import sys
+import unittest
+
+# Add the top level chapter directory to sys.path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             ".."))
+import numpy as np
+
+from goldhunt_index import ScanIndex, ScanContext, GridIndex, BandIndex
+from goldhunt_index import QuadTree, PolarIndex, SummedAreaTable, KDTree
+from goldhunt_index import concatenate_ranges, assign_to_circles, query_many
+from goldhunt_index import radius_counts, partition_slabs
+from goldhunt_pass7_indexed import GoldHunt, generate_random_points
+from goldhunt_pass7_indexed import generate_random_polar_points, path_centers
+from goldhunt_results import HuntResult
+from goldhunt_field import generate_random_chunks
+from goldhunt_dynamic import DynamicField
+from goldhunt_order import morton_codes, hilbert_codes, reorder_field
+
+
+class TestGoldHuntIndex(unittest.TestCase):
+    """Contains unit tests for the Gold Hunt spatial indices."""
+    def setUp(self):
+        """Overrides the setUp fixture of the superclass.
+
+        Creates a small gold field and a few search circles (some of these
+        lie partly or completely outside the field).
+        """
+        np.random.seed(7)
+        self.x_list, self.y_list = generate_random_points(10.0, 20000)
+        self.circles = [(-9.0, 0.0, 1.0), (0.0, 0.0, 0.1), (9.95, 0.0, 0.3),
+                        (3.3, -4.1, 2.5), (25.0, 25.0, 1.0), (0.0, 0.0, 0.0)]
+        self.scan = ScanIndex(self.x_list, self.y_list)
+
+    def assert_same_as_scan(self, index):
+        """Verify that index.query gives the brute force result."""
+        for x_ref, y_ref, radius in self.circles:
+            expected = self.scan.query(x_ref, y_ref, radius)
+            result = index.query(x_ref, y_ref, radius)
+            np.testing.assert_array_equal(result, expected)
+
+    def test_concatenate_ranges(self):
+        """concatenate_ranges should match a loop over np.arange"""
+        starts, stops = [3, 10, 10, 20], [6, 10, 12, 21]
+        expected = np.concatenate([np.arange(s, e)
+                                   for s, e in zip(starts, stops)])
+        np.testing.assert_array_equal(concatenate_ranges(starts, stops),
+                                      expected)
+
+    def test_scan_context(self):
+        """ScanContext should reuse its buffers and match ScanIndex"""
+        context = ScanContext(self.x_list, self.y_list)
+        buffers = (context.diff, context.distance_squares, context.inside)
+        self.assert_same_as_scan(context)
+        for before, after in zip(buffers, (context.diff,
+                                           context.distance_squares,
+                                           context.inside)):
+            self.assertIs(after, before)
+        x_32 = self.x_list.astype(np.float32)
+        y_32 = self.y_list.astype(np.float32)
+        self.assertEqual(ScanContext(x_32, y_32).diff.dtype, np.float32)
+
+    def test_grid_index(self):
+        """GridIndex.query should return the same coins as a full scan"""
+        for cell_size in (0.1, 1.0, 7.5):
+            self.assert_same_as_scan(GridIndex(self.x_list, self.y_list,
+                                               cell_size))
+
+    def test_grid_index_empty_field(self):
+        """GridIndex should work with an empty gold field"""
+        empty = np.empty(0)
+        index = GridIndex(empty, empty, 1.0)
+        self.assertEqual(index.query(0.0, 0.0, 1.0).size, 0)
+
+    def test_band_index(self):
+        """BandIndex.query should return the same coins as a full scan"""
+        self.assert_same_as_scan(BandIndex(self.x_list, self.y_list))
+
+    def test_quadtree(self):
+        """QuadTree query and count should agree with a full scan"""
+        for leaf_size in (1, 64, 100000):
+            tree = QuadTree(self.x_list, self.y_list, leaf_size)
+            self.assert_same_as_scan(tree)
+            for x_ref, y_ref, radius in self.circles:
+                self.assertEqual(tree.count(x_ref, y_ref, radius),
+                                 self.scan.query(x_ref, y_ref, radius).size)
+
+    def test_quadtree_duplicate_points(self):
+        """QuadTree should stop splitting nodes with identical coins"""
+        tree = QuadTree(np.ones(100), np.ones(100), leaf_size=4)
+        self.assertEqual(tree.count(1.0, 1.0, 0.5), 100)
+
+    def test_polar_index(self):
+        """PolarIndex built from theta, radius should match a full scan"""
+        np.random.seed(7)
+        theta, radius = generate_random_polar_points(10.0, 20000)
+        # Circles near the field boundary and across the theta = 0 line
+        self.circles += [(9.8, 0.0, 0.2), (9.0, -0.05, 0.5),
+                         (0.0, -9.9, 0.1), (-7.0, 7.0, 0.3)]
+        for rings, sectors in ((1, 1), (16, 64), (100, 629)):
+            self.assert_same_as_scan(PolarIndex(theta, radius, rings,
+                                                sectors))
+            self.assert_same_as_scan(PolarIndex.from_xy(
+                self.x_list, self.y_list, rings, sectors))
+
+    def test_summed_area_table_rect_count(self):
+        """SummedAreaTable.rect_count should match the 2D histogram"""
+        table = SummedAreaTable(self.x_list, self.y_list, resolution=16)
+        self.assertEqual(table.rect_count(0, 16, 0, 16), self.x_list.size)
+        rows = ((self.y_list - table.y_min)//table.cell_size).astype(int)
+        cols = ((self.x_list - table.x_min)//table.cell_size).astype(int)
+        expected = np.count_nonzero((rows >= 3) & (rows < 7) &
+                                    (cols >= 2) & (cols < 9))
+        self.assertEqual(table.rect_count(3, 7, 2, 9), expected)
+
+    def test_summed_area_table_bounds(self):
+        """The exact circle counts should lie within the reported bounds"""
+        centers = [(x_ref, y_ref) for x_ref, y_ref, radius in self.circles]
+        radii = [radius for x_ref, y_ref, radius in self.circles]
+        exact = np.array([self.scan.query(x_ref, y_ref, radius).size
+                          for x_ref, y_ref, radius in self.circles])
+        for resolution in (1, 32, 1024):
+            table = SummedAreaTable(self.x_list, self.y_list, resolution)
+            estimate, lower, upper = table.count_many(centers, radii)
+            self.assertTrue(np.all(lower <= exact))
+            self.assertTrue(np.all(exact <= upper))
+            self.assertTrue(np.all((lower <= estimate) &
+                                   (estimate <= upper)))
+
+    def test_kdtree_query(self):
+        """KDTree.query should return the same coins as a full scan"""
+        for leaf_size in (1, 32, 100000):
+            self.assert_same_as_scan(KDTree(self.x_list, self.y_list,
+                                            leaf_size))
+
+    def test_kdtree_nearest(self):
+        """KDTree.nearest should match sorting all the coin distances"""
+        tree = KDTree(self.x_list, self.y_list, leaf_size=8)
+        centers = [(0.0, 0.0), (-9.5, 3.0), (30.0, -30.0)]
+        coin_ids, distances = tree.nearest(centers, k=7)
+        self.assertEqual(coin_ids.shape, (3, 7))
+        for m, (x_ref, y_ref) in enumerate(centers):
+            all_distances = np.hypot(self.x_list - x_ref,
+                                     self.y_list - y_ref)
+            np.testing.assert_array_equal(coin_ids[m],
+                                          np.argsort(all_distances)[:7])
+            np.testing.assert_allclose(distances[m],
+                                       np.sort(all_distances)[:7])
+
+    def test_kdtree_nearest_more_than_field(self):
+        """KDTree.nearest should limit k to the number of coins"""
+        tree = KDTree([1.0, 2.0], [0.0, 0.0])
+        coin_ids, distances = tree.nearest([(0.0, 0.0)], k=5)
+        np.testing.assert_array_equal(coin_ids, [[0, 1]])
+        np.testing.assert_allclose(distances, [[1.0, 2.0]])
+        with self.assertRaises(ValueError):
+            tree.nearest([(0.0, 0.0)], k=-1)
+
+    def test_assign_to_circles(self):
+        """assign_to_circles should match a full scan of every circle"""
+        for radius in (0.1, 0.7, 1.0):
+            game = GoldHunt(search_radius=radius)
+            x_centers = game.circle_centers()
+            circle_start, coin_ids = assign_to_circles(
+                self.x_list, self.y_list, x_centers, 0.0, radius)
+            for k, x_ref in enumerate(x_centers):
+                np.testing.assert_array_equal(
+                    coin_ids[circle_start[k]:circle_start[k + 1]],
+                    self.scan.query(x_ref, 0.0, radius))
+
+    def test_assign_to_overlapping_circles(self):
+        """assign_to_circles should reject overlapping circles"""
+        with self.assertRaises(ValueError):
+            assign_to_circles(self.x_list, self.y_list, [0.0, 1.0, 2.0],
+                              0.0, 1.0)
+
+    def test_partition_slabs(self):
+        """The slabs should hold about as many coins, ordered along x"""
+        slab_start, coin_ids = partition_slabs(self.x_list, 4)
+        np.testing.assert_array_equal(np.sort(coin_ids),
+                                      np.arange(self.x_list.size))
+        np.testing.assert_allclose(np.diff(slab_start), 5000, atol=1)
+        slabs = [coin_ids[slab_start[k]:slab_start[k + 1]] for k in range(4)]
+        for left, right in zip(slabs[:-1], slabs[1:]):
+            self.assertLessEqual(self.x_list[left].max(),
+                                 self.x_list[right].min())
+        for slab in slabs:
+            self.assertTrue(np.all(np.diff(slab) > 0))
+        slab_start, coin_ids = partition_slabs(np.empty(0), 3)
+        np.testing.assert_array_equal(slab_start, [0, 0, 0, 0])
+        with self.assertRaises(ValueError):
+            partition_slabs(self.x_list, 0)
+
+    def test_query_many(self):
+        """query_many should match a full scan for any block size"""
+        centers = [(x_ref, y_ref) for x_ref, y_ref, radius in self.circles]
+        radii = [radius for x_ref, y_ref, radius in self.circles]
+        for block_bytes in (1, 1000, 10**6, 10**9):
+            circle_start, coin_ids = query_many(self.x_list, self.y_list,
+                                                centers, radii, block_bytes)
+            for k, (x_ref, y_ref, radius) in enumerate(self.circles):
+                np.testing.assert_array_equal(
+                    coin_ids[circle_start[k]:circle_start[k + 1]],
+                    self.scan.query(x_ref, y_ref, radius))
+
+    def test_radius_counts(self):
+        """radius_counts should match a full scan for every radius"""
+        centers = [(0.0, 0.0), (-9.0, 0.0), (5.0, 5.0)]
+        radii = [0.0, 0.1, 0.5, 2.0, 30.0]
+        counts = radius_counts(self.x_list, self.y_list, centers, radii)
+        for m, (x_ref, y_ref) in enumerate(centers):
+            for j, radius in enumerate(radii):
+                self.assertEqual(counts[m, j],
+                                 self.scan.query(x_ref, y_ref, radius).size)
+
+    def test_radius_sweep(self):
+        """radius_sweep should match a separate hunt for each radius"""
+        radii = [0.05, 0.1, 0.3, 1.0]
+        totals, counts_per_circle = GoldHunt().radius_sweep(
+            self.x_list, self.y_list, radii)
+        for j, radius in enumerate(radii):
+            game = GoldHunt(search_radius=radius, query_backend='scan')
+            coins_per_circle = game.search_circles(self.x_list, self.y_list,
+                                                   game.circle_centers())
+            np.testing.assert_array_equal(
+                counts_per_circle[j],
+                [coin_ids.size for coin_ids in coins_per_circle])
+            self.assertEqual(totals[j], sum(counts_per_circle[j]))
+        # A radius of 0 would never move the circles along the X axis.
+        for bad_radii in ([0.1, 0.0], [-0.5], [float('nan')]):
+            with self.assertRaises(ValueError):
+                GoldHunt().radius_sweep(self.x_list, self.y_list, bad_radii)
+        with self.assertRaises(ValueError):
+            GoldHunt().circle_centers(0.0)
+
+    def test_backends_find_same_coins(self):
+        """All the query backends of GoldHunt should collect the same coins"""
+        collected = []
+        backends = set(GoldHunt.query_backends) | set(GoldHunt.hunt_backends)
+        for backend in sorted(backends):
+            game = GoldHunt(field_coins=20000, search_radius=0.5,
+                            query_backend=backend)
+            coins_per_circle = game.search_circles(self.x_list, self.y_list,
+                                                   game.circle_centers())
+            collected.append(np.concatenate(coins_per_circle))
+            self.assertEqual(len(game.find_coins(self.x_list, self.y_list)),
+                             coins_per_circle[0].size)
+        for coin_ids in collected[1:]:
+            np.testing.assert_array_equal(coin_ids, collected[0])
+
+    def test_hunt_result(self):
+        """HuntResult should hold the same coins as search_circles"""
+        for backend in ('assign', 'grid'):
+            game = GoldHunt(search_radius=0.5, query_backend=backend)
+            x_centers = game.circle_centers()
+            coins_per_circle = game.search_circles(self.x_list, self.y_list,
+                                                   x_centers)
+            result = game.search_result(self.x_list, self.y_list, x_centers)
+            self.assertEqual(result.num_circles, len(x_centers))
+            self.assertEqual(result.coin_ids.dtype, np.int32)
+            for k, coin_ids in enumerate(coins_per_circle):
+                np.testing.assert_array_equal(result.circle(k), coin_ids)
+            self.assertEqual(result.as_tuples(0),
+                             game.find_coins(self.x_list, self.y_list))
+
+        # Merging and pickling keep only the index arrays.
+        halves = [game.search_result(self.x_list, self.y_list, centers)
+                  for centers in (x_centers[:5], x_centers[5:])]
+        merged = HuntResult.concatenate(halves)
+        np.testing.assert_array_equal(merged.circle_start,
+                                      result.circle_start)
+        np.testing.assert_array_equal(merged.coin_ids, result.coin_ids)
+        restored = pickle.loads(pickle.dumps(merged))
+        self.assertIsNone(restored.x_list)
+        with self.assertRaises(ValueError):
+            restored.coordinates()
+        x_coins, y_coins = restored.attach_field(
+            self.x_list, self.y_list).coordinates(3)
+        np.testing.assert_array_equal(x_coins,
+                                      self.x_list[coins_per_circle[3]])
+
+    def test_float32_field(self):
+        """A float32 field should only differ for the coins on a boundary"""
+        np.random.seed(11)
+        x_64, y_64 = generate_random_points(10.0, 20000)
+        np.random.seed(11)
+        x_32, y_32 = generate_random_points(10.0, 20000, np.float32)
+        self.assertEqual(x_32.dtype, np.float32)
+        self.assertEqual(y_32.dtype, np.float32)
+        np.testing.assert_allclose(x_32, x_64, atol=1e-5)
+        # A coin may switch sides only if it is this close to a boundary.
+        tolerance = 1e-5
+        for backend in ('assign', 'grid', 'scan'):
+            game = GoldHunt(search_radius=0.5, query_backend=backend)
+            x_centers = game.circle_centers()
+            result_64 = game.search_circles(x_64, y_64, x_centers)
+            result_32 = game.search_circles(x_32, y_32, x_centers)
+            for x_ref, ids_64, ids_32 in zip(x_centers, result_64, result_32):
+                changed = np.setxor1d(ids_64, ids_32)
+                distances = np.hypot(x_64[changed] - x_ref,
+                                     y_64[changed] - game.y_ref)
+                self.assertTrue(np.all(np.abs(distances - 0.5) < tolerance))
+            coins = game.find_coins(x_32, y_32)
+            self.assertEqual(len(coins), result_32[0].size)
+
+    def test_stream_counts(self):
+        """Streaming the field in chunks should give the same coin counts"""
+        np.random.seed(3)
+        chunks = list(generate_random_chunks(10.0, 20000, 3000))
+        self.assertEqual([x_list.size for x_list, y_list in chunks],
+                         [3000]*6 + [2000])
+        x_list = np.concatenate([chunk[0] for chunk in chunks])
+        y_list = np.concatenate([chunk[1] for chunk in chunks])
+        centers = path_centers([(-9.0, 0.0), (0.0, 6.0)], 0.4)
+        for backend in ('assign', 'grid'):
+            game = GoldHunt(search_radius=0.5, query_backend=backend)
+            x_centers = game.circle_centers()
+            expected = game.search_result(x_list, y_list, x_centers).counts()
+            np.testing.assert_array_equal(
+                game.stream_counts(iter(chunks), x_centers), expected)
+        new_coins_per_circle, collected = game.hunt_path(x_list, y_list,
+                                                         centers)
+        np.testing.assert_array_equal(
+            game.stream_counts(iter(chunks), centers=centers),
+            [new_coins.size for new_coins in new_coins_per_circle])
+
+    def test_dynamic_field(self):
+        """A DynamicField should return every coin only once"""
+        rng = np.random.RandomState(1)
+        circles = np.column_stack((rng.uniform(-10, 10, 60),
+                                   rng.uniform(-10, 10, 60)))
+        builders = (lambda x, y: GridIndex(x, y, 0.7), BandIndex, KDTree)
+        for builder in builders:
+            field = DynamicField(self.x_list, self.y_list, builder,
+                                 compact_ratio=0.1)
+            taken = np.zeros(self.x_list.size, dtype=bool)
+            for x_ref, y_ref in circles.tolist():
+                expected = self.scan.query(x_ref, y_ref, 2.0)
+                expected = expected[~taken[expected]]
+                np.testing.assert_array_equal(
+                    field.query(x_ref, y_ref, 2.0), expected)
+                np.testing.assert_array_equal(
+                    field.collect(x_ref, y_ref, 2.0), expected)
+                taken[expected] = True
+            np.testing.assert_array_equal(field.taken, taken)
+            self.assertEqual(len(field), self.x_list.size - taken.sum())
+            self.assertGreater(field.num_compactions, 3)
+            self.assertLess(field.x_list.size, self.x_list.size)
+
+    def test_curve_codes(self):
+        """The curve codes should number the cells of the grid in order"""
+        cols, rows = np.meshgrid(np.arange(16.0), np.arange(16.0))
+        cols, rows = cols.ravel(), rows.ravel()
+        for codes in (morton_codes(cols, rows, 4),
+                      hilbert_codes(cols, rows, 4)):
+            np.testing.assert_array_equal(np.sort(codes), np.arange(256))
+        np.testing.assert_array_equal(
+            morton_codes([0.0, 1.0, 0.0, 1.0, 2.0, 3.0],
+                         [0.0, 0.0, 1.0, 1.0, 0.0, 3.0], 2),
+            [0, 1, 2, 3, 4, 15])
+        # Two successive cells of the Hilbert curve are neighbours.
+        order = np.argsort(hilbert_codes(cols, rows, 4))
+        steps = (np.abs(np.diff(cols[order])) +
+                 np.abs(np.diff(rows[order])))
+        np.testing.assert_array_equal(steps, 1)
+
+    def test_spatial_order(self):
+        """A reordered field should give the same coins, once remapped"""
+        for curve in ('morton', 'hilbert'):
+            x_sorted, y_sorted, order = reorder_field(self.x_list,
+                                                      self.y_list, curve)
+            np.testing.assert_array_equal(x_sorted, self.x_list[order])
+            np.testing.assert_array_equal(np.sort(order),
+                                          np.arange(self.x_list.size))
+            for backend in ('assign', 'grid', 'band', 'kdtree'):
+                game = GoldHunt(search_radius=0.5, query_backend=backend)
+                x_centers = game.circle_centers()
+                expected = game.search_result(self.x_list, self.y_list,
+                                              x_centers)
+                result = game.search_result(x_sorted, y_sorted,
+                                            x_centers).remap(order)
+                np.testing.assert_array_equal(result.circle_start,
+                                              expected.circle_start)
+                np.testing.assert_array_equal(result.coin_ids,
+                                              expected.coin_ids)
+        with self.assertRaises(ValueError):
+            GoldHunt(spatial_order='peano')
+
+    def test_path_centers(self):
+        """path_centers should place the circles at equal walked distances"""
+        centers = path_centers([(0.0, 0.0), (3.0, 0.0), (3.0, 4.0)], 1.0)
+        self.assertEqual(len(centers), 8)
+        np.testing.assert_allclose(centers[[0, 3, 5, 7]],
+                                   [(0.0, 0.0), (3.0, 0.0), (3.0, 2.0),
+                                    (3.0, 4.0)])
+
+    def test_hunt_path_collects_each_coin_once(self):
+        """Overlapping circles of a path should not collect a coin twice"""
+        centers = path_centers([(-9.0, 0.0), (0.0, 6.0), (9.0, -3.0)], 0.2)
+        expected = np.zeros(self.x_list.size, dtype=bool)
+        for x_ref, y_ref in centers:
+            expected[self.scan.query(x_ref, y_ref, 1.0)] = True
+        for backend in ('scan', 'grid', 'kdtree', 'batched'):
+            game = GoldHunt(search_radius=1.0, query_backend=backend)
+            new_coins_per_circle, collected = game.hunt_path(
+                self.x_list, self.y_list, centers)
+            np.testing.assert_array_equal(collected, expected)
+            all_new_coins = np.concatenate(new_coins_per_circle)
+            self.assertEqual(all_new_coins.size, np.unique(all_new_coins).size)
+            self.assertEqual(all_new_coins.size, np.count_nonzero(expected))
+
+    def test_hunt_path_assign_backend(self):
+        """The 'assign' backend should refuse arbitrary hunt paths"""
+        game = GoldHunt(query_backend='assign')
+        with self.assertRaises(ValueError):
+            game.hunt_path(self.x_list, self.y_list, [(0.0, 0.0)])
+
+    def test_unknown_backend(self):
+        """An unknown query backend name should raise ValueError"""
+        with self.assertRaises(ValueError):
+            GoldHunt(query_backend='no_such_backend')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,315 @@
+"""test.test_goldhunt_parallel
+
+This module contains unit tests for the parallel Gold Hunt
+(goldhunt_pass8_parallel.py, goldhunt_shared.py and goldhunt_executor.py).
+
+This module requires Python 3.9 or later. It contains
+supporting code for the book, Learning Python Application Development,
+Packt Publishing.
+
+:copyright: 2016, Ninad Sathaye
+
+:license: The MIT License (MIT) . See LICENSE file for further details.
+"""
+
+from __future__ import print_function
+import os
+import pickle
+import signal
+import sys
+import time
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+# Add the top level chapter directory to sys.path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             ".."))
+import numpy as np
+
+import goldhunt_pass8_parallel
+from goldhunt_field import generate_random_chunks, generate_seeded_points
+from goldhunt_pass7_indexed import GoldHunt as GoldHunt7
+from goldhunt_pass8_parallel import GoldHunt
+from goldhunt_shared import SharedField, attach_field, detach_field
+from goldhunt_shared import scan_circles, trim_fields
+import goldhunt_executor
+from goldhunt_executor import HuntExecutor
+
+
+class TestGoldHuntParallel(unittest.TestCase):
+    """Contains unit tests for the parallel search of the circles."""
+    def setUp(self):
+        """Overrides the setUp fixture of the superclass.
+
+        Creates a small gold field and the expected (serial) result.
+        """
+        self.x_list, self.y_list = generate_seeded_points(3, 10.0, 20000)
+        self.game7 = GoldHunt7(search_radius=0.5, query_backend='scan')
+        self.x_centers = self.game7.circle_centers()
+        self.expected = self.game7.search_result(self.x_list, self.y_list,
+                                                 self.x_centers)
+
+    def assert_same_result(self, result, expected=None):
+        """Verify that result holds the coins of the serial search."""
+        expected = self.expected if expected is None else expected
+        np.testing.assert_array_equal(result.circle_start,
+                                      expected.circle_start)
+        np.testing.assert_array_equal(result.coin_ids, expected.coin_ids)
+
+    def test_shared_field(self):
+        """A shared field should be attached without copying the coins"""
+        with SharedField(self.x_list, self.y_list) as field:
+            np.testing.assert_array_equal(field.x_list, self.x_list)
+            np.testing.assert_array_equal(field.y_list, self.y_list)
+            handle = field.handle
+            self.assertLess(len(pickle.dumps(handle)), 100)
+            context = attach_field(handle)
+            self.assertIs(attach_field(handle), context)
+            field.points[0] = (0.25, 0.5)
+            np.testing.assert_array_equal(context.points[0], (0.25, 0.5))
+            coin_ids, = scan_circles((handle, [(0.25, 0.5)], 0.0))
+            self.assertIn(0, coin_ids.tolist())
+            del context
+            detach_field(handle[0])
+        field.close()
+        # Only the most recently used fields are kept attached.
+        with SharedField(self.x_list, self.y_list) as first, \
+                SharedField(self.y_list, self.x_list) as second:
+            attach_field(first.handle)
+            attach_field(second.handle)
+            attach_field(first.handle)
+            self.assertEqual(trim_fields(1), [second.handle[0]])
+            self.assertEqual(trim_fields(0), [first.handle[0]])
+            # The fields not kept are detached whatever their use.
+            attach_field(first.handle)
+            attach_field(second.handle)
+            self.assertEqual(trim_fields(2, keep={second.handle[0]}),
+                             [first.handle[0]])
+            self.assertEqual(trim_fields(2, keep=set()), [second.handle[0]])
+        # A block already destroyed (by another process) is closed quietly.
+        field = SharedField(self.x_list, self.y_list)
+        field.shm.unlink()
+        field.close()
+        with SharedField(np.empty(0), np.empty(0)) as field:
+            self.assertEqual(len(scan_circles((field.handle, [(0.0, 0.0)],
+                                               1.0))[0]), 0)
+
+    def test_process_backend(self):
+        """The worker processes should find the same coins"""
+        for workers in (1, 2):
+            game = GoldHunt(search_radius=0.5, workers=workers)
+            self.assert_same_result(game.search_result(
+                self.x_list, self.y_list, self.x_centers))
+        x_list = self.x_list.astype(np.float32)
+        y_list = self.y_list.astype(np.float32)
+        result = GoldHunt(search_radius=0.5).search_result(x_list, y_list,
+                                                           self.x_centers)
+        self.assert_same_result(result, self.game7.search_result(
+            x_list, y_list, self.x_centers))
+        # The other backends are searched in the main process.
+        game = GoldHunt(search_radius=0.5, query_backend='grid')
+        self.assert_same_result(game.search_result(
+            self.x_list, self.y_list, self.x_centers))
+        with self.assertRaises(ValueError):
+            GoldHunt(workers=0)
+
+    def test_thread_backend(self):
+        """The worker threads should find the same coins"""
+        for workers in (1, 3):
+            game = GoldHunt(search_radius=0.5, parallel_backend='thread',
+                            workers=workers)
+            self.assert_same_result(game.search_result(
+                self.x_list, self.y_list, self.x_centers))
+        with self.assertRaises(ValueError):
+            GoldHunt(parallel_backend='fiber')
+
+    def test_slab_decomposition(self):
+        """The workers owning the slabs should find the same coins"""
+        for backend in ('process', 'thread'):
+            for workers in (1, 3, 40):
+                game = GoldHunt(search_radius=0.5, parallel_backend=backend,
+                                workers=workers, decomposition='slab')
+                self.assert_same_result(game.search_result(
+                    self.x_list, self.y_list, self.x_centers))
+        # A float32 field, and circles partly outside the field.
+        game = GoldHunt(search_radius=2.5, workers=4, decomposition='slab')
+        x_list = self.x_list.astype(np.float32)
+        y_list = self.y_list.astype(np.float32)
+        x_centers = np.linspace(-12.0, 12.0, 7)
+        self.game7.search_radius = 2.5
+        self.assert_same_result(
+            game.search_result(x_list, y_list, x_centers),
+            self.game7.search_result(x_list, y_list, x_centers))
+        # The threads scan the slabs without any shared memory block.
+        game = GoldHunt(search_radius=0.5, parallel_backend='thread',
+                        workers=3, decomposition='slab')
+        with mock.patch.object(goldhunt_pass8_parallel, 'SharedField',
+                               side_effect=AssertionError):
+            self.assert_same_result(game.search_result(
+                self.x_list, self.y_list, self.x_centers))
+        with self.assertRaises(ValueError):
+            GoldHunt(decomposition='block')
+
+    @mock.patch.object(goldhunt_pass8_parallel, 'available_cpus',
+                       return_value=8)
+    def test_plan(self, available_cpus):
+        """The workers and the task size should follow the calibration"""
+        game = GoldHunt(search_radius=0.5)
+        num_circles = len(self.x_centers)
+        # A small field is not worth starting any worker.
+        self.assertEqual(game.plan(self.x_list, self.y_list,
+                                   self.x_centers)[0], 1)
+        with mock.patch.object(GoldHunt, 'calibrate', return_value=1.0):
+            self.assertEqual(game.plan(self.x_list, self.y_list,
+                                       self.x_centers), (8, 1))
+            self.assertEqual(game.plan(self.x_list, self.y_list,
+                                       self.x_centers[:3]), (3, 1))
+            game.decomposition = 'slab'
+            self.assertEqual(game.plan(self.x_list, self.y_list,
+                                       self.x_centers[:3]), (8, 1))
+        with mock.patch.object(GoldHunt, 'calibrate', return_value=1e-4):
+            game = GoldHunt(search_radius=0.5, workers=2)
+            self.assertEqual(game.plan(self.x_list, self.y_list,
+                                       self.x_centers),
+                             (2, -(-num_circles//8)))
+        game = GoldHunt(workers=3, circles_per_task=5)
+        with mock.patch.object(GoldHunt, 'calibrate') as calibrate:
+            self.assertEqual(game.plan(self.x_list, self.y_list,
+                                       self.x_centers), (3, 5))
+            self.assertFalse(calibrate.called)
+        self.assertGreater(game.calibrate(self.x_list, self.y_list,
+                                          self.x_centers), 0.0)
+        with self.assertRaises(ValueError):
+            GoldHunt(circles_per_task=0)
+
+    def test_executor(self):
+        """A warm executor should run hunts on its registered fields"""
+        with HuntExecutor(workers=2, max_fields=2) as executor:
+            handle = executor.add_field('field', self.x_list, self.y_list)
+            self.assertEqual(executor.add_field('field', None, None), handle)
+            for circles_per_task in (1, 7):
+                result = executor.hunt('field', self.x_centers,
+                                       search_radius=0.5,
+                                       circles_per_task=circles_per_task)
+                self.assert_same_result(result)
+            executor.add_field('other', self.y_list, self.x_list)
+            job = executor.submit('other', self.x_centers, search_radius=0.5)
+            self.assert_same_result(job.result(timeout=10),
+                                    self.game7.search_result(
+                                        self.y_list, self.x_list,
+                                        self.x_centers))
+            self.assertTrue(job.done())
+            executor.remove_field('other')
+            health = executor.health()
+            self.assertTrue(health['responsive'])
+            self.assertEqual(health['fields'], 1)
+            self.assertEqual(health['submitted'], health['completed'])
+            self.assertEqual(health['failed'], 0)
+
+            # A seeded game registers its own field only once.
+            game = GoldHunt(search_radius=0.5, seed=3, field_coins=20000,
+                            executor=executor)
+            x_list, y_list, order = game.game_field()
+            for _ in range(2):
+                self.assert_same_result(game.search_result(
+                    x_list, y_list, self.x_centers))
+            self.assertEqual(len(executor.fields), 2)
+            # Other arrays, even with the same coins, aren't registered.
+            self.assert_same_result(game.search_result(
+                self.x_list, self.y_list, self.x_centers))
+            game.seed = None
+            self.assert_same_result(game.search_result(
+                x_list, y_list, self.x_centers))
+            self.assertEqual(len(executor.fields), 2)
+            # Only max_fields fields are registered, the least recently
+            # used one is destroyed.
+            executor.hunt('field', self.x_centers[:1])
+            executor.add_field('other', self.y_list, self.x_list)
+            self.assertEqual(list(executor.fields), ['field', 'other'])
+        health = executor.health()
+        self.assertFalse(health['responsive'])
+        self.assertIsNone(health['uptime'])
+        self.assertEqual(health['fields'], 0)
+        with self.assertRaises(ValueError):
+            GoldHunt(parallel_backend='thread', executor=executor)
+
+    def test_executor_stream_counts(self):
+        """Each chunk of a streamed field should be scanned by the executor"""
+        game7 = GoldHunt7(search_radius=0.5, seed=3, field_coins=20000,
+                          chunk_size=5000)
+        x_centers = game7.circle_centers()
+        chunks = list(generate_random_chunks(10.0, 20000, 5000, seed=3))
+        expected = game7.stream_counts(iter(chunks), x_centers)
+        with HuntExecutor(workers=2) as executor:
+            game = GoldHunt(search_radius=0.5, seed=3, field_coins=20000,
+                            chunk_size=5000, executor=executor)
+            np.testing.assert_array_equal(
+                game.stream_counts(iter(chunks), x_centers), expected)
+            self.assertEqual(len(executor.fields), 0)
+
+    def test_executor_restart(self):
+        """A dead worker should be reported and replaced"""
+        with HuntExecutor(workers=2) as executor:
+            executor.add_field('field', self.x_list, self.y_list)
+            pids = executor.warm_up()
+            self.assertEqual(len(pids), 2)
+            os.kill(pids[0], signal.SIGKILL)
+            for _ in range(100):
+                if not executor.health(timeout=0.5)['responsive']:
+                    break
+                time.sleep(0.05)
+            self.assertFalse(executor.health()['responsive'])
+            # The next job restarts the pool.
+            self.assert_same_result(executor.hunt(
+                'field', self.x_centers, search_radius=0.5))
+            health = executor.health()
+            self.assertTrue(health['responsive'])
+            self.assertEqual(health['restarts'], 1)
+            executor.restart()
+            self.assertNotIn(pids[1], executor.warm_up())
+            self.assertEqual(executor.restarts, 2)
+            # The registered field survives the exit of the old workers.
+            self.assert_same_result(executor.hunt(
+                'field', self.x_centers, search_radius=0.5))
+
+    def test_executor_restart_hung_worker(self):
+        """A restart should stop the old workers, even a hung one"""
+        with HuntExecutor(workers=2) as executor:
+            executor.add_field('field', self.x_list, self.y_list)
+            hung = [executor._submit(goldhunt_executor._ping, 30.0)
+                    for _ in range(2)]
+            old_processes = executor._processes()
+            self.assertEqual(len(old_processes), 2)
+            time.sleep(0.2)
+            # The busy workers are alive, but the ping waits in the queue.
+            health = executor.health(timeout=0.1)
+            self.assertFalse(health['responsive'])
+            self.assertEqual(health['alive'], 2)
+            start = time.monotonic()
+            executor.restart()
+            self.assertLess(time.monotonic() - start, 10.0)
+            for process in old_processes:
+                self.assertFalse(process.is_alive())
+            for future in hung:
+                self.assertIsInstance(future.exception(timeout=10),
+                                      BrokenProcessPool)
+            self.assert_same_result(executor.hunt(
+                'field', self.x_centers, search_radius=0.5))
+            self.assertEqual(executor.health()['alive'], 2)
+
+    def test_batched_tasks(self):
+        """Batches of circles per task should give the same coins"""
+        for backend in ('process', 'thread'):
+            for circles_per_task in (1, 4, 100):
+                game = GoldHunt(search_radius=0.5, parallel_backend=backend,
+                                workers=2, circles_per_task=circles_per_task)
+                self.assert_same_result(game.search_result(
+                    self.x_list, self.y_list, self.x_centers))
+        # The automatic plan runs the small field in this process.
+        self.assert_same_result(GoldHunt(search_radius=0.5).search_result(
+            self.x_list, self.y_list, self.x_centers))
+
+
+if __name__ == '__main__':
+    unittest.main()